@@ -0,0 +1,318 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+import data_cleaning
+import verification
+
+# Per-bin sufficient statistics kept for every cell (see verification.bin_statistics).
+STATS = ('count', 'sum_prob', 'succ', 'sq_err')
+
+# Bump whenever the on-disk layout below changes.
+SCHEMA_VERSION = 1
+
+
+def _save_column(arrays, name, values):
+    """Store a numeric column as is and any other column as text plus a missing-value mask."""
+    values = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(values) and not isinstance(values.dtype, pd.CategoricalDtype):
+        arrays[name] = values.to_numpy()
+    else:
+        arrays[f'{name}/null'] = values.isna().to_numpy()
+        arrays[f'{name}/str'] = values.astype(object).fillna('').astype(str).to_numpy(dtype=str)
+
+
+def _load_column(arrays, name):
+    if name in arrays:
+        return arrays[name]
+    values = arrays[f'{name}/str'].astype(object)
+    values[arrays[f'{name}/null']] = np.nan
+    return values
+
+
+class BinAccumulator:
+    """
+    Mergeable per-bin sufficient statistics of forecasts, per group and feature.
+
+    For every (group keys, feature) cell the accumulator holds, per reliability bin, the
+    number of forecasts, the sum of the forecasts, the number of successes and the sum
+    of squared errors. These sums are all that verification.metrics_from_stats needs,
+    so accumulators of separate releases or chunks can be added (or subtracted) and then
+    scored at any coarser grouping without the underlying rows.
+
+        acc = BinAccumulator.from_frame(df_npd, by=['year', 'result NPD play'])
+        acc.metrics(by=['period', 'result NPD play'], years=[1990, 2006, 2023])
+
+    Parameters:
+        keys (DataFrame): One row per cell with the grouping columns and 'feature'.
+        stats (dict): Arrays 'count', 'sum_prob', 'succ' and 'sq_err' of shape
+            (len(keys), bins_num + 1).
+        bins_num (int): Number of regular bins.
+        width (float): Bin width (default: 1 / bins_num).
+    """
+
+    def __init__(self, keys, stats, bins_num=10, width=None):
+        self.keys = keys.reset_index(drop=True)
+        self.keys['feature'] = pd.Categorical(self.keys['feature'], categories=list(verification.FEATURES))
+        self.stats = {name: np.asarray(stats[name], dtype=float) for name in STATS}
+        self.bins_num = bins_num
+        self.width = width
+
+    @property
+    def by(self):
+        return [c for c in self.keys.columns if c != 'feature']
+
+    @classmethod
+    def from_frame(cls, df, by=('year',), features=None, bins_num=10, width=None):
+        """
+        Accumulate the forecasts of a reshaped frame.
+
+        Parameters:
+            df (DataFrame): Reshaped frame (optionally mapped with map_npd).
+            by (list): Grouping columns; keep them fine (e.g. 'year' rather than 'period')
+                so that the accumulator can be scored at any coarser grouping.
+            features (list): Features to accumulate (default: all of verification.FEATURES).
+            bins_num (int): Number of regular bins.
+            width (float): Bin width (default: 1 / bins_num).
+
+        Returns:
+            BinAccumulator: Statistics of the non-empty cells.
+        """
+        by = list(by)
+        features = list(verification.FEATURES) if features is None else list(features)
+        codes, index = verification.group_codes(df, by)
+        probs, outcomes, cells = verification.stacked_forecasts(df, codes, features)
+        stats = verification.bin_statistics(probs, outcomes, cells, len(index) * len(features), bins_num, width)
+
+        keys = index.to_frame(index=False) if by else pd.DataFrame(index=range(1))
+        keys = keys.iloc[np.repeat(np.arange(len(keys)), len(features))].reset_index(drop=True)
+        keys['feature'] = np.tile(features, len(index))
+        filled = stats['count'].sum(axis=1) > 0
+        return cls(keys[filled], {name: stats[name][filled] for name in STATS}, bins_num, width)
+
+    def _combine(self, others, signs):
+        for other in others:
+            if (other.by, other.bins_num, other.width) != (self.by, self.bins_num, self.width):
+                raise ValueError('Accumulators must share grouping columns and bins to be combined')
+        parts = [self] + list(others)
+        keys = pd.concat([p.keys.astype({'feature': str}) for p in parts], ignore_index=True)
+        codes, index = verification.group_codes(keys, self.by + ['feature'])
+        merged = {}
+        for name in STATS:
+            values = np.concatenate([sign * p.stats[name] for p, sign in zip(parts, [1] + list(signs))])
+            merged[name] = np.zeros((len(index), self.bins_num + 1))
+            np.add.at(merged[name], codes, values)
+        return BinAccumulator(index.to_frame(index=False), merged, self.bins_num, self.width)
+
+    def merge(self, *others):
+        """Return the sum of this accumulator and others (cells are aligned by key)."""
+        return self._combine(others, [1] * len(others))
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    def __sub__(self, other):
+        return self._combine([other], [-1])
+
+    def metrics(self, by=None, years=None):
+        """
+        Score the accumulated cells, optionally at a coarser grouping.
+
+        Parameters:
+            by (list): Grouping columns among the accumulator's, where 'period' groups
+                'year' into the periods defined by years (default: the accumulator's own).
+            years (list): Period edges, required when grouping by 'period'.
+
+        Returns:
+            DataFrame: Same layout as verification.metrics_table.
+        """
+        by = self.by if by is None else list(by)
+        # Group on the feature position so features keep the metrics_table order.
+        keys = self.keys.assign(feature=self.keys['feature'].cat.codes)
+        codes, index = verification.group_codes(keys, by + ['feature'], years)
+        valid = codes >= 0
+        stats = {}
+        for name in STATS:
+            stats[name] = np.zeros((len(index), self.bins_num + 1))
+            np.add.at(stats[name], codes[valid], self.stats[name][valid])
+        measures = verification.metrics_from_stats(**stats)
+        table = index.to_frame(index=False)
+        table['feature'] = self.keys['feature'].cat.categories[table['feature']]
+        for name, values in measures.items():
+            table[name] = values
+        return table[table['n'] > 0].reset_index(drop=True)
+
+    def to_arrays(self, prefix=''):
+        """Return the accumulator as a dict of plain arrays (see save)."""
+        arrays = {f'{prefix}meta': np.array(json.dumps({
+            'schema': SCHEMA_VERSION, 'by': self.by, 'bins_num': self.bins_num, 'width': self.width}))}
+        for column in self.keys.columns:
+            _save_column(arrays, f'{prefix}key/{column}', self.keys[column])
+        for name in STATS:
+            arrays[f'{prefix}stat/{name}'] = self.stats[name]
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix=''):
+        meta = json.loads(str(arrays[f'{prefix}meta']))
+        if meta['schema'] != SCHEMA_VERSION:
+            raise ValueError(f"Unsupported accumulator schema {meta['schema']}")
+        keys = pd.DataFrame({c: _load_column(arrays, f'{prefix}key/{c}') for c in meta['by'] + ['feature']})
+        return cls(keys, {name: arrays[f'{prefix}stat/{name}'] for name in STATS}, meta['bins_num'], meta['width'])
+
+    def save(self, path):
+        """Write the accumulator to an '.npz' file."""
+        np.savez_compressed(path, **self.to_arrays())
+
+    @classmethod
+    def load(cls, path):
+        """Read an accumulator written by save."""
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls.from_arrays(arrays)
+
+
+class IncrementalMetrics:
+    """
+    Verification statistics that are refreshed release by release.
+
+    Every (Well name, Prospect name) key of the raw data is fingerprinted by hashing its
+    prognosis and result rows. update() compares the fingerprints of a new release with
+    the stored ones, reshapes only the new and changed keys, subtracts the statistics of
+    changed and removed keys and adds those of new and changed keys. The reshaped rows of
+    every key (only the columns the statistics need) are kept so their contribution can
+    be taken out again later.
+
+        store = IncrementalMetrics(by=['year', 'result NPD play'], regions=True)
+        store.update(ingest.read_prognosis('PrognosisResultData_2024Q1.xlsx'))
+        store.save('metrics_store.npz')
+        ...
+        store = IncrementalMetrics.load('metrics_store.npz')
+        store.update(ingest.read_prognosis('PrognosisResultData_2024Q2.xlsx'))
+        store.metrics(by=['period', 'result NPD play'], years=[1990, 2006, 2023])
+
+    Parameters:
+        by (list): Grouping columns of the accumulator.
+        regions (bool): Map plays to NPD regions (map_npd) before accumulating.
+        bins_num (int): Number of regular bins.
+        width (float): Bin width (default: 1 / bins_num).
+    """
+
+    KEYS = ['Well name', 'Prospect name']
+    # Raw columns that decide a key's reshaped rows.
+    SOURCE_COLUMNS = KEYS + ['Prognosis - Result'] + list(dict.fromkeys(
+        list(data_cleaning.PROGNOSIS_COLUMNS) + list(data_cleaning.RESULT_COLUMNS)))
+
+    def __init__(self, by=('year',), regions=False, bins_num=10, width=None):
+        self.by = list(by)
+        self.regions = regions
+        self.bins_num = bins_num
+        self.width = width
+        self.hashes = pd.Series(dtype=np.uint64)
+        self.rows = None
+        self.accumulator = None
+
+    def _row_columns(self):
+        columns = self.by + [f'{f} Probability' for f in verification.FEATURES] + list(verification.FEATURES.values())
+        return list(dict.fromkeys(columns))
+
+    def _key_strings(self, well, prospect):
+        return (pd.Series(well).astype(str) + '\x1f' + pd.Series(prospect).astype(str)).to_numpy()
+
+    def fingerprints(self, data):
+        """
+        Fingerprint every (Well name, Prospect name) key of the raw data.
+
+        Parameters:
+            data (DataFrame): Raw PrognosisResultData rows (first row is the description).
+
+        Returns:
+            Series: Order-independent hash of each key's rows, indexed by key.
+        """
+        data = data.drop(0)
+        data = data[data[self.KEYS].notna().all(axis=1)]
+        row_hash = pd.util.hash_pandas_object(data[self.SOURCE_COLUMNS].astype(str), index=False).to_numpy()
+        codes, keys = pd.factorize(self._key_strings(data['Well name'], data['Prospect name']))
+        hashes = np.zeros(len(keys), dtype=np.uint64)
+        np.add.at(hashes, codes, row_hash)
+        return pd.Series(hashes, index=keys)
+
+    def _reshape(self, data, keys):
+        """Reshape only the raw rows of the given keys."""
+        data = data.drop(0)
+        selected = np.isin(self._key_strings(data['Well name'], data['Prospect name']), keys)
+        df = data_cleaning.reshape_pairs(data_cleaning.pair_rows(data[selected]))
+        if self.regions:
+            import map_npd
+            df = map_npd.map_npd(df)
+        rows = df[self._row_columns()].copy()
+        well_prospect = np.array(df['well_prospect'].tolist(), dtype=object).reshape(-1, 2)
+        rows.insert(0, 'key', self._key_strings(well_prospect[:, 0], well_prospect[:, 1]))
+        return rows
+
+    def _accumulate(self, rows):
+        return BinAccumulator.from_frame(rows, self.by, bins_num=self.bins_num, width=self.width)
+
+    def update(self, data):
+        """
+        Apply a new release of the raw data.
+
+        Parameters:
+            data (DataFrame): Raw PrognosisResultData rows of the full release.
+
+        Returns:
+            dict: Number of 'added', 'changed' and 'removed' keys.
+        """
+        hashes = self.fingerprints(data)
+        common = hashes.index.intersection(self.hashes.index)
+        changed = common[hashes[common].to_numpy() != self.hashes[common].to_numpy()]
+        added = hashes.index.difference(self.hashes.index)
+        removed = self.hashes.index.difference(hashes.index)
+
+        # Take out the old contribution of changed and removed keys ...
+        if self.rows is not None:
+            stale = np.isin(self.rows['key'].to_numpy(), changed.append(removed))
+            if stale.any():
+                self.accumulator = self.accumulator - self._accumulate(self.rows[stale])
+                self.rows = self.rows[~stale]
+        # ... and add the new contribution of new and changed keys.
+        fresh = self._reshape(data, changed.append(added))
+        if len(fresh):
+            delta = self._accumulate(fresh)
+            if self.rows is None:
+                self.accumulator, self.rows = delta, fresh
+            else:
+                self.accumulator = self.accumulator + delta
+                self.rows = pd.concat([self.rows, fresh], ignore_index=True)
+        self.hashes = hashes
+        return {'added': len(added), 'changed': len(changed), 'removed': len(removed)}
+
+    def metrics(self, by=None, years=None):
+        """Score the current statistics (see BinAccumulator.metrics)."""
+        return self.accumulator.metrics(by, years)
+
+    def save(self, path):
+        """Write the store (fingerprints, kept rows and accumulator) to an '.npz' file."""
+        if self.accumulator is None:
+            raise ValueError('Nothing to save: the store has not been updated with any data')
+        arrays = self.accumulator.to_arrays('acc/')
+        arrays['meta'] = np.array(json.dumps({'schema': SCHEMA_VERSION, 'by': self.by, 'regions': self.regions,
+                                              'bins_num': self.bins_num, 'width': self.width}))
+        arrays['hash/key'] = self.hashes.index.to_numpy(dtype=str)
+        arrays['hash/value'] = self.hashes.to_numpy(dtype=np.uint64)
+        for column in self.rows.columns:
+            _save_column(arrays, f'row/{column}', self.rows[column])
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Read a store written by save."""
+        with np.load(path, allow_pickle=False) as arrays:
+            meta = json.loads(str(arrays['meta']))
+            if meta['schema'] != SCHEMA_VERSION:
+                raise ValueError(f"Unsupported store schema {meta['schema']}")
+            store = cls(meta['by'], meta['regions'], meta['bins_num'], meta['width'])
+            store.hashes = pd.Series(arrays['hash/value'], index=arrays['hash/key'].astype(object))
+            store.rows = pd.DataFrame({c: _load_column(arrays, f'row/{c}') for c in ['key'] + store._row_columns()})
+            store.accumulator = BinAccumulator.from_arrays(arrays, 'acc/')
+        return store
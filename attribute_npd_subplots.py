@@ -1,10 +1,10 @@
-import numpy as np
-from scipy.stats import binom
-import matplotlib.pyplot as plt
-import map_npd
+import os
 
-# map npd plays
-df_npd = map_npd.map_npd(data)
+import numpy as np
+import confidence
+import instrument
+import isotonic
+import verification
 
 # Global list of NPD names (regions)
 npd_names = ['north sea', 'norwegian sea', 'barents sea']
@@ -21,106 +21,135 @@ def calculate_confidence_intervals(avg_prob, trials, confidence_level):
     Returns:
         tuple: Lower and upper bounds of the confidence interval.
     """
-    lower_bound_cp, upper_bound_cp = binom.interval(confidence_level, trials, avg_prob, loc=0)
-    lower_bound_cp /= trials
-    upper_bound_cp /= trials
-    return lower_bound_cp, upper_bound_cp
+    lower_bound_cp, upper_bound_cp = confidence.binomial_intervals(avg_prob, trials, confidence_level)
+    return lower_bound_cp[()], upper_bound_cp[()]
 
-def attribute_diagram(df, years):
+# Feature parameters
+feature_p = ['Reservoir', 'Source', 'Trap']
+feature_obs = ['reservoir', 'source', 'trap']
+feature_title = [
+    'Reservoir Probability',
+    'Source Probability',
+    'Trap Probability'
+]
+
+class NpdAttributeDiagramFigure:
     """
-    Generate attribute diagrams and Brier/Skill Score plots for multiple features over time.
-    
-    For each period a single 3×3 figure is created:
-      - The rows (top to bottom) correspond to the features: Reservoir, Source, Trap.
-      - The columns (left to right) correspond to the regions: north sea, norwegian sea, barents sea.
-      
-    Similarly, after processing all periods a single 3×3 figure is created showing the time series 
-    of Brier/Skill Score (plus bias) for each region/feature pair.
-    
+    Reusable 3×3 attribute diagram figure (rows: features, columns: regions).
+
+    The axes, titles, labels and reference lines are created once. update() only refreshes
+    the data-bearing artists (empirical curve, confidence band, no-skill line, bars, bin
+    counts, x-ticks and metric texts), so a single figure can be rendered for any number
+    of periods.
+
+    Parameters:
+        ci_method (str): Method of the confidence band (see confidence.METHODS).
+        confidence_level (float): Confidence level of the band.
+        isotonic (bool): Also draw the binning-free CORP calibration curve (see
+            isotonic.corp_decomposition) on every diagram.
     """
-    # Define the feature parameters internally
-    feature_p = ['Reservoir', 'Source', 'Trap']
-    feature_obs = ['reservoir', 'source', 'trap']
-    feature_title = [
-        'Reservoir Probability',
-        'Source Probability',
-        'Trap Probability'
-    ]
-    
-    # Dictionary to store verification metrics for each (region, feature) pair
-    metrics = {(region, feat): {'brier': [], 'skill': [], 'bias': [], 'time_label': []} 
-               for region in npd_names for feat in feature_p}
-    
-    # ----- 1. For each period, create a 3×3 figure for attribute diagrams -----
-    for p in range(len(years) - 1):
-        period_start = years[p]
-        period_end = years[p+1]
+    bins_num = 5
+    width = 0.2
+
+    def __init__(self, ci_method='binom', confidence_level=0.8, isotonic=False):
+        import matplotlib.pyplot as plt
+
+        self.ci_method = ci_method
+        self.confidence_level = confidence_level
+        self.isotonic = isotonic
+        bins_num, width = self.bins_num, self.width
+        default_blue = plt.rcParams['axes.prop_cycle'].by_key()['color'][0]
+
         # Create a 3×3 subplot figure (rows: features, columns: regions)
-        fig, axes = plt.subplots(3, 3, figsize=(16, 14))
+        self.fig, self.axes = plt.subplots(3, 3, figsize=(16, 14))
+        self.artists = {}
+        for j, region in enumerate(npd_names):
+            for i, feat in enumerate(feature_p):
+                ax = self.axes[i, j]  # row: feature, column: region
+                a = {}
+                # Empirical curve, perfect reliability line and confidence band.
+                a['curve'], = ax.plot([], [], 'ro--', markersize=4, label='Empirical Curve')
+                if isotonic:
+                    a['isotonic'], = ax.plot([], [], 'g-', linewidth=1.5, label='CORP (Isotonic) Curve')
+                ax.plot([0, 1], [0, 1], 'k--', label='Perfect Reliability')
+                a['band'] = ax.fill_between([], [], [], color='gray', alpha=0.2,
+                                            label=f'{confidence_level:.0%} Conf. Interval')
+                a['no_skill'], = ax.plot([], [], 'orange', linestyle='--')
+
+                # Metrics and bin counts (unused count labels stay hidden).
+                a['metrics'] = [
+                    ax.text(0.03, 1.03, 'Brier Score: 0.0', color='blue', fontsize=9),
+                    ax.text(0.39, 1.03, 'Skill Score: 0.0', color='blue', fontsize=9),
+                    ax.text(0.75, 1.03, 'Bias: 0.0', color='blue', fontsize=9),
+                ]
+                a['counts'] = [ax.text(0, 0.05, '', color='blue', fontsize=9, rotation=90, ha='center',
+                                       visible=False) for _ in range(bins_num + 1)]
+                ax.axhline(y=1.0, color='gray', linestyle='-', linewidth=1)
+
+                # Titles and axis labels.
+                # For the leftmost column add the region name to the title.
+                if i == 0:
+                    ax.set_title(f'{region.capitalize()}\n\n{feature_title[i]}', fontsize=10)
+                else:
+                    ax.set_title(f'{feature_title[i]}', fontsize=10)
+                if i == 2:
+                    ax.set_xlabel('Forecasted PoS (f)', fontsize=10)
+                if j == 0:
+                    ax.set_ylabel('Observed Rel. Frequency', fontsize=10)
+                ax.set_ylim([0, 1.1])
+                ax.set_xlim([0, 1])
+                ax.tick_params(axis='both', labelsize=9)
+
+                # Bars for probability assessment frequency: the merged first bin plus a pool
+                # for the remaining bins (unused bars stay hidden).
+                a['bars'] = ax.bar([0] * bins_num, [0] * bins_num, width=width, align='center', alpha=0.3,
+                                   label='Probability Assessment Frequency')
+                for rect in a['bars']:
+                    rect.set_visible(False)
+                a['first_bar'], = ax.bar(0.2, 0, width=0.4, align='center', alpha=0.3, color=default_blue)
+                self.artists[(region, feat)] = a
+        #fig.suptitle(f'Attribute Diagrams for period {period_start}-{period_end-1}', fontsize=12)
+
+    def update(self, df):
+        """
+        Draw the attribute diagrams of one period's data.
+
+        Parameters:
+            df (DataFrame): Reshaped data of the period with plays mapped to regions.
+
+        Returns:
+            dict: Verification measures per (region, feature) pair
+            (see verification.verification_metrics), with the CORP fit under 'corp' when the
+            figure draws the isotonic curve.
+        """
+        bins_num, width = self.bins_num, self.width
+        period_metrics = {}
         # Loop over regions (columns)
         for j, region in enumerate(npd_names):
             # Filter the dataframe for the current region.
-            df_region = df[df['result NPD play'] == region]
+            df_y = df[df['result NPD play'] == region]
             # Loop over features (rows)
             for i, feat in enumerate(feature_p):
-                # Select data for the current period.
-                df_y = df_region[(df_region['year'] >= period_start) & (df_region['year'] < period_end)]
                 # Retrieve forecast probabilities and observations.
                 probs = np.array(df_y[f'{feat} Probability'])
                 discovs = np.array(df_y[f'{feature_obs[i]}?'])
-                success_mean = np.mean(discovs)
-                
-                bins_num = 5
-                width = 0.2
-                
-                # Initialize binning arrays.
-                extra_bin = bins_num  # Extra bin for probability == 1
-                succ_well_per_bin = [0] * (bins_num + 1)
-                sum_probs_per_bin = [0] * (bins_num + 1)
-                count_per_bin = [0] * (bins_num + 1)
-                
-                # Bin the forecast probabilities and count successes.
-                for prob, discov in zip(probs, discovs):
-                    if prob == 1.0:
-                        bin_idx = extra_bin
-                    elif 0.9 < prob < 1:
-                        bin_idx = bins_num - 1
-                    else:
-                        bin_idx = min(int((prob - 0.001) / width), bins_num - 1)
-                    sum_probs_per_bin[bin_idx] += prob
-                    count_per_bin[bin_idx] += 1
-                    if discov == 1:
-                        succ_well_per_bin[bin_idx] += 1
-                        
-                avg_probs = [sum_probs_per_bin[i] / count_per_bin[i] if count_per_bin[i] > 0 else 0
-                             for i in range(bins_num + 1)]
-                succ_rate_bin = [succ_well_per_bin[i] / count_per_bin[i] if count_per_bin[i] > 0 else 0
-                                 for i in range(bins_num + 1)]
-                succ_bin = [succ_well_per_bin[i] if count_per_bin[i] > 0 else 0
-                            for i in range(bins_num + 1)]
-                bins_mid = [round((i + 0.5) * width, 2) for i in range(bins_num)] + [1.0]
-                
-                # Attribute measures.
-                brier = np.mean((probs - discovs) ** 2)
-                rel = np.sum([count_per_bin[i] * (avg_probs[i] - succ_rate_bin[i]) ** 2
-                              for i in range(bins_num + 1) if count_per_bin[i] > 0]) / len(probs)
-                res = np.sum([count_per_bin[i] * (succ_rate_bin[i] - success_mean) ** 2
-                              for i in range(bins_num + 1) if count_per_bin[i] > 0]) / len(probs)
-                variance = np.var(discovs, ddof=1)
-                skill = (res - rel) / variance if variance > 0 else 0
-                bias0 = np.mean(probs - discovs)
-                sharp = np.sqrt(np.mean((probs - np.mean(probs)) ** 2))
-                
-                # Store metrics for the later Brier/Skill Score plot.
-                metrics[(region, feat)]['brier'].append(brier)
-                metrics[(region, feat)]['skill'].append(skill)
-                metrics[(region, feat)]['bias'].append(bias0)
-                metrics[(region, feat)]['time_label'].append(f"{period_start}-{period_end-1}")
-                
-                
-                # --- Plot the attribute diagram on the corresponding subplot ---
-                ax = axes[i, j]  # row: feature, column: region
-                
+
+                # Bin the forecast probabilities and compute the attribute measures.
+                stats = verification.verification_metrics(probs, discovs, bins_num, width)
+                success_mean = stats['success_mean']
+                count_per_bin = stats['count_per_bin'].tolist()
+                avg_probs = stats['avg_probs'].tolist()
+                succ_rate_bin = stats['succ_rate_bin'].tolist()
+                succ_bin = stats['succ_well_per_bin'].tolist()
+                bins_mid = stats['bins_mid'].tolist()
+                brier, skill, bias0 = stats['brier'], stats['skill'], stats['bias']
+
+                period_metrics[(region, feat)] = stats
+
+                # --- Update the attribute diagram on the corresponding subplot ---
+                ax = self.axes[i, j]
+                a = self.artists[(region, feat)]
+
                 # Prepare empirical curve data.
                 x_axis = [m for m, cnt in zip(bins_mid, count_per_bin) if cnt != 0]
                 # Adjust first two bins as in original logic.
@@ -132,56 +161,36 @@ def attribute_diagram(df, years):
                 y_axis = [val for val, cnt in zip(succ_rate_bin, count_per_bin) if cnt != 0]
                 if len(y_axis) >= 2 and counts[0] != 0:
                     y_axis = [ (succ_bin[0] + succ_bin[1]) / counts[0] ] + y_axis[2:]
-                
-                # Plot the empirical curve and perfect reliability line.
-                ax.plot(x_axis[:-1], y_axis[:-1], 'ro--', markersize=4, label='Empirical Curve')
-                ax.plot([0, 1], [0, 1], 'k--', label='Perfect Reliability')
-                
+
+                a['curve'].set_data(x_axis[:-1], y_axis[:-1])
+                if self.isotonic:
+                    stats['corp'] = isotonic.corp_decomposition(probs, discovs)
+                    a['isotonic'].set_data(stats['corp']['forecast'], stats['corp']['calibrated'])
+
                 # Confidence intervals.
-                lower_bounds = [calculate_confidence_intervals(x_axis[i], counts[i], 0.8)[0]
-                                for i in range(len(x_axis))]
-                upper_bounds = [calculate_confidence_intervals(x_axis[i], counts[i], 0.8)[1]
-                                for i in range(len(x_axis))]
-                ax.fill_between(x_axis[:-1], lower_bounds[:-1], upper_bounds[:-1],
-                                color='gray', alpha=0.2, label='80% Conf. Interval')
-                
-                # Additional lines and text.
-                #if i == 0 and j == 'north sea':
-                #    ax.text(0.83, 0.78, 'Perfect', color='blue', fontsize=9)
-                #    ax.plot([0, 1.1], [success_mean, success_mean], 'orange', linestyle='--')
-                #    ax.text(0.8, success_mean + 0.02, 'No Resolution', color='blue', fontsize=9)
-                #    ax.text(0.84, (success_mean + 0.84) / 2, 'No Skill', color='blue', fontsize=12)
-                ax.plot([0] + avg_probs + [1.1],
-                        [success_mean / 2] + [0.5 * (a + success_mean) for a in avg_probs] + [(success_mean + 1.1) / 2],
-                        'orange', linestyle='--')
-                
-                
+                lower_bounds, upper_bounds = confidence.binomial_intervals(x_axis, counts, self.confidence_level,
+                                                                           self.ci_method)
+                a['band'].remove()
+                a['band'] = ax.fill_between(x_axis[:-1], lower_bounds[:-1], upper_bounds[:-1],
+                                            color='gray', alpha=0.2)
+
+                # No skill line.
+                a['no_skill'].set_data(
+                    [0] + avg_probs + [1.1],
+                    [success_mean / 2] + [0.5 * (avg + success_mean) for avg in avg_probs] + [(success_mean + 1.1) / 2])
+
                 # Display metrics.
-                ax.text(0.03, 1.03, f'Brier Score: {round(brier, 2)}', color='blue', fontsize=9)
-                ax.text(0.39, 1.03, f'Skill Score: {round(skill, 2)}', color='blue', fontsize=9)
-                ax.text(0.75, 1.03, f'Bias: {round(bias0, 2)}', color='blue', fontsize=9)
-                
+                a['metrics'][0].set_text(f'Brier Score: {round(brier, 2)}')
+                a['metrics'][1].set_text(f'Skill Score: {round(skill, 2)}')
+                a['metrics'][2].set_text(f'Bias: {round(bias0, 2)}')
+
                 # Annotate bin counts.
-                for n in range(len(x_axis)):
+                for n, text in enumerate(a['counts']):
                     if n < len(x_axis) - 1:
-                        ax.text(x_axis[n], 0.05, f'{counts[n]}', color='blue', fontsize=9,
-                                rotation=90, ha='center')
-                ax.axhline(y=1.0, color='gray', linestyle='-', linewidth=1)
-                
-                # Titles and axis labels.
-                # For the leftmost column add the region name to the title.
-                if i == 0:
-                    ax.set_title(f'{region.capitalize()}\n\n{feature_title[i]}', fontsize=10)
-                else:
-                    ax.set_title(f'{feature_title[i]}', fontsize=10)
-                if i == 2:
-                    ax.set_xlabel('Forecasted PoS (f)', fontsize=10)
-                if j == 0:
-                    ax.set_ylabel('Observed Rel. Frequency', fontsize=10)
-                ax.set_ylim([0, 1.1])
-                ax.set_xlim([0, 1])
-                ax.tick_params(axis='both', labelsize=9)
-                
+                        text.set_position((x_axis[n], 0.05))
+                        text.set_text(f'{counts[n]}')
+                    text.set_visible(n < len(x_axis) - 1)
+
                 # Custom x-ticks.
                 xticks = x_axis
                 xticklabels = []
@@ -197,21 +206,53 @@ def attribute_diagram(df, years):
                     xticklabels.append(label)
                 ax.set_xticks(xticks[:-1])
                 ax.set_xticklabels(xticklabels[:-1], fontsize=9, rotation=45)
-                
+
                 # Bar plot for probability assessment frequency.
                 normalized_counts = [cnt / sum(counts) if sum(counts) != 0 else 0 for cnt in counts]
-                ax.bar(x_axis[1:-1], normalized_counts[1:-1], width=width, align='center', alpha=0.3,
-                       label='Probability Assessment Frequency')
-                default_blue = plt.rcParams['axes.prop_cycle'].by_key()['color'][0]
-                ax.bar(0.2, normalized_counts[0], width=0.4, align='center', alpha=0.3, color=default_blue)
-                #if (i == 0 and j == 0):
-                #    ax.legend(loc=(0.008, 0.71), fontsize=10)
-        #fig.suptitle(f'Attribute Diagrams for period {period_start}-{period_end-1}', fontsize=12)
-        plt.tight_layout(rect=[0, 0, 1, 0.95])
-        plt.savefig(f"attribute_npd.pdf")
-        plt.show()
-    
-    # ----- 2. Create a single 3×3 figure for Brier/Skill Score plots -----
+                for k, rect in enumerate(a['bars']):
+                    if k < len(x_axis[1:-1]):
+                        rect.set_x(x_axis[1:-1][k] - width / 2)
+                        rect.set_height(normalized_counts[1:-1][k])
+                    rect.set_visible(k < len(x_axis[1:-1]))
+                a['first_bar'].set_height(normalized_counts[0] if normalized_counts else 0)
+        # The x-tick labels change per period, so the layout is redone after every update.
+        self.fig.tight_layout(rect=[0, 0, 1, 0.95])
+        return period_metrics
+
+@instrument.timed('attribute_npd_subplots.plot_period')
+def plot_period(df, period_start, period_end, figure=None):
+    """
+    Draw the 3×3 attribute diagram figure (rows: features, columns: regions) of one period.
+
+    Parameters:
+        df (DataFrame): Reshaped data with plays mapped to regions (map_npd.map_npd).
+        period_start (int): First year of the period.
+        period_end (int): Year after the last year of the period.
+        figure (NpdAttributeDiagramFigure): Figure to reuse (default: a new one).
+
+    Returns:
+        tuple: The figure and a dict mapping each (region, feature) pair to its verification
+        measures (see verification.verification_metrics).
+    """
+    if figure is None:
+        figure = NpdAttributeDiagramFigure()
+    # Select data for the current period.
+    df_y = df[(df['year'] >= period_start) & (df['year'] < period_end)]
+    return figure.fig, figure.update(df_y)
+
+@instrument.timed('attribute_npd_subplots.plot_measures')
+def plot_measures(metrics):
+    """
+    Create the 3×3 figure of Brier/Skill Score (plus bias) evolution for each region/feature pair.
+
+    Parameters:
+        metrics (dict): Per (region, feature) pair, lists of 'brier', 'skill', 'bias' and 'time_label'.
+
+    Returns:
+        Figure: The measures figure.
+    """
+    import matplotlib.pyplot as plt
+
     fig, axes = plt.subplots(3, 3, figsize=(16, 12))
     for j, region in enumerate(npd_names):
         for i, feat in enumerate(feature_p):
@@ -244,8 +285,78 @@ def attribute_diagram(df, years):
                 ax2.legend(fontsize=9, loc='upper right')
             ax2.grid(True, which='both', axis='both', linestyle='-', color='green', alpha=0.2)
     plt.tight_layout()
-    plt.savefig(f"measures_npd.pdf")
-    plt.show()
+    return fig
+
+@instrument.timed('attribute_npd_subplots.attribute_diagram')
+def attribute_diagram(df, years, show=True, pdf_path="attribute_npd.pdf", image_dir=None,
+                      image_formats=('png', 'svg'), isotonic=False):
+    """
+    Generate attribute diagrams and Brier/Skill Score plots for multiple features over time.
+    
+    For each period a single 3×3 figure is created:
+      - The rows (top to bottom) correspond to the features: Reservoir, Source, Trap.
+      - The columns (left to right) correspond to the regions: north sea, norwegian sea, barents sea.
+    Every period is written as one page of pdf_path and, when image_dir is given, as
+    'attribute_npd_<start>-<end>.<format>' files.
+      
+    Similarly, after processing all periods a single 3×3 figure is created showing the time series 
+    of Brier/Skill Score (plus bias) for each region/feature pair. It is the last page of pdf_path and,
+    when image_dir is given, written as 'measures_npd.<format>'.
+    
+    With show=False nothing is displayed and a single NpdAttributeDiagramFigure is reused for all
+    periods (see batch_export for headless, parallel rendering). With isotonic=True every
+    diagram also shows the binning-free CORP calibration curve.
+    
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    # Dictionary to store verification metrics for each (region, feature) pair
+    metrics = {(region, feat): {'brier': [], 'skill': [], 'bias': [], 'time_label': []} 
+               for region in npd_names for feat in feature_p}
+    
+    # Displayed figures are closed by plt.show(), so only a headless run can reuse one figure.
+    figure = None if show else NpdAttributeDiagramFigure(isotonic=isotonic)
+    if image_dir is not None:
+        os.makedirs(image_dir, exist_ok=True)
+    
+    # ----- 1. For each period, create a 3×3 figure for attribute diagrams -----
+    with PdfPages(pdf_path) as pdf:
+        for p in range(len(years) - 1):
+            period_start = years[p]
+            period_end = years[p+1]
+            fig, period_metrics = plot_period(df, period_start, period_end,
+                                              figure or NpdAttributeDiagramFigure(isotonic=isotonic))
+            
+            # Store metrics for the later Brier/Skill Score plot.
+            for key, stats in period_metrics.items():
+                metrics[key]['brier'].append(stats['brier'])
+                metrics[key]['skill'].append(stats['skill'])
+                metrics[key]['bias'].append(stats['bias'])
+                metrics[key]['time_label'].append(f"{period_start}-{period_end-1}")
+            
+            # Stream the period into the multi-page PDF (and the image set).
+            with instrument.stage('attribute_npd_subplots.savefig'):
+                pdf.savefig(fig)
+                if image_dir is not None:
+                    for fmt in image_formats:
+                        fig.savefig(os.path.join(image_dir, f"attribute_npd_{period_start}-{period_end-1}.{fmt}"))
+            if show:
+                plt.show()
+        if figure is not None:
+            plt.close(figure.fig)
+
+        # ----- 2. Create a single 3×3 figure for Brier/Skill Score plots -----
+        # It is the last page of pdf_path (and 'measures_npd.<format>' in image_dir).
+        fig = plot_measures(metrics)
+        pdf.savefig(fig)
+        if image_dir is not None:
+            for fmt in image_formats:
+                fig.savefig(os.path.join(image_dir, f"measures_npd.{fmt}"))
+        if show:
+            plt.show()
+        else:
+            plt.close(fig)
 
 # Example call:
 #years = [1990, 2022]
@@ -1,6 +1,11 @@
+import os
+
 import numpy as np
-from scipy.stats import binom
-import matplotlib.pyplot as plt
+
+import confidence
+import instrument
+import isotonic
+import verification
 
 def calculate_confidence_intervals(avg_prob, trials, confidence_level):
     """
@@ -14,164 +19,91 @@ def calculate_confidence_intervals(avg_prob, trials, confidence_level):
     Returns:
         tuple: Lower and upper bounds of the confidence interval.
     """
-    lower_bound_cp, upper_bound_cp = binom.interval(confidence_level, trials, avg_prob, loc=0)
-    lower_bound_cp /= trials
-    upper_bound_cp /= trials
-    return lower_bound_cp, upper_bound_cp
+    lower_bound_cp, upper_bound_cp = confidence.binomial_intervals(avg_prob, trials, confidence_level)
+    return lower_bound_cp[()], upper_bound_cp[()]
 
-def attribute_diagram(df, years):
+# Feature parameters
+feature_p = ['Technical', 'Reservoir', 'Source', 'Trap']
+feature_obs = ['discovery', 'reservoir', 'source', 'trap']
+feature_title = [
+    'Technical Probability',
+    'Reservoir Probability',
+    'Source Probability',
+    'Trap Probability'
+]
+
+class AttributeDiagramFigure:
     """
-    Generate attribute diagrams and measure Score plots for multiple features over time.
-    - For each period (years[i] to years[i+1]-1) a 2×2 figure is created showing the attribute diagrams for
-      Technical, Reservoir, Source, and Trap.
-    - After processing all periods, a single 2×2 figure is created where each subplot shows the Brier/Skill Score
-      (plus bias) evolution over time for one feature.
-      
+    Reusable 2×2 attribute diagram figure (Technical, Reservoir, Source and Trap).
+
+    The axes, ticks, titles, labels, legend and reference lines are created once. update()
+    only refreshes the data-bearing artists (empirical curve, confidence band, no-resolution
+    and no-skill lines, bars, bin counts and metric texts), so a single figure can be
+    rendered for any number of periods.
+
+    Parameters:
+        ci_method (str): Method of the confidence band (see confidence.METHODS).
+        confidence_level (float): Confidence level of the band.
+        isotonic (bool): Also draw the binning-free CORP calibration curve (see
+            isotonic.corp_decomposition) on every diagram.
     """
-    # Define the feature parameters internally
-    feature_p = ['Technical', 'Reservoir', 'Source', 'Trap']
-    feature_obs = ['discovery', 'reservoir', 'source', 'trap']
-    feature_title = [
-        'Technical Probability',
-        'Reservoir Probability',
-        'Source Probability',
-        'Trap Probability'
-    ]
-    
-    # This dictionary will store the Brier/Skill/Bias metrics per feature over the periods.
-    metrics = {fp: {'brier': [], 'skill': [], 'bias': [], 'time_label': []} for fp in feature_p}
-    
-    # ----- 1. For each period, create a 2x2 figure for attribute diagrams -----
-    for period in range(len(years) - 1):
-        period_start = years[period]
-        period_end = years[period + 1]
-        # Create a 2x2 subplot figure for the 4 features for this period.
-        fig, axes = plt.subplots(2, 2, figsize=(16, 14))
-        axes = axes.flatten()
-        
-        for ff in range(len(feature_p)):
-            # Select data for the current period.
-            df_y = df[(df['year'] >= period_start) & (df['year'] < period_end)]
-            # Extract forecast probabilities and observations for current feature.
-            probs = np.array(df_y[f'{feature_p[ff]} Probability'])
-            discovs = np.array(df_y[f'{feature_obs[ff]}?'])
-            # The mean observed success
-            success_mean = np.mean(discovs)
-            
-            bins_num = 10
-            width = 0.1
-            
-            # Initialize lists for bin calculations.
-            extra_bin = bins_num  # extra bin for probability == 1
-            succ_well_per_bin = [0] * (bins_num + 1)
-            sum_probs_per_bin = [0] * (bins_num + 1)
-            count_per_bin = [0] * (bins_num + 1)
-            
-            # Bin the forecast probabilities and count successes.
-            for prob, discov in zip(probs, discovs):
-                if prob == 1.0:
-                    bin_idx = extra_bin
-                elif 0.9 < prob < 1:
-                    bin_idx = bins_num - 1
-                else:
-                    bin_idx = min(int((prob - 0.001) / width), bins_num - 1)
-                sum_probs_per_bin[bin_idx] += prob
-                count_per_bin[bin_idx] += 1
-                if discov == 1:
-                    succ_well_per_bin[bin_idx] += 1
-            
-            avg_probs = [
-                sum_probs_per_bin[i] / count_per_bin[i] if count_per_bin[i] > 0 else 0
-                for i in range(bins_num + 1)
-            ]
-            succ_rate_bin = [
-                succ_well_per_bin[i] / count_per_bin[i] if count_per_bin[i] > 0 else 0
-                for i in range(bins_num + 1)
-            ]
-            bins_mid = [round((i + 0.5) * width, 2) for i in range(bins_num)] + [1.0]
-            
-            # --- Attribute measures ---
-            brier = np.mean((probs - discovs) ** 2)
-            rel = np.sum([
-                (count_per_bin[i] * (avg_probs[i] - succ_rate_bin[i]) ** 2)
-                for i in range(bins_num + 1) if count_per_bin[i] > 0
-            ]) / len(probs)
-            res = np.sum([
-                (count_per_bin[i] * (succ_rate_bin[i] - success_mean) ** 2)
-                for i in range(bins_num + 1) if count_per_bin[i] > 0
-            ]) / len(probs)
-            variance = np.var(discovs, ddof=1)
-            skill = (res - rel) / variance if variance > 0 else 0
-            bias0 = np.mean(probs - discovs)
-            
-            # Store metrics for the later Brier/Skill Score plot.
-            metrics[feature_p[ff]]['brier'].append(brier)
-            metrics[feature_p[ff]]['skill'].append(skill)
-            metrics[feature_p[ff]]['bias'].append(bias0)
-            metrics[feature_p[ff]]['time_label'].append(f"{period_start}-{period_end-1}")
-            
-            # --- Plotting the attribute diagram in the subplot ---
-            ax = axes[ff]
-            
-            # Plot the empirical curve.
-            # (Select only bins with nonzero counts.)
-            valid_bins = [i for i, cnt in enumerate(count_per_bin) if cnt != 0]
-            x_axis = [bins_mid[i] for i in valid_bins]
-            y_axis = [succ_rate_bin[i] for i in valid_bins]
-            if len(x_axis) > 1:
-                ax.plot(x_axis[:-1], y_axis[:-1], 'ro--', markersize=10, label='Empirical Curve')
+    bins_num = 10
+    width = 0.1
+
+    def __init__(self, ci_method='binom', confidence_level=0.8, isotonic=False):
+        import matplotlib.pyplot as plt
+
+        self.ci_method = ci_method
+        self.confidence_level = confidence_level
+        self.isotonic = isotonic
+        bins_num, width = self.bins_num, self.width
+        bins_mid = [round((i + 0.5) * width, 2) for i in range(bins_num)] + [1.0]
+        fig_num = ['(a)', '(b)', '(c)', '(d)']
+        perfect = ['Perfect', '', '', '']
+        no_res = ['No Resolution', '', '', '']
+        no_skl = ['No Skill', '', '', '']
+        x_lab = ['', '', 'Forecasted PoS (f)', 'Forecasted PoS (f)']
+        y_lab = ['Observed Rel. Frequency', '', 'Observed Rel. Frequency', '']
+
+        # Create a 2x2 subplot figure for the 4 features.
+        self.fig, axes = plt.subplots(2, 2, figsize=(16, 14))
+        self.axes = axes.flatten()
+        self.artists = []
+        for ff, ax in enumerate(self.axes):
+            a = {}
+            # Empirical curve, perfect reliability and confidence band.
+            a['curve'], = ax.plot([], [], 'ro--', markersize=10, label='Empirical Curve')
+            if isotonic:
+                a['isotonic'], = ax.plot([], [], 'g-', linewidth=2, label='CORP (Isotonic) Curve')
             ax.plot([0, 1], [0, 1], 'k--', label='Perfect Reliability')
-            fig_num = ['(a)', '(b)', '(c)', '(d)']
             ax.text(0, 1.13, fig_num[ff], color='k', fontsize=12)
-            
-            # Confidence intervals.
-            p_hat = [bins_mid[i] for i in valid_bins]
-            counts = [count_per_bin[i] for i in valid_bins]
-            lower_bounds = [
-                calculate_confidence_intervals(p_hat[i_idx], counts[i_idx], 0.8)[0]
-                for i_idx in range(len(p_hat))
-            ]
-            upper_bounds = [
-                calculate_confidence_intervals(p_hat[i_idx], counts[i_idx], 0.8)[1]
-                for i_idx in range(len(p_hat))
-            ]
-            if len(p_hat) > 1:
-                ax.fill_between(p_hat[:-1], lower_bounds[:-1], upper_bounds[:-1],
-                                color='gray', alpha=0.2, label='80% Conf. Interval')
-            
+            a['band'] = ax.fill_between([], [], [], color='gray', alpha=0.2,
+                                        label=f'{confidence_level:.0%} Conf. Interval')
+
             # Additional lines and texts (perfect reliability, no resolution, no skill).
-            perfect = ['Perfect', '', '', '']
-            no_res = ['No Resolution', '', '', '']
-            no_skl = ['No Skill', '', '', '']
             ax.text(0.83, 0.78, perfect[ff], color='blue', fontsize=12)
-            ax.plot([0, 1.1], [success_mean, success_mean], 'orange', linestyle='--')
-            ax.text(0.8, success_mean + 0.02, no_res[ff], color='blue', fontsize=12)
-            ax.plot([0] + avg_probs + [1.1],
-                    [success_mean / 2] + [0.5 * (a + success_mean) for a in avg_probs] + [(success_mean + 1.1) / 2],
-                    'orange', linestyle='--')
-            ax.text(0.84, (success_mean + 0.84) / 2, no_skl[ff], color='blue', fontsize=12)
-            
-            # Display metrics.
-            ax.text(0.03, 1.03, f'Brier Score: {round(brier, 2)}', color='blue', fontsize=12)
-            ax.text(0.39, 1.03, f'Skill Score: {round(skill, 2)}', color='blue', fontsize=12)
-            ax.text(0.75, 1.03, f'Bias: {round(bias0, 2)}', color='blue', fontsize=12)
-            
-            # Annotate bin counts.
-            for n in range(len(bins_mid)):
-                if n < len(bins_mid) - 1:
-                    ax.text(bins_mid[n], 0.05, f'{count_per_bin[n]}', color='blue',
-                            fontsize=12, rotation=90, ha='center')
+            a['no_res'], = ax.plot([0, 1.1], [0, 0], 'orange', linestyle='--')
+            a['no_res_text'] = ax.text(0.8, 0.02, no_res[ff], color='blue', fontsize=12)
+            a['no_skill'], = ax.plot([], [], 'orange', linestyle='--')
+            a['no_skill_text'] = ax.text(0.84, 0.42, no_skl[ff], color='blue', fontsize=12)
+
+            # Metrics and bin counts.
+            a['metrics'] = [
+                ax.text(0.03, 1.03, 'Brier Score: 0.0', color='blue', fontsize=12),
+                ax.text(0.39, 1.03, 'Skill Score: 0.0', color='blue', fontsize=12),
+                ax.text(0.75, 1.03, 'Bias: 0.0', color='blue', fontsize=12),
+            ]
+            a['counts'] = [ax.text(m, 0.05, '', color='blue', fontsize=12, rotation=90, ha='center')
+                           for m in bins_mid[:-1]]
             ax.axhline(y=1.0, color='gray', linestyle='-', linewidth=1)
-            
+
             # Set titles and labels.
             ax.set_title(feature_title[ff], fontsize=14)
-            x_lab = ['', '', 'Forecasted PoS (f)', 'Forecasted PoS (f)']
-            y_lab = ['Observed Rel. Frequency', '', 'Observed Rel. Frequency', '']
             ax.set_xlabel(x_lab[ff], fontsize=12)
             ax.set_ylabel(y_lab[ff], fontsize=12)
             ax.set_ylim([0, 1.1])
             ax.set_xlim([0, 1])
-            
+
             # Custom x-ticks.
             ax.set_xticks(bins_mid[:-1])
             xticklabels = []
@@ -184,20 +116,119 @@ def attribute_diagram(df, years):
                     label = f'({round(m - width / 2, 2)} - {round(m + width / 2, 2)})'
                 xticklabels.append(label)
             ax.set_xticklabels(xticklabels[:-1], fontsize=10, rotation=45)
-            
+
             # Bar plot for probability assessment frequency.
-            normalized_counts = [cnt / sum(count_per_bin) for cnt in count_per_bin]
-            ax.bar(bins_mid[:-1], normalized_counts[:-1], width=width, align='center',
-                   alpha=0.3, label='Probability Assessment Frequency')
+            a['bars'] = ax.bar(bins_mid[:-1], [0] * bins_num, width=width, align='center',
+                               alpha=0.3, label='Probability Assessment Frequency')
             if ff == 0:
                 ax.legend(loc=(0.008, 0.73), fontsize=10)
-        
+            self.artists.append(a)
+
         #fig.suptitle(f'Attribute Diagrams for period {period_start}-{period_end-1}', fontsize=24)
-        plt.tight_layout(rect=[0, 0, 1, 0.95])
-        plt.savefig(f"attribute_diagram.pdf")
-        plt.show()
-    
-    # ----- 2. Create a single 2x2 figure for Brier/Skill Score plots -----
+        self.fig.tight_layout(rect=[0, 0, 1, 0.95])
+
+    def update(self, df_y):
+        """
+        Draw the attribute diagrams of one period's data.
+
+        Parameters:
+            df_y (DataFrame): Reshaped data of the period.
+
+        Returns:
+            dict: Verification measures per feature (see verification.verification_metrics),
+            with the CORP fit under 'corp' when the figure draws the isotonic curve.
+        """
+        bins_num, width = self.bins_num, self.width
+        period_metrics = {}
+        for ff, (ax, a) in enumerate(zip(self.axes, self.artists)):
+            # Extract forecast probabilities and observations for current feature.
+            probs = np.array(df_y[f'{feature_p[ff]} Probability'])
+            discovs = np.array(df_y[f'{feature_obs[ff]}?'])
+
+            # Bin the forecast probabilities and compute the attribute measures.
+            stats = verification.verification_metrics(probs, discovs, bins_num, width)
+            success_mean = stats['success_mean']
+            count_per_bin = stats['count_per_bin'].tolist()
+            avg_probs = stats['avg_probs'].tolist()
+            succ_rate_bin = stats['succ_rate_bin'].tolist()
+            bins_mid = stats['bins_mid'].tolist()
+            brier, skill, bias0 = stats['brier'], stats['skill'], stats['bias']
+
+            period_metrics[feature_p[ff]] = stats
+
+            # Empirical curve (only bins with nonzero counts).
+            valid_bins = [i for i, cnt in enumerate(count_per_bin) if cnt != 0]
+            x_axis = [bins_mid[i] for i in valid_bins]
+            y_axis = [succ_rate_bin[i] for i in valid_bins]
+            a['curve'].set_data(x_axis[:-1], y_axis[:-1])
+            if self.isotonic:
+                stats['corp'] = isotonic.corp_decomposition(probs, discovs)
+                a['isotonic'].set_data(stats['corp']['forecast'], stats['corp']['calibrated'])
+
+            # Confidence intervals.
+            p_hat = [bins_mid[i] for i in valid_bins]
+            counts = [count_per_bin[i] for i in valid_bins]
+            lower_bounds, upper_bounds = confidence.binomial_intervals(p_hat, counts, self.confidence_level,
+                                                                       self.ci_method)
+            a['band'].remove()
+            a['band'] = ax.fill_between(p_hat[:-1], lower_bounds[:-1], upper_bounds[:-1],
+                                        color='gray', alpha=0.2)
+
+            # No resolution and no skill lines.
+            a['no_res'].set_ydata([success_mean, success_mean])
+            a['no_res_text'].set_y(success_mean + 0.02)
+            a['no_skill'].set_data(
+                [0] + avg_probs + [1.1],
+                [success_mean / 2] + [0.5 * (avg + success_mean) for avg in avg_probs] + [(success_mean + 1.1) / 2])
+            a['no_skill_text'].set_y((success_mean + 0.84) / 2)
+
+            # Display metrics and bin counts.
+            a['metrics'][0].set_text(f'Brier Score: {round(brier, 2)}')
+            a['metrics'][1].set_text(f'Skill Score: {round(skill, 2)}')
+            a['metrics'][2].set_text(f'Bias: {round(bias0, 2)}')
+            for text, cnt in zip(a['counts'], count_per_bin):
+                text.set_text(f'{cnt}')
+
+            # Probability assessment frequency.
+            normalized_counts = [cnt / sum(count_per_bin) for cnt in count_per_bin]
+            for rect, height in zip(a['bars'], normalized_counts[:-1]):
+                rect.set_height(height)
+        return period_metrics
+
+@instrument.timed('attribute_subplots.plot_period')
+def plot_period(df, period_start, period_end, figure=None):
+    """
+    Draw the 2×2 attribute diagram figure of one period.
+
+    Parameters:
+        df (DataFrame): Reshaped data (data_cleaning.data_reshape).
+        period_start (int): First year of the period.
+        period_end (int): Year after the last year of the period.
+        figure (AttributeDiagramFigure): Figure to reuse (default: a new one).
+
+    Returns:
+        tuple: The figure and a dict mapping each feature to its verification measures
+        (see verification.verification_metrics).
+    """
+    if figure is None:
+        figure = AttributeDiagramFigure()
+    # Select data for the current period.
+    df_y = df[(df['year'] >= period_start) & (df['year'] < period_end)]
+    return figure.fig, figure.update(df_y)
+
+@instrument.timed('attribute_subplots.plot_measures')
+def plot_measures(metrics):
+    """
+    Create the 2×2 figure of Brier/Skill Score (plus bias) evolution over time.
+
+    Parameters:
+        metrics (dict): Per feature, lists of 'brier', 'skill', 'bias' and 'time_label'.
+
+    Returns:
+        Figure: The measures figure.
+    """
+    import matplotlib.pyplot as plt
+
     fig, axes = plt.subplots(2, 2, figsize=(16, 12))
     axes = axes.flatten()
     fig_num = ['(a)', '(b)', '(c)', '(d)']
@@ -235,8 +266,72 @@ def attribute_diagram(df, years):
         ax2.grid(True, which='both', axis='both', linestyle='-', color='green', alpha=0.2)
     
     plt.tight_layout()
-    plt.savefig(f"measures.pdf")
-    plt.show()
+    return fig
+
+@instrument.timed('attribute_subplots.attribute_diagram')
+def attribute_diagram(df, years, show=True, pdf_path="attribute_diagram.pdf", image_dir=None,
+                      image_formats=('png', 'svg'), isotonic=False):
+    """
+    Generate attribute diagrams and measure Score plots for multiple features over time.
+    - For each period (years[i] to years[i+1]-1) a 2×2 figure is created showing the attribute diagrams for
+      Technical, Reservoir, Source, and Trap. Every period is written as one page of pdf_path and, when
+      image_dir is given, as 'attribute_diagram_<start>-<end>.<format>' files.
+    - After processing all periods, a single 2×2 figure is created where each subplot shows the Brier/Skill Score
+      (plus bias) evolution over time for one feature. It is the last page of pdf_path and, when image_dir is
+      given, written as 'measures.<format>'.
+    - With show=False nothing is displayed and a single AttributeDiagramFigure is reused for all
+      periods (see batch_export for headless, parallel rendering).
+    - With isotonic=True every diagram also shows the binning-free CORP calibration curve.
+      
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    # This dictionary will store the Brier/Skill/Bias metrics per feature over the periods.
+    metrics = {fp: {'brier': [], 'skill': [], 'bias': [], 'time_label': []} for fp in feature_p}
+    
+    # Displayed figures are closed by plt.show(), so only a headless run can reuse one figure.
+    figure = None if show else AttributeDiagramFigure(isotonic=isotonic)
+    if image_dir is not None:
+        os.makedirs(image_dir, exist_ok=True)
+    
+    # ----- 1. For each period, create a 2x2 figure for attribute diagrams -----
+    with PdfPages(pdf_path) as pdf:
+        for period in range(len(years) - 1):
+            period_start = years[period]
+            period_end = years[period + 1]
+            fig, period_metrics = plot_period(df, period_start, period_end,
+                                              figure or AttributeDiagramFigure(isotonic=isotonic))
+            
+            # Store metrics for the later Brier/Skill Score plot.
+            for fp, stats in period_metrics.items():
+                metrics[fp]['brier'].append(stats['brier'])
+                metrics[fp]['skill'].append(stats['skill'])
+                metrics[fp]['bias'].append(stats['bias'])
+                metrics[fp]['time_label'].append(f"{period_start}-{period_end-1}")
+            
+            # Stream the period into the multi-page PDF (and the image set).
+            with instrument.stage('attribute_subplots.savefig'):
+                pdf.savefig(fig)
+                if image_dir is not None:
+                    for fmt in image_formats:
+                        fig.savefig(os.path.join(image_dir, f"attribute_diagram_{period_start}-{period_end-1}.{fmt}"))
+            if show:
+                plt.show()
+        if figure is not None:
+            plt.close(figure.fig)
+
+        # ----- 2. Create a single 2x2 figure for Brier/Skill Score plots -----
+        # It is the last page of pdf_path (and 'measures.<format>' in image_dir).
+        fig = plot_measures(metrics)
+        pdf.savefig(fig)
+        if image_dir is not None:
+            for fmt in image_formats:
+                fig.savefig(os.path.join(image_dir, f"measures.{fmt}"))
+        if show:
+            plt.show()
+        else:
+            plt.close(fig)
 
 # Example call:
 # (Make sure that "data" is defined as a DataFrame with columns such as
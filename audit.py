@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+import instrument
+import verification
+
+FACTOR_COLUMNS = ['Reservoir Probability', 'Source Probability', 'Trap Probability']
+TOTAL_COLUMN = 'Technical Probability'
+
+# Default tolerance on |total - product of factors|. The released probabilities have two
+# decimals, so a total rounded from the product can be off by up to 0.005.
+TOLERANCE = 0.01
+
+
+@instrument.timed('audit.audit_rows')
+def audit_rows(df, tolerance=TOLERANCE):
+    """
+    Check the reported total probability of every row against the product of its factors.
+
+    Parameters:
+        df (DataFrame): Reshaped frame (data_cleaning.data_reshape, optionally mapped with
+            map_npd), one row per prognosis.
+        tolerance (float): Largest |deviation| still counted as consistent.
+
+    Returns:
+        DataFrame: Indexed like df, with 'implied' (Reservoir * Source * Trap),
+        'deviation' (Technical - implied) and the flags 'missing' (a probability is
+        missing), 'out_of_range' (a probability outside [0, 1], e.g. given in percent)
+        and 'inconsistent' (|deviation| > tolerance; rows with missing or out-of-range
+        probabilities are never flagged inconsistent). 'implied' and 'deviation' are NaN
+        where a probability is missing.
+    """
+    factors = np.column_stack([verification.as_probabilities(df[c]) for c in FACTOR_COLUMNS])
+    total = verification.as_probabilities(df[TOTAL_COLUMN])
+    values = np.column_stack([total, factors])
+
+    implied = factors.prod(axis=1)
+    deviation = total - implied
+    missing = np.isnan(values).any(axis=1)
+    out_of_range = ((values < 0) | (values > 1)).any(axis=1)
+    return pd.DataFrame({
+        'implied': implied,
+        'deviation': deviation,
+        'missing': missing,
+        'out_of_range': out_of_range,
+        'inconsistent': ~missing & ~out_of_range & (np.abs(deviation) > tolerance),
+    }, index=df.index)
+
+
+@instrument.timed('audit.audit_table')
+def audit_table(df, by=('period',), years=None, tolerance=TOLERANCE):
+    """
+    Summarize the consistency audit per group, in one pass over the rows.
+
+    Besides the flag counts, the table relates the mismatch to the outcomes: the
+    discovery rate of consistent and inconsistent rows, and the Brier score of the
+    reported total next to that of the product of the factors.
+
+        audit_table(df_npd, by=['period', 'result NPD play'], years=[1990, 2006, 2023])
+
+    Parameters:
+        df (DataFrame): Reshaped frame (optionally mapped with map_npd).
+        by (list): Grouping columns, e.g. 'period', 'result NPD play' (see
+            verification.group_codes).
+        years (list): Period edges, required when grouping by 'period'.
+        tolerance (float): Largest |deviation| still counted as consistent.
+
+    Returns:
+        DataFrame: One row per group with the grouping keys, 'n', 'missing',
+        'out_of_range', 'inconsistent' (row counts), 'inconsistent_share',
+        'mean_deviation', 'mean_abs_deviation' and 'max_abs_deviation' (over the rows
+        with all probabilities in range), 'success_rate_consistent',
+        'success_rate_inconsistent', 'brier_reported' and 'brier_implied' (over the
+        checked rows with a known discovery outcome).
+    """
+    by = list(by)
+    codes, index = verification.group_codes(df, by, years)
+    rows = audit_rows(df, tolerance)
+    n_groups = len(index)
+    inside = codes >= 0
+    group = codes[inside]
+    rows = rows[inside]
+    discovery = df['discovery?'].to_numpy(dtype=float)[inside]
+    total = verification.as_probabilities(df[TOTAL_COLUMN])[inside]
+
+    def per_group(weights):
+        return np.bincount(group, weights=weights, minlength=n_groups)
+
+    missing, out_of_range = rows['missing'].to_numpy(), rows['out_of_range'].to_numpy()
+    inconsistent = rows['inconsistent'].to_numpy()
+    checked = ~missing & ~out_of_range
+    deviation = np.where(checked, rows['deviation'].to_numpy(), 0.0)
+    scored = checked & ~np.isnan(discovery)
+    success = np.where(scored, discovery == 1, False)
+    implied = rows['implied'].to_numpy()
+
+    n_checked = per_group(checked)
+    n_scored = per_group(scored)
+    n_consistent = per_group(scored & ~inconsistent)
+    n_inconsistent = per_group(scored & inconsistent)
+    max_abs = np.zeros(n_groups)
+    np.maximum.at(max_abs, group[checked], np.abs(deviation[checked]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        measures = {
+            'n': per_group(None).astype(int),
+            'missing': per_group(missing).astype(int),
+            'out_of_range': per_group(out_of_range).astype(int),
+            'inconsistent': per_group(inconsistent).astype(int),
+            'inconsistent_share': per_group(inconsistent) / n_checked,
+            'mean_deviation': per_group(deviation) / n_checked,
+            'mean_abs_deviation': per_group(np.abs(deviation)) / n_checked,
+            'max_abs_deviation': np.where(n_checked > 0, max_abs, np.nan),
+            'success_rate_consistent': per_group(success & ~inconsistent) / n_consistent,
+            'success_rate_inconsistent': per_group(success & inconsistent) / n_inconsistent,
+            'brier_reported': per_group(np.where(scored, (total - success) ** 2, 0.0)) / n_scored,
+            'brier_implied': per_group(np.where(scored, (implied - success) ** 2, 0.0)) / n_scored,
+        }
+
+    table = index.to_frame(index=False) if by else pd.DataFrame(index=range(1))
+    for name, values in measures.items():
+        table[name] = values
+    return table[table['n'] > 0].reset_index(drop=True)
@@ -0,0 +1,140 @@
+import importlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import instrument
+
+# Plotting module, output file names and reusable figure class per diagram kind.
+DIAGRAMS = {
+    'all': ('attribute_subplots', 'attribute_diagram', 'measures', 'AttributeDiagramFigure'),
+    'npd': ('attribute_npd_subplots', 'attribute_npd', 'measures_npd', 'NpdAttributeDiagramFigure'),
+}
+
+
+def _use_agg():
+    """Switch the worker process to the non-interactive Agg backend."""
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+
+def _save(fig, stem, formats, close=True):
+    import matplotlib.pyplot as plt
+    paths = [f'{stem}.{fmt}' for fmt in formats]
+    with instrument.stage('batch_export.savefig'):
+        for path in paths:
+            fig.savefig(path)
+    if close:
+        plt.close(fig)
+    return paths
+
+
+def _render_periods(kind, chunk, output_dir, formats, figure_options=None):
+    """Render a chunk of (df_y, start, end) periods on one reused figure."""
+    _use_agg()
+    import matplotlib.pyplot as plt
+    module_name, prefix, _, figure_class = DIAGRAMS[kind]
+    module = importlib.import_module(module_name)
+    figure = getattr(module, figure_class)(**(figure_options or {}))
+    results = []
+    for df_y, period_start, period_end in chunk:
+        fig, period_metrics = module.plot_period(df_y, period_start, period_end, figure)
+        _save(fig, os.path.join(output_dir, f'{prefix}_{period_start}-{period_end - 1}'), formats,
+              close=False)
+        results.append({key: {m: stats[m] for m in ('brier', 'skill', 'bias')}
+                        for key, stats in period_metrics.items()})
+    plt.close(figure.fig)
+    return results
+
+
+def _render_measures(kind, metrics, output_dir, formats):
+    _use_agg()
+    module_name, _, prefix, _ = DIAGRAMS[kind]
+    module = importlib.import_module(module_name)
+    return _save(module.plot_measures(metrics), os.path.join(output_dir, prefix), formats)
+
+
+def _render_risk_pie_chart(df_npd, output_dir, formats):
+    _use_agg()
+    import post_drill_risk
+    return _save(post_drill_risk.risk_pie_chart(df_npd, show=False),
+                 os.path.join(output_dir, 'risk_pie_chart'), formats)
+
+
+@instrument.timed('batch_export.export_attribute_diagrams')
+def export_attribute_diagrams(df, years, output_dir, kind='all', formats=('pdf',), processes=None,
+                              figure_options=None):
+    """
+    Render the per-period attribute diagrams and the measures plot without a display.
+
+    The periods are split into one contiguous chunk per worker process; each worker builds a
+    single figure on the Agg backend, redraws it for every period of its chunk and writes it
+    to output_dir as '<prefix>_<start>-<end>.<format>'. The measures plot is written once all
+    periods are done. Nothing is shown and the calling process never imports pyplot.
+
+    Parameters:
+        df (DataFrame): Reshaped data (mapped with map_npd.map_npd when kind is 'npd').
+        years (list): Period edges, as for attribute_diagram (at least two).
+        output_dir (str): Directory for the figure files (created if needed).
+        kind (str): 'all' for attribute_subplots or 'npd' for attribute_npd_subplots.
+        formats (tuple): File formats to write, e.g. ('pdf', 'png').
+        processes (int): Number of worker processes (default: number of CPUs).
+        figure_options (dict): Keyword arguments of the figure classes, e.g.
+            {'ci_method': 'wilson', 'confidence_level': 0.9}.
+
+    Returns:
+        dict: The Brier/Skill/Bias metrics per feature (or (region, feature)) over the periods,
+        as plotted in the measures figure.
+    """
+    periods = list(zip(years[:-1], years[1:]))
+    if not periods:
+        raise ValueError(f'Attribute diagrams need at least two year edges (one period), got {list(years)}')
+    os.makedirs(output_dir, exist_ok=True)
+    workers = min(processes or os.cpu_count() or 1, max(len(periods), 1))
+    size = -(-len(periods) // workers)
+    chunks = [periods[i:i + size] for i in range(0, len(periods), size)]
+    profile = instrument.profile_mode()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_use_agg) as pool:
+        # Ship every worker only the rows of its own periods.
+        futures = [
+            pool.submit(instrument.run_recorded, profile, _render_periods, kind,
+                        [(df[(df['year'] >= start) & (df['year'] < end)], start, end) for start, end in chunk],
+                        output_dir, formats, figure_options)
+            for chunk in chunks
+        ]
+        results = []
+        for future in futures:
+            chunk_results, records = future.result()
+            instrument.add_records(records)
+            results.extend(chunk_results)
+        metrics = {}
+        for (start, end), period_stats in zip(periods, results):
+            for key, stats in period_stats.items():
+                series = metrics.setdefault(key, {'brier': [], 'skill': [], 'bias': [], 'time_label': []})
+                for m in ('brier', 'skill', 'bias'):
+                    series[m].append(stats[m])
+                series['time_label'].append(f'{start}-{end - 1}')
+        _, records = pool.submit(instrument.run_recorded, profile, _render_measures, kind, metrics, output_dir,
+                                 formats).result()
+        instrument.add_records(records)
+    return metrics
+
+
+@instrument.timed('batch_export.export_risk_pie_chart')
+def export_risk_pie_chart(df_npd, output_dir, formats=('pdf',)):
+    """
+    Render post_drill_risk.risk_pie_chart on the Agg backend and write it to output_dir.
+
+    Parameters:
+        df_npd (DataFrame): Non-replicated data mapped with map_npd.map_npd.
+        output_dir (str): Directory for the figure files (created if needed).
+        formats (tuple): File formats to write.
+
+    Returns:
+        list: Paths of the written files.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=1, initializer=_use_agg) as pool:
+        paths, records = pool.submit(instrument.run_recorded, instrument.profile_mode(), _render_risk_pie_chart,
+                                     df_npd, output_dir, formats).result()
+    instrument.add_records(records)
+    return paths
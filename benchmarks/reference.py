@@ -0,0 +1,332 @@
+"""
+Reference implementations for the benchmarks: the original row-by-row code of
+data_cleaning.data_reshape, data_cleaning_no_replicate.data_reshape, map_npd.map_npd and
+the per-bin loop of the attribute diagrams, kept verbatim so the vectorized code can be
+checked against them.
+"""
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+
+def data_reshape(data):
+    # dropping the first row
+    data = data.drop(0)
+
+    # Separate observed and prognosis data
+    data_obs = data[data['Prognosis - Result'].str.upper() != 'PROGNOSIS']
+    data_prog = data[data['Prognosis - Result'].str.upper() != 'RESULT']
+
+    # Find common well IDs
+    well_ids_common = np.intersect1d(pd.unique(data_obs['Well name']), pd.unique(data_prog['Well name']))
+
+    # Initialize lists
+    well_prospect_ids = []
+    technical_probs, reservoir_probs, source_probs, trap_probs = [], [], [], []
+    discovery, reservoir, source, trap, years = [], [], [], [], []
+    npd_play_obs = []
+    npd_play_prog = []
+
+    # Process data
+    for w in well_ids_common:
+        wells_obs = data_obs[data_obs['Well name'] == w]
+        wells_prog = data_prog[data_prog['Well name'] == w]
+        prospect_ids = np.intersect1d(pd.unique(wells_obs['Prospect name']), pd.unique(wells_prog['Prospect name']))
+
+        for p in prospect_ids:
+            prospects_obs = wells_obs[wells_obs['Prospect name'] == p]
+            prospects_prog = wells_prog[wells_prog['Prospect name'] == p]
+
+            # well-prospect names
+            well_prospect_ids.append([w, p])
+            # Probabilities
+            technical_probs.append(list(prospects_prog["Probability Technical Total"]))
+            reservoir_probs.append(list(prospects_prog["Probability Techn Reservoir"]))
+            source_probs.append(list(prospects_prog["Probability Techn Source"]))
+            trap_probs.append(list(prospects_prog["Probability Techn Trap"]))
+
+            # Discovery and geological factors
+            discovery.append(list(prospects_obs["Discovery?"]))
+            reservoir.append(list(prospects_obs["OK Reservoir?"]))
+            source.append(list(prospects_obs["OK Source/ Charge?"]))
+            trap.append(list(prospects_obs["OK Trap?"]))
+
+            # Years
+            years.append([int(str(d)[:4]) for d in prospects_obs['Completion date']])
+
+            # NPD Plays
+            npd_play_obs.append(list(prospects_obs["NPD Play"]))
+            npd_play_prog.append(list(prospects_prog["NPD Play"]))
+
+
+    # Convert categorical data to binary
+    def convert_to_binary(lst, mapping):
+        for sublist in lst:
+            if isinstance(sublist[0], str):
+                sublist[0] = mapping.get(sublist[0].upper(), sublist[0])
+
+    mapping = {'YES': 1, 'NO': 0, 'OK': 1, 'FAIL': 0}
+    for lst in [discovery, reservoir, source, trap]:
+        convert_to_binary(lst, mapping)
+
+    # Handle multiple prognoses by duplicating observed data
+    multi_prognosis_indices = [i for i, x in enumerate(technical_probs) if len(x) > 1]
+    for idx in reversed(multi_prognosis_indices):
+        for _ in range(len(technical_probs[idx]) - 1):
+            well_prospect_ids.insert(idx, well_prospect_ids[idx])
+            discovery.insert(idx, discovery[idx])
+            reservoir.insert(idx, reservoir[idx])
+            source.insert(idx, source[idx])
+            trap.insert(idx, trap[idx])
+            years.insert(idx, years[idx])
+            npd_play_obs.insert(idx, npd_play_obs[idx])
+
+    # Flatten lists
+    flatten = lambda lst: list(chain.from_iterable(lst))
+    dict_total = {
+        'well_prospect': well_prospect_ids,
+        'year': flatten(years),
+        'result NPD play':flatten(npd_play_obs),
+        'prognosis NPD play':flatten(npd_play_prog),
+        'Technical Probability': flatten(technical_probs),
+        'Reservoir Probability': flatten(reservoir_probs),
+        'Source Probability': flatten(source_probs),
+        'Trap Probability': flatten(trap_probs),
+        'discovery?': flatten(discovery),
+        'reservoir?': flatten(reservoir),
+        'source?': flatten(source),
+        'trap?': flatten(trap)
+    }
+
+    df = pd.DataFrame(dict_total)
+
+    # Clean up placeholders
+    def clean_placeholders(row):
+        if row['discovery?'] == 1:
+            for col in ['reservoir?', 'source?', 'trap?']:
+                if pd.isna(row[col]):
+                    row[col] = 1
+        return row
+
+    df = df.apply(clean_placeholders, axis=1)
+
+    # Remove invalid data
+    df = df[df[['Technical Probability', 'Reservoir Probability', 'Source Probability', 'Trap Probability']].notna().all(axis=1)]
+    df = df[df[['reservoir?', 'source?', 'trap?', 'discovery?']].isin([0, 1]).all(axis=1)]
+
+    # Reset index
+    df = df.reset_index(drop=True)
+    len(df)
+    return df
+
+
+def data_reshape_no_replicate(data):
+    # Load data
+    #data = pd.read_excel('PrognosisResultData_All_3Q2023_v1_anonymized_modified2.xlsx').drop(0)
+
+    # Separate observed and prognosis data
+    data_obs = data[data['Prognosis - Result'].str.upper() != 'PROGNOSIS']
+    data_prog = data[data['Prognosis - Result'].str.upper() != 'RESULT']
+
+    # Find common well IDs
+    well_ids_common = np.intersect1d(pd.unique(data_obs['Well name']), pd.unique(data_prog['Well name']))
+
+    # Initialize lists
+    well_prospect_ids = []
+    technical_probs, reservoir_probs, source_probs, trap_probs = [], [], [], []
+    discovery, reservoir, source, trap, years = [], [], [], [], []
+    npd_play_obs = []
+    npd_play_prog = []
+
+    # Process data
+    for w in well_ids_common:
+        wells_obs = data_obs[data_obs['Well name'] == w]
+        wells_prog = data_prog[data_prog['Well name'] == w]
+        prospect_ids = np.intersect1d(pd.unique(wells_obs['Prospect name']), pd.unique(wells_prog['Prospect name']))
+
+        for p in prospect_ids:
+            prospects_obs = wells_obs[wells_obs['Prospect name'] == p]
+            prospects_prog = wells_prog[wells_prog['Prospect name'] == p]
+
+            # well-prospect names
+            well_prospect_ids.append([w, p])
+            # Probabilities
+            technical_probs.append(list(prospects_prog["Probability Technical Total"]))
+            reservoir_probs.append(list(prospects_prog["Probability Techn Reservoir"]))
+            source_probs.append(list(prospects_prog["Probability Techn Source"]))
+            trap_probs.append(list(prospects_prog["Probability Techn Trap"]))
+
+            # Discovery and geological factors
+            discovery.append(list(prospects_obs["Discovery?"]))
+            reservoir.append(list(prospects_obs["OK Reservoir?"]))
+            source.append(list(prospects_obs["OK Source/ Charge?"]))
+            trap.append(list(prospects_obs["OK Trap?"]))
+
+            # Years
+            years.append([int(str(d)[:4]) for d in prospects_obs['Completion date']])
+
+            # NPD Plays
+            npd_play_obs.append(list(prospects_obs["NPD Play"]))
+            npd_play_prog.append(list(prospects_prog["NPD Play"]))
+
+
+    # Convert categorical data to binary
+    def convert_to_binary(lst, mapping):
+        for sublist in lst:
+            if isinstance(sublist[0], str):
+                sublist[0] = mapping.get(sublist[0].upper(), sublist[0])
+
+    mapping = {'YES': 1, 'NO': 0, 'OK': 1, 'FAIL': 0}
+    for lst in [discovery, reservoir, source, trap]:
+        convert_to_binary(lst, mapping)
+
+
+
+    # Flatten lists
+    flatten = lambda lst: list(chain.from_iterable(lst))
+
+    dict_total = {
+        'well_prospect': well_prospect_ids,
+        'year': flatten(years),
+        'result NPD play':flatten(npd_play_obs),
+        'prognosis NPD play':npd_play_prog,
+        'Technical Probability': technical_probs,
+        'Reservoir Probability': reservoir_probs,
+        'Source Probability': source_probs,
+        'Trap Probability': trap_probs,
+        'discovery?': flatten(discovery),
+        'reservoir?': flatten(reservoir),
+        'source?': flatten(source),
+        'trap?': flatten(trap)
+    }
+
+    df = pd.DataFrame(dict_total)
+
+    # Clean up placeholders
+    def clean_placeholders(row):
+        if row['discovery?'] == 1:
+            for col in ['reservoir?', 'source?', 'trap?']:
+                if pd.isna(row[col]):
+                    row[col] = 1
+        return row
+
+    df = df.apply(clean_placeholders, axis=1)
+
+    # Remove invalid data
+    #df = df[df[['Technical Probability', 'Reservoir Probability', 'Source Probability', 'Trap Probability']].notna().all(axis=1)]
+    df = df[df[['reservoir?', 'source?', 'trap?', 'discovery?']].isin([0, 1]).all(axis=1)]
+    df = df.drop(df[df['discovery?'] == 1].index)
+
+    # Reset index
+    df = df.reset_index(drop=True)
+    len(df)
+    return df
+
+
+def map_npd(df):
+    """
+    this function map npd plays to their region (north, norwegian, or barent sea)
+
+    """
+    # Create a copy of the input DataFrame to avoid modifying the original data.
+    df_info = df.copy()
+
+    # Convert string values to lowercase in the specified columns.
+    df_info['result NPD play'] = df_info['result NPD play'].apply(
+        lambda x: x.lower() if isinstance(x, str) else x
+    )
+    df_info['prognosis NPD play'] = df_info['prognosis NPD play'].apply(
+        lambda x: x.lower() if isinstance(x, str) else x
+    )
+
+    # Reset the index and drop the old index.
+    df_info.reset_index(drop=True, inplace=True)
+
+    # Define the lists of plays corresponding to each region.
+    north_sea = [
+        'neo/frigg-1', 'neo/grid-1', 'nol-1', 'npc-1', 'npc-2', 'npc-3', 'npc-4', 'npc-5',
+        'nsbku-1', 'nkl-2', 'nku-2', 'nku-3', 'nku-4', 'nku-5', 'nju-1', 'nju-2', 'nju-3',
+        'njl,jm-1', 'njl,jm-2', 'njl,jm-3', 'njl,jm-4', 'njl,jm-5', 'njm-1', 'nru,jm-1',
+        'npl-1', 'npl-2', 'nkl-x', 'nku-x', 'nmi-1', 'nju-'
+    ]
+    
+    norwegian_sea = [
+        'nhjj-x', 'nhru-x', 'nheo-x', 'nhplei-1', 'nhpc-1', 'nhpc-2', 'nhpc-4', 'nhku-2',
+        'nhku-3', 'nhku-4', 'nhku-5', 'nhku-6', 'nhkl-2', 'nhkl-3', 'nhju-1', 'nhju-2',
+        'nhjm-1', 'nhjl,jm-1', 'nhjl,jm-2', 'nhjl,jm-3', 'nhpp,rr-1', 'nhpe-x', 'hju-1'
+    ]
+    
+    barents_sea = [
+        'beo-1', 'bpc-1', 'bju,kl-3', 'bku-x', 'bjl,jm-5', 'bjl,jm-6', 'bjl,jm-7', 'brl,rm-4',
+        'brl,rm-5', 'brl-1', 'bru-1', 'bru-2', 'bpm,pu-4', 'bpm,pu-5', 'bpm,pu-7', 'bpu-4',
+        'bcu,pl-3', 'bcu,pl-4', 'bcu,pp-4', 'bcu,pp-5', 'bcu,pp-7', 'bcl-3', 'bcl-4',
+        'bpu-x', 'bpl-x'
+    ]
+
+    # Helper function to map a play value to its region.
+    def map_region(value):
+        if isinstance(value, str):
+            if value in north_sea:
+                return 'north sea'
+            elif value in norwegian_sea:
+                return 'norwegian sea'
+            elif value in barents_sea:
+                return 'barents sea'
+        return value
+
+    # Apply the mapping to both 'result NPD play' and 'prognosis NPD play' columns.
+    df_info['result NPD play'] = df_info['result NPD play'].apply(map_region)
+    df_info['prognosis NPD play'] = df_info['prognosis NPD play'].apply(map_region)
+
+    return df_info
+
+
+def verification_metrics(probs, discovs, bins_num=10, width=0.1):
+    # Initialize lists for bin calculations.
+    probs = np.asarray(probs, dtype=float)
+    discovs = np.asarray(discovs, dtype=float)
+    success_mean = np.mean(discovs)
+    extra_bin = bins_num  # extra bin for probability == 1
+    succ_well_per_bin = [0] * (bins_num + 1)
+    sum_probs_per_bin = [0] * (bins_num + 1)
+    count_per_bin = [0] * (bins_num + 1)
+
+    # Bin the forecast probabilities and count successes.
+    for prob, discov in zip(probs, discovs):
+        if prob == 1.0:
+            bin_idx = extra_bin
+        elif 0.9 < prob < 1:
+            bin_idx = bins_num - 1
+        else:
+            bin_idx = min(int((prob - 0.001) / width), bins_num - 1)
+        sum_probs_per_bin[bin_idx] += prob
+        count_per_bin[bin_idx] += 1
+        if discov == 1:
+            succ_well_per_bin[bin_idx] += 1
+
+    avg_probs = [
+        sum_probs_per_bin[i] / count_per_bin[i] if count_per_bin[i] > 0 else 0
+        for i in range(bins_num + 1)
+    ]
+    succ_rate_bin = [
+        succ_well_per_bin[i] / count_per_bin[i] if count_per_bin[i] > 0 else 0
+        for i in range(bins_num + 1)
+    ]
+
+    # --- Attribute measures ---
+    brier = np.mean((probs - discovs) ** 2)
+    rel = np.sum([
+        (count_per_bin[i] * (avg_probs[i] - succ_rate_bin[i]) ** 2)
+        for i in range(bins_num + 1) if count_per_bin[i] > 0
+    ]) / len(probs)
+    res = np.sum([
+        (count_per_bin[i] * (succ_rate_bin[i] - success_mean) ** 2)
+        for i in range(bins_num + 1) if count_per_bin[i] > 0
+    ]) / len(probs)
+    variance = np.var(discovs, ddof=1)
+    skill = (res - rel) / variance if variance > 0 else 0
+    bias0 = np.mean(probs - discovs)
+    return {'count_per_bin': count_per_bin, 'succ_well_per_bin': succ_well_per_bin,
+            'avg_probs': avg_probs, 'succ_rate_bin': succ_rate_bin,
+            'brier': brier, 'rel': rel, 'res': res, 'skill': skill, 'bias': bias0}
@@ -0,0 +1,310 @@
+"""
+Time and memory-profile the public functions on synthetic NCS data.
+
+    python benchmarks/run.py --scales 1 10 100 --save benchmarks/results/baseline.json
+    python benchmarks/run.py --scales 1 10 100 --compare benchmarks/results/baseline.json
+
+Every function runs on synthetic.make_prognosis_data at each scale (1 is about the size of
+the released data). Up to --reference-max-scale the outputs are also checked against the
+original row-by-row code in benchmarks/reference.py. Results (seconds, peak traced memory,
+rows and an output digest per function and scale) are written as JSON; with --compare the
+run fails when a function got slower or bigger than the baseline by more than --tolerance,
+or when its output digest changed.
+"""
+import argparse
+import gc
+import hashlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import reference  # noqa: E402
+import synthetic  # noqa: E402
+
+YEARS = [1990, 1996, 2002, 2011, 2016, 2022]
+
+
+def _digest(output):
+    """Hash of a function output, to detect changed results between runs."""
+    if isinstance(output, pd.DataFrame):
+        # Text form, since the reshaped frames hold lists of plays.
+        values = pd.util.hash_pandas_object(output.astype(str), index=False).to_numpy()
+        return hashlib.sha256(values.tobytes() + str(list(output.columns)).encode()).hexdigest()[:16]
+    return None
+
+
+def _rows(output):
+    return len(output) if isinstance(output, pd.DataFrame) else None
+
+
+def _measure(func, arg, repeat=1):
+    """
+    Return the output of func(arg), its fastest wall time in seconds over `repeat` runs and
+    its peak traced memory in MB. Memory is traced in a separate run, since tracemalloc
+    slows the code down.
+    """
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        output = func(arg)
+        timings.append(time.perf_counter() - start)
+    del output
+    gc.collect()
+    tracemalloc.start()
+    output = func(arg)
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return output, min(timings), peak
+
+
+def _plot_period(df, module):
+    import matplotlib.pyplot as plt
+    fig, _ = module.plot_period(df, YEARS[0], YEARS[-1])
+    plt.close(fig)
+
+
+def _risk_pie_chart(df_npd):
+    import matplotlib.pyplot as plt
+    import post_drill_risk
+    plt.close(post_drill_risk.risk_pie_chart(df_npd, show=False))
+
+
+def cases():
+    """
+    Benchmarked functions as (name, input, function): input names the frame the function
+    takes ('data' the raw rows, 'df' the reshaped frame, 'df_nr' the reshape without
+    replicated prognoses, 'df_npd' and 'df_nr_npd' their region-mapped versions).
+    """
+    import accumulator
+    import audit
+    import attribute_npd_subplots
+    import attribute_subplots
+    import calibration
+    import cube
+    import data_cleaning
+    import data_cleaning_no_replicate
+    import isotonic
+    import map_npd
+    import permutation
+    import portfolio
+    import post_drill_risk
+    import rolling
+    import verification
+
+    return [
+        ('data_cleaning.data_reshape', 'data', data_cleaning.data_reshape),
+        ('data_cleaning_no_replicate.data_reshape', 'data', data_cleaning_no_replicate.data_reshape),
+        ('map_npd.map_npd', 'df', map_npd.map_npd),
+        ('data_cleaning.compact_frame', 'df_nr', data_cleaning.compact_frame),
+        ('verification.metrics_table', 'df_npd',
+         lambda df: verification.metrics_table(df, by=['period', 'result NPD play'], years=YEARS)),
+        ('isotonic.corp_table', 'df_npd',
+         lambda df: isotonic.corp_table(df, by=['period', 'result NPD play'], years=YEARS)),
+        ('audit.audit_table', 'df_npd',
+         lambda df: audit.audit_table(df, by=['period', 'result NPD play'], years=YEARS)),
+        ('rolling.rolling_metrics', 'df', lambda df: rolling.rolling_metrics(df, length=5, start=1990, stop=2023)),
+        ('accumulator.BinAccumulator.from_frame', 'df',
+         lambda df: accumulator.BinAccumulator.from_frame(df, by=('year',)).metrics(by=())),
+        ('cube.MetricsCube.from_frame', 'df', cube.MetricsCube.from_frame),
+        ('permutation.permutation_tests', 'df_npd',
+         lambda df: permutation.permutation_tests(df, compare='period', by=['result NPD play'], years=YEARS,
+                                                  n_perm=1000, seed=0, processes=1)),
+        ('portfolio.simulate_portfolio', 'df_npd',
+         lambda df: portfolio.simulate_portfolio(df, by=['period', 'result NPD play'], years=YEARS, n_scenarios=1000,
+                                                 seed=0, processes=1)),
+        ('calibration.CalibrationModel', 'df',
+         lambda df: calibration.CalibrationModel.fit(df, by=['result NPD play'], method='isotonic').score(df)),
+        ('attribute_subplots.plot_period', 'df', lambda df: _plot_period(df, attribute_subplots)),
+        ('attribute_npd_subplots.plot_period', 'df_npd', lambda df: _plot_period(df, attribute_npd_subplots)),
+        ('post_drill_risk.failure_reasons', 'df_nr_npd',
+         lambda df: post_drill_risk.failure_reasons(df, by=['result NPD play', 'period'], years=YEARS)),
+        ('post_drill_risk.risk_pie_chart', 'df_nr_npd', _risk_pie_chart),
+    ]
+
+
+def _reference_metrics(df):
+    """metrics_table of (period, result NPD play) computed with the reference bin loop."""
+    import verification
+    rows = []
+    period = verification.period_labels(df['year'], YEARS)
+    for (label, play), group in df.groupby([period, 'result NPD play'], sort=True, observed=True):
+        for feature, outcome in verification.FEATURES.items():
+            probs = group[f'{feature} Probability'].to_numpy(dtype=float)
+            discovs = group[outcome].to_numpy(dtype=float)
+            valid = ~np.isnan(probs) & ~np.isnan(discovs)
+            if valid.any():
+                m = reference.verification_metrics(probs[valid], discovs[valid])
+                rows.append({'period': label, 'result NPD play': play, 'feature': feature, 'n': int(valid.sum()),
+                             **{k: m[k] for k in ('brier', 'rel', 'res', 'skill', 'bias')}})
+    return pd.DataFrame(rows)
+
+
+def check_reference(data, frames):
+    """Compare the vectorized outputs with the reference implementations; return failures."""
+    from pandas.testing import assert_frame_equal
+    failures = []
+
+    def compare(name, expected, actual, **kwargs):
+        try:
+            assert_frame_equal(expected.reset_index(drop=True), actual.reset_index(drop=True), **kwargs)
+        except AssertionError as error:
+            failures.append(f'{name}: {str(error).splitlines()[0]}')
+
+    compare('data_cleaning.data_reshape', reference.data_reshape(data), frames['df'], check_dtype=False)
+    compare('data_cleaning_no_replicate.data_reshape', reference.data_reshape_no_replicate(data), frames['df_nr'],
+            check_dtype=False)
+    compare('map_npd.map_npd', reference.map_npd(frames['df'].copy()), frames['df_npd'].astype(
+        {c: object for c in frames['df_npd'].select_dtypes('category').columns}), check_dtype=False)
+
+    import verification
+    with warnings.catch_warnings():
+        # The reference takes the variance of single-forecast groups.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        expected = _reference_metrics(frames['df_npd'])
+    actual = verification.metrics_table(frames['df_npd'], by=['period', 'result NPD play'], years=YEARS)
+    keys = ['period', 'result NPD play', 'feature']
+    expected, actual = (t.astype({'period': str, 'result NPD play': str})[list(expected.columns)].sort_values(keys)
+                        for t in (expected, actual))
+    compare('verification.metrics_table', expected, actual, check_dtype=False, rtol=1e-9)
+    return failures
+
+
+def run(scales, repeat=1, reference_max_scale=1.0, seed=0):
+    """
+    Benchmark every case at every scale.
+
+    Returns:
+        dict: {'meta': ..., 'results': [{'function', 'scale', 'input_rows', 'output_rows',
+        'seconds', 'peak_mb', 'digest'}, ...], 'reference': {scale: [failures]}}.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import data_cleaning
+    import data_cleaning_no_replicate
+    import map_npd
+
+    # Warm up (imports, font caches) so the first scale is not charged for it.
+    warm = synthetic.make_prognosis_data(0.05, seed=seed)
+    warm = {'data': warm, 'df': data_cleaning.data_reshape(warm),
+            'df_nr': data_cleaning_no_replicate.data_reshape(warm)}
+    warm['df_npd'], warm['df_nr_npd'] = map_npd.map_npd(warm['df']), map_npd.map_npd(warm['df_nr'])
+    for _, source, func in cases():
+        func(warm[source])
+
+    results, checks = [], {}
+    for scale in scales:
+        start = time.perf_counter()
+        data = synthetic.make_prognosis_data(scale, seed=seed)
+        print(f'scale {scale:g}: {len(data)} rows generated in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+        frames = {'data': data}
+        frames['df'] = data_cleaning.data_reshape(data)
+        frames['df_nr'] = data_cleaning_no_replicate.data_reshape(data)
+        frames['df_npd'] = map_npd.map_npd(frames['df'])
+        frames['df_nr_npd'] = map_npd.map_npd(frames['df_nr'])
+
+        for name, source, func in cases():
+            output, seconds, peak = _measure(func, frames[source], repeat)
+            results.append({
+                'function': name,
+                'scale': scale,
+                'input_rows': len(frames[source]),
+                'output_rows': _rows(output),
+                'seconds': seconds,
+                'peak_mb': peak,
+                'digest': _digest(output),
+            })
+            print(f'  {name:<42} {seconds:9.3f}s {peak:9.1f} MB', file=sys.stderr)
+
+        if scale <= reference_max_scale:
+            checks[str(scale)] = check_reference(data, frames)
+            status = 'ok' if not checks[str(scale)] else f'{len(checks[str(scale)])} mismatch(es)'
+            print(f'  reference check: {status}', file=sys.stderr)
+
+    meta = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'seed': seed,
+        'repeat': repeat,
+    }
+    return {'meta': meta, 'results': results, 'reference': checks}
+
+
+def compare(report, baseline, tolerance=1.5, min_seconds=0.05):
+    """
+    List the regressions of report against a baseline report.
+
+    A function regresses when it is more than `tolerance` times slower (ignoring timings
+    below min_seconds, which are mostly noise) or uses more than `tolerance` times the
+    peak memory, or when its output digest changed at the same scale and seed.
+    """
+    old = {(r['function'], r['scale']): r for r in baseline['results']}
+    regressions = []
+    for r in report['results']:
+        b = old.get((r['function'], r['scale']))
+        if b is None:
+            continue
+        label = f"{r['function']} at scale {r['scale']:g}"
+        if r['seconds'] > tolerance * max(b['seconds'], min_seconds):
+            regressions.append(f"{label}: {b['seconds']:.3f}s -> {r['seconds']:.3f}s")
+        if r['peak_mb'] > tolerance * max(b['peak_mb'], 1.0):
+            regressions.append(f"{label}: {b['peak_mb']:.1f} MB -> {r['peak_mb']:.1f} MB")
+        if b['digest'] != r['digest'] and baseline['meta'].get('seed') == report['meta']['seed']:
+            regressions.append(f'{label}: output changed')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10, 100],
+                        help='Data sizes relative to the released data (default: %(default)s; 1000 is about '
+                             '4.5 million rows and needs several GB of memory).')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per function; the fastest is kept.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data.')
+    parser.add_argument('--reference-max-scale', type=float, default=1.0,
+                        help='Check outputs against the reference code up to this scale (default: %(default)s).')
+    parser.add_argument('--save', metavar='JSON', help='Write the results to JSON.')
+    parser.add_argument('--compare', metavar='JSON', help='Baseline results to check for regressions.')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='Allowed slowdown/memory growth factor against the baseline (default: %(default)s).')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Plotting functions may write files next to the working directory.
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            report = run(args.scales, args.repeat, args.reference_max_scale, args.seed)
+        finally:
+            os.chdir(cwd)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    failed = [f'reference at scale {s}: {m}' for s, ms in report['reference'].items() for m in ms]
+    if args.compare:
+        with open(args.compare) as f:
+            failed += compare(report, json.load(f), args.tolerance)
+    for message in failed:
+        print(message, file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import instrument
+import verification
+
+
+def _replicate_chunk(probs, outcomes, bins, n_rep, seed, bins_num, measures):
+    """
+    Measures of n_rep bootstrap replicates of one group/feature cell.
+
+    The resamples are drawn as one (n_rep, n) index matrix and all replicates are binned
+    with a single bincount over (replicate, bin) cells.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(probs)
+    n_bins = bins_num + 1
+    idx = rng.integers(0, n, size=(n_rep, n))
+    cells = (np.arange(n_rep)[:, None] * n_bins + bins[idx]).ravel()
+    size = n_rep * n_bins
+    shape = (n_rep, n_bins)
+    stats = verification.metrics_from_stats(
+        np.bincount(cells, minlength=size).reshape(shape),
+        np.bincount(cells, weights=probs[idx].ravel(), minlength=size).reshape(shape),
+        np.bincount(cells, weights=outcomes[idx].ravel(), minlength=size).reshape(shape),
+        np.bincount(cells, weights=((probs - outcomes) ** 2)[idx].ravel(), minlength=size).reshape(shape),
+    )
+    return {m: stats[m] for m in measures}
+
+
+@instrument.timed('bootstrap.bootstrap_metrics')
+def bootstrap_metrics(df, by=('period',), years=None, features=None, n_boot=10000, confidence_level=0.9,
+                      measures=('brier', 'skill', 'bias'), bins_num=10, width=None, seed=None,
+                      processes=None, max_elements=2_000_000):
+    """
+    Percentile bootstrap intervals of the verification measures per group and feature.
+
+    The (probability, outcome) pairs of every group/feature cell are resampled with
+    replacement. Replicates are drawn in chunks of at most max_elements resampled pairs
+    so memory stays bounded, and the chunks are spread over worker processes. Every
+    chunk gets its own child of one SeedSequence, so results depend on seed but not on
+    the number of processes.
+
+        bootstrap_metrics(df_npd, by=['period', 'result NPD play'], years=[1990, 2006, 2023])
+
+    Parameters:
+        df (DataFrame): Reshaped frame (optionally mapped with map_npd).
+        by (list): Grouping columns, as for verification.metrics_table.
+        years (list): Period edges, required when grouping by 'period'.
+        features (list): Features to score (default: Technical, Reservoir, Source, Trap).
+        n_boot (int): Number of bootstrap replicates.
+        confidence_level (float): Coverage of the percentile intervals.
+        measures (tuple): Measures to bootstrap (see verification.metrics_from_stats).
+        bins_num (int): Number of regular bins.
+        width (float): Bin width (default: 1 / bins_num).
+        seed (int): Seed of the random generator.
+        processes (int): Worker processes (default: number of CPUs; 1 runs in-process).
+        max_elements (int): Resampled pairs per chunk.
+
+    Returns:
+        DataFrame: verification.metrics_table columns for the grouping keys, 'feature', 'n'
+        and the measures, plus '<measure>_lower' and '<measure>_upper' for every measure.
+    """
+    by = list(by)
+    measures = list(measures)
+    features = list(verification.FEATURES) if features is None else list(features)
+    table = verification.metrics_table(df, by, years, features, bins_num, width)
+    table = table[by + ['feature', 'n'] + measures]
+
+    # Group the stacked forecasts by (group, feature) cell, as metrics_table does.
+    codes, _ = verification.group_codes(df, by, years)
+    probs, outcomes, cells = verification.stacked_forecasts(df, codes, features)
+    bins = verification.bin_index(probs, bins_num, width)
+    order = np.argsort(cells, kind='stable')
+    splits = np.flatnonzero(np.diff(cells[order])) + 1
+    groups = np.split(order, splits) if len(order) else []
+
+    # One task per (cell, chunk of replicates).
+    tasks = []
+    for cell, rows in enumerate(groups):
+        chunk = max(1, max_elements // len(rows))
+        for start in range(0, n_boot, chunk):
+            tasks.append((cell, rows, min(chunk, n_boot - start)))
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+    args = [(probs[rows], outcomes[rows], bins[rows], n_rep, s, bins_num, measures)
+            for (_, rows, n_rep), s in zip(tasks, seeds)]
+
+    workers = processes or os.cpu_count() or 1
+    if workers == 1 or len(tasks) <= 1:
+        results = [_replicate_chunk(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_replicate_chunk, *zip(*args)))
+
+    # Percentile intervals per cell (cells follow the row order of the table).
+    alpha = (1 - confidence_level) / 2
+    replicates = [{m: [] for m in measures} for _ in groups]
+    for (cell, _, _), result in zip(tasks, results):
+        for m in measures:
+            replicates[cell][m].append(result[m])
+    table = table.reset_index(drop=True)
+    for m in measures:
+        bounds = np.array([np.nanpercentile(np.concatenate(r[m]), [100 * alpha, 100 * (1 - alpha)])
+                           for r in replicates]).reshape(-1, 2)
+        table[f'{m}_lower'] = bounds[:, 0]
+        table[f'{m}_upper'] = bounds[:, 1]
+    return table
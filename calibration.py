@@ -0,0 +1,290 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+import instrument
+import isotonic
+import verification
+
+# Bump whenever the on-disk layout below changes.
+SCHEMA_VERSION = 1
+
+METHODS = ('binned', 'isotonic', 'logistic')
+
+# Forecasts of exactly 0 or 1 are moved this far inside (0, 1) before taking their logit.
+LOGIT_EPS = 1e-6
+
+
+def _logit(probs):
+    probs = np.clip(probs, LOGIT_EPS, 1 - LOGIT_EPS)
+    return np.log(probs / (1 - probs))
+
+
+def _sigmoid(eta):
+    return np.exp(-np.logaddexp(0, -eta))
+
+
+def _fit_logistic(cell, forecast, count, succ, n_cells, ridge, max_iter=100, tol=1e-10):
+    """
+    Fit P(success) = sigmoid(a + b * logit(forecast)) for every cell at once.
+
+    All cells take their Newton steps together, with the gradients and 2x2 Hessians
+    accumulated per cell with bincount; a cell's step is halved until it lowers the
+    cell's objective. The penalty ridge / 2 * (a^2 + (b - 1)^2) shrinks the fit
+    towards the identity mapping (a = 0, b = 1), which keeps cells without failures
+    (or without successes) finite.
+
+    Returns:
+        ndarray: Coefficients of shape (n_cells, 2).
+    """
+    z = _logit(forecast)
+    a, b = np.zeros(n_cells), np.ones(n_cells)
+
+    def per_cell(weights):
+        return np.bincount(cell, weights=weights, minlength=n_cells)
+
+    def objective(a, b):
+        eta = a[cell] + b[cell] * z
+        return per_cell(count * np.logaddexp(0, eta) - succ * eta) + ridge / 2 * (a ** 2 + (b - 1) ** 2)
+
+    current = objective(a, b)
+    for _ in range(max_iter):
+        mu = _sigmoid(a[cell] + b[cell] * z)
+        residual = count * mu - succ
+        weight = count * mu * (1 - mu)
+        g_a, g_b = per_cell(residual) + ridge * a, per_cell(residual * z) + ridge * (b - 1)
+        h_aa, h_ab, h_bb = per_cell(weight) + ridge, per_cell(weight * z), per_cell(weight * z * z) + ridge
+        det = h_aa * h_bb - h_ab ** 2
+        step_a = (h_bb * g_a - h_ab * g_b) / det
+        step_b = (h_aa * g_b - h_ab * g_a) / det
+        scale = np.ones(n_cells)
+        for _ in range(50):
+            new = objective(a - scale * step_a, b - scale * step_b)
+            worse = new > current
+            if not worse.any():
+                break
+            scale = np.where(worse, scale / 2, scale)
+        step_a, step_b = scale * step_a, scale * step_b
+        a, b, current = a - step_a, b - step_b, new
+        if max(np.abs(step_a).max(initial=0), np.abs(step_b).max(initial=0)) < tol:
+            break
+    return np.column_stack([a, b])
+
+
+class CalibrationModel:
+    """
+    Per-group mappings from reported to calibrated probabilities.
+
+    fit learns, from historical forecasts and outcomes, one mapping per (group, feature)
+    cell plus a pooled mapping per feature, used for groups with fewer than min_count
+    forecasts and for groups not seen in the history. calibrate and score then apply
+    the mappings to any number of new forecasts in one vectorized call, without
+    refitting:
+
+        model = CalibrationModel.fit(df_npd, by=['result NPD play'], method='isotonic')
+        model.save('calibration.npz')
+        model = CalibrationModel.load('calibration.npz')
+        calibrated = model.score(new_prospects)   # same probability columns, calibrated
+
+    Methods:
+        'binned': the observed success rate of the forecast's reliability bin
+            (verification.bin_index); empty bins keep the forecast.
+        'isotonic': the CORP calibration curve (isotonic.calibration_points),
+            interpolated linearly between the fitted forecasts and constant beyond them.
+        'logistic': sigmoid(a + b * logit(forecast)), fitted by penalized maximum
+            likelihood (see ridge).
+
+    Parameters:
+        method (str): One of METHODS.
+        by (list): Grouping columns of the cells.
+        keys (list): Group keys (tuples in the order of by), one per fitted group.
+        features (list): Calibrated features.
+        params (dict): Arrays of the method, over (len(keys) + 1) * len(features) cells
+            where the last group is the pooled one ('binned': 'rate'; 'isotonic': 'x',
+            'y' and 'start'; 'logistic': 'coef').
+        use_pooled (array): Per non-pooled cell, whether it falls back to the pooled one.
+        years (list): Period edges when by holds 'period'.
+        bins_num (int): Number of regular bins ('binned').
+        width (float): Bin width ('binned'; default: 1 / bins_num).
+    """
+
+    def __init__(self, method, by, keys, features, params, use_pooled, years=None, bins_num=10, width=None):
+        if method not in METHODS:
+            raise ValueError(f'Unknown calibration method {method!r} (use one of {METHODS})')
+        self.method = method
+        self.by = list(by)
+        self.keys = [tuple(k) for k in keys]
+        self.features = list(features)
+        self.params = {name: np.asarray(values) for name, values in params.items()}
+        self.use_pooled = np.asarray(use_pooled, dtype=bool)
+        self.years = years
+        self.bins_num = bins_num
+        self.width = width
+        self._index = pd.MultiIndex.from_tuples(self.keys, names=self.by) if self.by and self.keys else None
+        if method == 'isotonic':
+            # Knots of cell c sit at 2 * c + x, so one interp call serves every cell.
+            start = self.params['start']
+            self._knots = self.params['x'] + 2 * np.repeat(np.arange(len(start) - 1), np.diff(start))
+
+    @classmethod
+    @instrument.timed('calibration.CalibrationModel.fit')
+    def fit(cls, df, by=('result NPD play',), years=None, features=None, method='isotonic', min_count=30,
+            bins_num=10, width=None, ridge=1.0):
+        """
+        Fit the mappings of every group and feature from historical forecasts.
+
+        Parameters:
+            df (DataFrame): Reshaped frame with outcomes (optionally mapped with map_npd).
+            by (list): Grouping columns, e.g. 'result NPD play', 'period' (see
+                verification.group_codes).
+            years (list): Period edges, required when grouping by 'period'.
+            features (list): Features to calibrate (default: all of verification.FEATURES).
+            method (str): 'binned', 'isotonic' or 'logistic'.
+            min_count (int): Groups with fewer forecasts of a feature use the pooled mapping.
+            bins_num (int): Number of regular bins ('binned').
+            width (float): Bin width ('binned'; default: 1 / bins_num).
+            ridge (float): Penalty pulling the logistic fit towards the identity mapping.
+
+        Returns:
+            CalibrationModel: The fitted model.
+        """
+        if method not in METHODS:
+            raise ValueError(f'Unknown calibration method {method!r} (use one of {METHODS})')
+        by = list(by)
+        features = list(verification.FEATURES) if features is None else list(features)
+        codes, index = verification.group_codes(df, by, years)
+        n_features = len(features)
+        n_groups = len(index) if by else 0
+        pooled = n_groups * n_features
+        n_cells = pooled + n_features
+
+        # Every forecast counts for its own cell and for the pooled cell of its feature.
+        probs, outcomes, cells = verification.stacked_forecasts(df, codes, features)
+        pooled_cells = pooled + cells % n_features
+        if by:
+            probs, outcomes = np.concatenate([probs, probs]), np.concatenate([outcomes, outcomes])
+            cells = np.concatenate([cells, pooled_cells])
+        else:
+            cells = pooled_cells
+        use_pooled = np.bincount(cells, minlength=n_cells)[:pooled] < min_count
+
+        if method == 'binned':
+            stats = verification.bin_statistics(probs, outcomes, cells, n_cells, bins_num, width)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                params = {'rate': np.where(stats['count'] > 0, stats['succ'] / stats['count'], np.nan)}
+        else:
+            points = isotonic.calibration_points(probs, outcomes, cells)
+            if method == 'isotonic':
+                params = {'x': points['forecast'], 'y': points['calibrated'],
+                          'start': np.searchsorted(points['cell'], np.arange(n_cells + 1))}
+            else:
+                params = {'coef': _fit_logistic(points['cell'], points['forecast'], points['count'],
+                                                points['succ'], n_cells, ridge)}
+        keys = [k if isinstance(k, tuple) else (k,) for k in index] if by else []
+        keys = [tuple(v.item() if isinstance(v, np.generic) else v for v in k) for k in keys]
+        years = None if years is None else [int(y) for y in years]
+        return cls(method, by, keys, features, params, use_pooled, years, bins_num, width)
+
+    def _groups(self, keys, n):
+        """Fitted group of every row of keys (the pooled group where unknown)."""
+        pooled = len(self.keys)
+        if self._index is None or keys is None:
+            return np.full(n, pooled, dtype=int)
+        # Look up every distinct group of keys once.
+        codes, index = verification.group_codes(pd.DataFrame(keys), self.by, self.years)
+        distinct = pd.MultiIndex.from_frame(index.to_frame(index=False).astype(object))
+        groups = np.append(self._index.get_indexer(distinct), -1)[codes]
+        return np.where(groups >= 0, groups, pooled)
+
+    def calibrate(self, probs, feature, keys=None):
+        """
+        Calibrate an array of forecasts of one feature.
+
+        Parameters:
+            probs (array): Forecast probabilities (missing ones stay missing).
+            feature (str): Feature of the forecasts.
+            keys (DataFrame or dict): Grouping columns of the forecasts ('year' for
+                'period'), of the same length as probs. Without keys (or for groups the
+                model has not seen) the pooled mapping is used.
+
+        Returns:
+            ndarray: Calibrated probabilities.
+        """
+        probs = verification.as_probabilities(probs)
+        return self._calibrate(probs, feature, self._groups(keys, len(probs)))
+
+    def _calibrate(self, probs, feature, groups):
+        n_features = len(self.features)
+        f = self.features.index(feature)
+        cell = groups * n_features + f
+        # Groups with too few forecasts use the pooled cell of the feature.
+        pooled = len(self.keys) * n_features + f
+        fitted = cell < pooled
+        cell[fitted] = np.where(self.use_pooled[cell[fitted]], pooled, cell[fitted])
+
+        known = ~np.isnan(probs)
+        p, cell = probs[known], cell[known]
+        if self.method == 'binned':
+            values = self.params['rate'][cell, verification.bin_index(p, self.bins_num, self.width)]
+            values = np.where(np.isnan(values), p, values)
+        elif self.method == 'isotonic':
+            x, start = self.params['x'], self.params['start']
+            first, stop = start[cell], start[cell + 1]
+            # Cells without forecasts keep the forecast.
+            fitted = stop > first
+            values = p.copy()
+            if fitted.any():
+                first, last, c = first[fitted], stop[fitted] - 1, cell[fitted]
+                # Clipping to the cell's own knots keeps interp from reaching into other cells.
+                shifted = np.clip(p[fitted], x[first], x[last]) + 2 * c
+                values[fitted] = np.interp(shifted, self._knots, self.params['y'])
+        else:
+            a, b = self.params['coef'][cell].T
+            values = _sigmoid(a + b * _logit(p))
+        result = probs.copy()
+        result[known] = values
+        return result
+
+    @instrument.timed('calibration.CalibrationModel.score')
+    def score(self, df, features=None):
+        """
+        Calibrate the probability columns of a frame of new forecasts.
+
+        Parameters:
+            df (DataFrame): Forecasts with '<feature> Probability' columns and the
+                grouping columns of the model ('year' when grouped by 'period').
+            features (list): Features to calibrate (default: the model's features found
+                in df).
+
+        Returns:
+            DataFrame: Indexed like df, with the calibrated '<feature> Probability'
+            columns.
+        """
+        if features is None:
+            features = [f for f in self.features if f'{f} Probability' in df.columns]
+        # The groups are looked up once for all features.
+        groups = self._groups(df, len(df))
+        columns = {}
+        for f in features:
+            probs = verification.as_probabilities(df[f'{f} Probability'])
+            columns[f'{f} Probability'] = self._calibrate(probs, f, groups)
+        return pd.DataFrame(columns, index=df.index)
+
+    def save(self, path):
+        """Write the model to an '.npz' file."""
+        meta = {'schema': SCHEMA_VERSION, 'method': self.method, 'by': self.by, 'keys': self.keys,
+                'features': self.features, 'years': self.years, 'bins_num': self.bins_num, 'width': self.width}
+        arrays = {f'param/{name}': values for name, values in self.params.items()}
+        np.savez_compressed(path, meta=np.array(json.dumps(meta)), use_pooled=self.use_pooled, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Read a model written by save."""
+        with np.load(path, allow_pickle=False) as arrays:
+            meta = json.loads(str(arrays['meta']))
+            if meta['schema'] != SCHEMA_VERSION:
+                raise ValueError(f"Unsupported calibration model schema {meta['schema']}")
+            params = {name[len('param/'):]: arrays[name] for name in arrays.files if name.startswith('param/')}
+            return cls(meta['method'], meta['by'], meta['keys'], meta['features'], params, arrays['use_pooled'],
+                       meta['years'], meta['bins_num'], meta['width'])
@@ -0,0 +1,109 @@
+import argparse
+import sys
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='cli.py',
+        description='Verify NCS prognoses: read the workbook, reshape it, optionally map plays to '
+                    'NPD regions, and write the verification measures and attribute diagrams.')
+    parser.add_argument('workbook', help='Prognosis/result workbook (PrognosisResultData_Released.xlsx).')
+    parser.add_argument('--years', type=int, nargs='+', default=[1990, 1996, 2002, 2011, 2016, 2022],
+                        help='Period edges (default: %(default)s).')
+    parser.add_argument('--npd', action='store_true',
+                        help='Map plays to NPD regions and score/plot every region separately.')
+    parser.add_argument('--metrics', metavar='CSV',
+                        help='Write the verification measures to CSV (default: print them).')
+    parser.add_argument('--audit', metavar='CSV',
+                        help='Write the consistency audit of total vs factor probabilities per group to CSV.')
+    parser.add_argument('--plots', metavar='DIR',
+                        help='Render the attribute diagrams and the measures plot into DIR.')
+    parser.add_argument('--risk', action='store_true',
+                        help='Also render the failure-reason pie chart into the --plots directory.')
+    parser.add_argument('--isotonic', action='store_true',
+                        help='Overlay the binning-free CORP calibration curve on the attribute diagrams.')
+    parser.add_argument('--formats', nargs='+', default=['pdf'],
+                        help='Figure file formats (default: %(default)s).')
+    parser.add_argument('--processes', type=int, help='Worker processes for rendering (default: CPUs).')
+    parser.add_argument('--cache-dir', help='Directory of the workbook cache (see ingest.cache_path).')
+    parser.add_argument('--no-cache', action='store_true', help='Always parse the workbook.')
+    parser.add_argument('--stream', action='store_true',
+                        help='Stream only the needed columns of the workbook (or CSV export) and reshape it in '
+                             'chunks, for exports too large to load whole (see ingest.reshape_stream).')
+    parser.add_argument('--profile', metavar='JSON',
+                        help='Record wall/CPU time, peak memory and row counts of every stage to JSON.')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='With --profile, also trace the memory of every stage (slows the run down).')
+    return parser
+
+
+def main(argv=None):
+    """
+    Run ingest -> reshape -> region mapping -> metrics/plots.
+
+    The pipeline modules are imported here rather than at the top of the module, so
+    'cli.py --help' and argument errors return without loading pandas or matplotlib.
+    """
+    args = build_parser().parse_args(argv)
+    if args.risk and not args.plots:
+        build_parser().error('--risk needs --plots')
+    if args.plots and len(args.years) < 2:
+        build_parser().error('--plots needs at least two --years edges (one period)')
+
+    import instrument
+    if args.profile:
+        instrument.enable(memory=args.profile_memory)
+    try:
+        return _run(args)
+    finally:
+        if args.profile:
+            instrument.to_json(args.profile)
+
+
+def _run(args):
+    import data_cleaning
+    import ingest
+    import verification
+
+    if args.stream:
+        df = ingest.reshape_stream(args.workbook)
+        no_replicate = lambda: ingest.reshape_stream(args.workbook, no_replicate=True)  # noqa: E731
+    else:
+        data = ingest.read_prognosis(args.workbook, cache_dir=args.cache_dir, use_cache=not args.no_cache)
+        views = data_cleaning.ReshapeViews(data)
+        df = views.replicated
+        no_replicate = lambda: views.no_replicate  # noqa: E731
+    by = ['period']
+    if args.npd:
+        import map_npd
+        index = map_npd.load_play_index()
+        unmapped = map_npd.unmapped_plays(df, index)
+        if len(unmapped):
+            print(f'{unmapped["play"].nunique()} play(s) not in the play table, e.g. '
+                  f'{", ".join(unmapped["play"].unique()[:5])}', file=sys.stderr)
+        df = map_npd.map_npd(df)
+        by.append('result NPD play')
+
+    table = verification.metrics_table(df, by=by, years=args.years)
+    if args.metrics:
+        table.to_csv(args.metrics, index=False)
+    else:
+        print(table.to_string(index=False))
+    if args.audit:
+        import audit
+        audit.audit_table(df, by=by, years=args.years).to_csv(args.audit, index=False)
+
+    if args.plots:
+        import batch_export
+        batch_export.export_attribute_diagrams(df, args.years, args.plots, kind='npd' if args.npd else 'all',
+                                               formats=tuple(args.formats), processes=args.processes,
+                                               figure_options={'isotonic': True} if args.isotonic else None)
+        if args.risk:
+            import map_npd
+            batch_export.export_risk_pie_chart(map_npd.map_npd(no_replicate()), args.plots,
+                                               formats=tuple(args.formats))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+
+import numpy as np
+
+import instrument
+
+# Memoized bounds keyed by (method, p, n, confidence level), least recently used first.
+# The attribute diagrams need a few hundred pairs per run; the bound keeps long batch or
+# pipeline processes from keeping every pair they ever saw.
+CACHE_SIZE = 10_000
+_cache = OrderedDict()
+
+
+def _binom(p, n, confidence_level):
+    """Central interval of the Binomial(n, p) count, as a fraction of n."""
+    from scipy.stats import binom
+    lower, upper = binom.interval(confidence_level, n, p, loc=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return lower / n, upper / n
+
+
+def _clopper_pearson(p, n, confidence_level):
+    """Exact (beta) interval of a success rate p observed in n trials."""
+    from scipy.stats import beta
+    alpha = 1 - confidence_level
+    k = np.round(p * n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lower = np.where(k > 0, beta.ppf(alpha / 2, k, n - k + 1), 0.0)
+        upper = np.where(k < n, beta.ppf(1 - alpha / 2, k + 1, n - k), 1.0)
+    invalid = n <= 0
+    return np.where(invalid, np.nan, lower), np.where(invalid, np.nan, upper)
+
+
+def _wilson(p, n, confidence_level):
+    """Wilson score interval of a success rate p observed in n trials."""
+    from scipy.stats import norm
+    z = norm.ppf(0.5 + confidence_level / 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centre = (p + z ** 2 / (2 * n)) / (1 + z ** 2 / n)
+        half = z / (1 + z ** 2 / n) * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2))
+    return centre - half, centre + half
+
+
+METHODS = {
+    'binom': _binom,
+    'clopper-pearson': _clopper_pearson,
+    'wilson': _wilson,
+}
+
+
+@instrument.timed('confidence.binomial_intervals')
+def binomial_intervals(p, n, confidence_level=0.8, method='binom'):
+    """
+    Confidence bands of success rates for many (p, n) pairs in one call.
+
+    Bounds are memoized per (method, p, n, confidence level), so only pairs not seen
+    before reach scipy, all in a single vectorized call. The CACHE_SIZE most recently
+    used pairs are kept.
+
+    Parameters:
+        p (array): Success probabilities (or observed success rates).
+        n (array): Number of trials; broadcast against p.
+        confidence_level (float): Desired confidence level.
+        method (str): 'binom' (central interval of the binomial count, as used by the
+            attribute diagrams), 'clopper-pearson' or 'wilson'.
+
+    Returns:
+        tuple: Lower and upper bounds, shaped like the broadcast inputs
+        (NaN where n is 0).
+    """
+    if method not in METHODS:
+        raise ValueError(f'Unknown interval method {method!r}; expected one of {sorted(METHODS)}')
+    p, n = np.broadcast_arrays(np.asarray(p, dtype=float), np.asarray(n, dtype=float))
+    keys = [(method, pi, ni, confidence_level) for pi, ni in zip(p.ravel().tolist(), n.ravel().tolist())]
+    values, missing = {}, []
+    for k in dict.fromkeys(keys):
+        if k in _cache:
+            _cache.move_to_end(k)
+            values[k] = _cache[k]
+        else:
+            missing.append(k)
+    instrument.annotate(computed=len(missing))
+    if missing:
+        lower, upper = METHODS[method](np.array([k[1] for k in missing]), np.array([k[2] for k in missing]),
+                                       confidence_level)
+        computed = dict(zip(missing, zip(np.asarray(lower, dtype=float).tolist(),
+                                         np.asarray(upper, dtype=float).tolist())))
+        values.update(computed)
+        _cache.update(computed)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    # Looked up in this call's values: a call with more pairs than CACHE_SIZE evicts some.
+    bounds = np.array([values[k] for k in keys], dtype=float).reshape(p.shape + (2,))
+    return bounds[..., 0], bounds[..., 1]
+
+
+def clear_cache():
+    """Drop all memoized bounds."""
+    _cache.clear()
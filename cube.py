@@ -0,0 +1,265 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import instrument
+import map_npd
+import verification
+from accumulator import STATS
+
+# Bump whenever the on-disk layout below changes.
+SCHEMA_VERSION = 2
+
+AXES = ('year', 'region', 'play', 'feature')
+
+# Region label of the plays the play table does not cover.
+UNMAPPED = 'unmapped'
+
+
+class MetricsCube:
+    """
+    Per-bin statistics indexed by (year, play, feature, bin), with the region of every play.
+
+    The cube holds, for every completion year, NPD play (of the result), feature and
+    reliability bin, the statistics of verification.bin_statistics. Regions are not an
+    axis of their own: every play carries its region (UNMAPPED for plays the play table
+    does not cover), and a region is the sum of its plays. Any slice is scored by summing
+    the cube along its axes, so questions like "Reservoir forecasts of the north sea plays
+    in 2006-2015" are answered without touching the rows again. The statistics are stored
+    summed cumulatively over the years, so a year range is the difference of two year
+    slices whatever its length:
+
+        cube = MetricsCube.from_frame(df)
+        cube.save('metrics_cube')
+        cube = MetricsCube.load('metrics_cube')     # memory-mapped
+        cube.query(years=(2006, 2016), region='north sea', feature='Reservoir')
+        cube.table(by=['region', 'feature'], years=(2006, 2016))
+
+    Parameters:
+        cumulative (ndarray): Array of shape (len(STATS), years + 1, plays, features,
+            bins_num + 1): the statistics (in accumulator.STATS order) of all years before
+            each year position, starting with zeros.
+        axes (dict): Labels of the axes: 'year' (consecutive years), 'region' (the regions
+            of the plays), 'play' and 'feature'.
+        play_region (list): Region of every play, in the order of axes['play'].
+        bins_num (int): Number of regular bins.
+        width (float): Bin width (default: 1 / bins_num).
+    """
+
+    def __init__(self, cumulative, axes, play_region, bins_num=10, width=None):
+        self.cumulative = cumulative
+        self.play_region = list(play_region)
+        self.axes = {name: list(axes[name]) for name in AXES}
+        self.bins_num = bins_num
+        self.width = width
+        self._positions = {name: {label: i for i, label in enumerate(labels)}
+                           for name, labels in self.axes.items()}
+        self._play_region = np.array([self._positions['region'][r] for r in self.play_region], dtype=int)
+
+    @classmethod
+    @instrument.timed('cube.MetricsCube.from_frame')
+    def from_frame(cls, df, features=None, bins_num=10, width=None, table=None):
+        """
+        Build the cube of a reshaped frame.
+
+        The plays are mapped to their regions here (with the rules map_npd uses), so
+        pass the frame before map_npd: afterwards its play columns only hold regions.
+
+        Parameters:
+            df (DataFrame): Reshaped frame (data_cleaning.data_reshape).
+            features (list): Features to include (default: all of verification.FEATURES).
+            bins_num (int): Number of regular bins.
+            width (float): Bin width (default: 1 / bins_num).
+            table (str): Play -> region table (default: map_npd.PLAY_TABLE).
+
+        Returns:
+            MetricsCube: Cube covering every year from the first to the last completion
+            year. Forecasts without a result play are left out; plays the table does not
+            cover are kept with the region UNMAPPED.
+        """
+        features = list(verification.FEATURES) if features is None else list(features)
+        index = map_npd.load_play_index(table)
+        play = pd.Categorical(df['result NPD play'].str.lower())
+        play_region = [index.region(p) or UNMAPPED for p in play.categories]
+        year = df['year'].to_numpy().astype(int)
+        first = int(year.min()) if len(year) else 0
+        shape = (int(year.max()) - first + 1 if len(year) else 0, len(play.categories), len(features))
+
+        # Group = (year offset, play); cell = group * features + feature.
+        codes = np.ravel_multi_index((year - first, np.maximum(play.codes, 0)), shape[:2]) if len(year) else \
+            np.zeros(0, dtype=int)
+        codes[play.codes < 0] = -1
+        probs, outcomes, cells = verification.stacked_forecasts(df, codes, features)
+        stats = verification.bin_statistics(probs, outcomes, cells, int(np.prod(shape)), bins_num, width)
+        stats = np.stack([stats[name].reshape(shape + (bins_num + 1,)) for name in STATS])
+        cumulative = np.concatenate([np.zeros_like(stats[:, :1]), np.cumsum(stats, axis=1)], axis=1)
+        # Regions in the order of the play table, with the unmapped plays last.
+        regions = [r for r in index.regions if r in play_region] + ([UNMAPPED] if UNMAPPED in play_region else [])
+        axes = {'year': list(range(first, first + shape[0])), 'region': regions, 'play': list(play.categories),
+                'feature': features}
+        return cls(cumulative, axes, play_region, bins_num, width)
+
+    def save(self, path):
+        """
+        Write the cube to the directory path: the cumulative statistics as 'stats.npy'
+        and the axis labels and play regions as 'axes.json'.
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'stats.npy'), np.ascontiguousarray(self.cumulative, dtype=float))
+        with open(os.path.join(path, 'axes.json'), 'w') as f:
+            json.dump({'schema': SCHEMA_VERSION, 'axes': self.axes, 'play_region': self.play_region,
+                       'bins_num': self.bins_num, 'width': self.width}, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Read a cube written by save. The statistics are memory-mapped (mmap_mode=None
+        reads them into memory), so only the pages a query touches are read.
+        """
+        with open(os.path.join(path, 'axes.json')) as f:
+            meta = json.load(f)
+        if meta['schema'] != SCHEMA_VERSION:
+            raise ValueError(f"Unsupported metrics cube schema {meta['schema']}")
+        cumulative = np.load(os.path.join(path, 'stats.npy'), mmap_mode=mmap_mode)
+        return cls(cumulative, meta['axes'], meta['play_region'], meta['bins_num'], meta['width'])
+
+    def _index(self, name, labels):
+        """Positions of labels (a label or a list of labels) on an axis; None for all."""
+        if labels is None:
+            return None
+        if isinstance(labels, (str, int, np.integer)):
+            labels = [labels]
+        if name in ('region', 'play'):
+            labels = [label.lower() for label in labels]
+        missing = [label for label in labels if label not in self._positions[name]]
+        if missing:
+            raise KeyError(f'{name} not in the cube: {missing}')
+        return np.array([self._positions[name][label] for label in labels], dtype=int)
+
+    def _year_positions(self, years):
+        """Cumulative positions (start, stop) of a (first year, year after the last) range."""
+        first, n_years = (self.axes['year'][0] if self.axes['year'] else 0), len(self.axes['year'])
+        start, stop = (None, None) if years is None else years
+        start = 0 if start is None else min(max(start - first, 0), n_years)
+        stop = n_years if stop is None else min(max(stop - first, start), n_years)
+        return start, stop
+
+    def _plays(self, region, play):
+        """Positions of the plays selected by the region and play selectors."""
+        selected = np.ones(len(self.axes['play']), dtype=bool)
+        regions = self._index('region', region)
+        if regions is not None:
+            selected &= np.isin(self._play_region, regions)
+        plays = self._index('play', play)
+        if plays is not None:
+            selected &= np.isin(np.arange(len(selected)), plays)
+        return np.flatnonzero(selected)
+
+    def _select(self, stats, plays, feature):
+        """Take the selected plays and features of per-year statistics."""
+        stats = np.take(stats, plays, axis=2)
+        features = self._index('feature', feature)
+        return stats if features is None else np.take(stats, features, axis=3)
+
+    def query(self, years=None, region=None, play=None, feature=None):
+        """
+        Score one slice of the cube.
+
+        Every selector takes a label, a list of labels or None (all); the selected cells
+        are summed into one set of forecasts.
+
+        Parameters:
+            years (tuple): (first year, year after the last year); either may be None.
+            region (str or list): NPD regions (or UNMAPPED).
+            play (str or list): NPD plays (case-insensitive).
+            feature (str or list): Technical, Reservoir, Source and/or Trap.
+
+        Returns:
+            dict: The measures 'n', 'brier', 'rel', 'res', 'unc', 'skill' and 'bias' (see
+            verification.metrics_from_stats) and 'curve', a dict with the arrays of the
+            reliability-curve points ('bins_mid', 'count', 'avg_prob', 'succ_rate') of the
+            non-empty bins.
+        """
+        start, stop = self._year_positions(years)
+        # Year range = cumulative[stop] - cumulative[start].
+        stats = self.cumulative[:, [stop]] - self.cumulative[:, [start]]
+        totals = self._select(stats, self._plays(region, play), feature).sum(axis=(1, 2, 3))
+        measures = verification.metrics_from_stats(*totals)
+        result = {name: values.item() for name, values in measures.items()}
+
+        count, sum_prob, succ = totals[0], totals[1], totals[2]
+        width = self.width or 1 / self.bins_num
+        bins_mid = np.array([round((i + 0.5) * width, 2) for i in range(self.bins_num)] + [1.0])
+        filled = count > 0
+        result['curve'] = {
+            'bins_mid': bins_mid[filled],
+            'count': count[filled].astype(int),
+            'avg_prob': sum_prob[filled] / count[filled],
+            'succ_rate': succ[filled] / count[filled],
+        }
+        return result
+
+    def table(self, by=('feature',), years=None, region=None, play=None, feature=None):
+        """
+        Score a slice of the cube per combination of the `by` axes.
+
+        Parameters:
+            by (list): Axes kept apart, among 'year', 'region', 'play' and 'feature'; all
+                other axes are summed. With both 'region' and 'play' every play is listed
+                with its own region only.
+            years, region, play, feature: Selectors, as for query.
+
+        Returns:
+            DataFrame: Same layout as verification.metrics_table (the `by` columns,
+            'n', 'brier', 'rel', 'res', 'unc', 'skill' and 'bias'). Empty combinations
+            are left out.
+        """
+        by = list(by)
+        unknown = set(by) - set(AXES)
+        if unknown:
+            raise ValueError(f'Unknown cube axes: {sorted(unknown)}')
+        start, stop = self._year_positions(years)
+        if 'year' in by:
+            stats = np.diff(self.cumulative[:, start:stop + 1], axis=1)
+        else:
+            stats = self.cumulative[:, [stop]] - self.cumulative[:, [start]]
+        plays = self._plays(region, play)
+        stats = self._select(stats, plays, feature)
+
+        # Play axis: one entry per play, per region (plays summed by region) or one total.
+        if 'play' in by:
+            groups = pd.DataFrame({'play': [self.axes['play'][i] for i in plays]})
+            if 'region' in by:
+                groups.insert(0, 'region', [self.play_region[i] for i in plays])
+        elif 'region' in by:
+            codes = self._play_region[plays]
+            order = np.argsort(codes, kind='stable')
+            present, starts = np.unique(codes[order], return_index=True)
+            stats = np.add.reduceat(stats[:, :, order], starts, axis=2) if len(order) else stats
+            groups = pd.DataFrame({'region': [self.axes['region'][i] for i in present]})
+        else:
+            stats = stats.sum(axis=2, keepdims=True)
+            groups = None
+        labels = {
+            1: pd.DataFrame({'year': self.axes['year'][start:stop]}),
+            2: groups,
+            3: pd.DataFrame({'feature': self.axes['feature'] if feature is None else
+                             [self.axes['feature'][i] for i in self._index('feature', feature)]}),
+        }
+        axis_of = {'year': 1, 'region': 2, 'play': 2, 'feature': 3}
+        kept = list(dict.fromkeys(axis_of[name] for name in by))
+        stats = stats.sum(axis=tuple(a for a in (1, 2, 3) if a not in kept))
+        # Bring the kept axes into the order of by, then flatten them into rows.
+        stats = np.moveaxis(stats, [1 + sorted(kept).index(a) for a in kept], range(1, len(kept) + 1))
+        stats = stats.reshape(len(STATS), -1, self.bins_num + 1)
+        measures = verification.metrics_from_stats(*stats)
+
+        table = pd.DataFrame(index=range(1))
+        for a in kept:
+            table = table.merge(labels[a], how='cross')
+        table = table[by] if by else table
+        for name, values in measures.items():
+            table[name] = values
+        return table[table['n'] > 0].reset_index(drop=True)
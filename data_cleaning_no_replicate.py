@@ -3,108 +3,74 @@
 
 import numpy as np
 import pandas as pd
-from itertools import chain
 
-def data_reshape(data):
-    # Load data
-    #data = pd.read_excel('PrognosisResultData_All_3Q2023_v1_anonymized_modified2.xlsx').drop(0)
-
-    # Separate observed and prognosis data
-    data_obs = data[data['Prognosis - Result'].str.upper() != 'PROGNOSIS']
-    data_prog = data[data['Prognosis - Result'].str.upper() != 'RESULT']
-
-    # Find common well IDs
-    well_ids_common = np.intersect1d(pd.unique(data_obs['Well name']), pd.unique(data_prog['Well name']))
-
-    # Initialize lists
-    well_prospect_ids = []
-    technical_probs, reservoir_probs, source_probs, trap_probs = [], [], [], []
-    discovery, reservoir, source, trap, years = [], [], [], [], []
-    npd_play_obs = []
-    npd_play_prog = []
-
-    # Process data
-    for w in well_ids_common:
-        wells_obs = data_obs[data_obs['Well name'] == w]
-        wells_prog = data_prog[data_prog['Well name'] == w]
-        prospect_ids = np.intersect1d(pd.unique(wells_obs['Prospect name']), pd.unique(wells_prog['Prospect name']))
-
-        for p in prospect_ids:
-            prospects_obs = wells_obs[wells_obs['Prospect name'] == p]
-            prospects_prog = wells_prog[wells_prog['Prospect name'] == p]
+import data_cleaning
+import instrument
 
-            # well-prospect names
-            well_prospect_ids.append([w, p])
-            # Probabilities
-            technical_probs.append(list(prospects_prog["Probability Technical Total"]))
-            reservoir_probs.append(list(prospects_prog["Probability Techn Reservoir"]))
-            source_probs.append(list(prospects_prog["Probability Techn Source"]))
-            trap_probs.append(list(prospects_prog["Probability Techn Trap"]))
 
-            # Discovery and geological factors
-            discovery.append(list(prospects_obs["Discovery?"]))
-            reservoir.append(list(prospects_obs["OK Reservoir?"]))
-            source.append(list(prospects_obs["OK Source/ Charge?"]))
-            trap.append(list(prospects_obs["OK Trap?"]))
+@instrument.timed('data_cleaning_no_replicate.reshape_pairs')
+def reshape_pairs(pairs):
+    """
+    Build the non-replicated frame (one row per well/prospect) from data_cleaning.pair_rows.
 
-            # Years
-            years.append([int(str(d)[:4]) for d in prospects_obs['Completion date']])
+    Parameters:
+        pairs (DataFrame): Paired prognosis and result rows.
 
-            # NPD Plays
-            npd_play_obs.append(list(prospects_obs["NPD Play"]))
-            npd_play_prog.append(list(prospects_prog["NPD Play"]))
+    Returns:
+        DataFrame: Reshaped frame, see data_reshape.
+    """
+    keys = ['Well name', 'Prospect name']
 
+    # pairs is sorted by well and prospect, so each well/prospect is a contiguous block
+    starts = np.flatnonzero(pairs[keys].ne(pairs[keys].shift()).any(axis=1).to_numpy())
+    group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(pairs))))
+    if (pd.Series(pairs['obs_row'].to_numpy()).groupby(group).nunique() > 1).any():
+        raise ValueError('Every well/prospect must have a single result row')
 
-    # Convert categorical data to binary
-    def convert_to_binary(lst, mapping):
-        for sublist in lst:
-            if isinstance(sublist[0], str):
-                sublist[0] = mapping.get(sublist[0].upper(), sublist[0])
+    # Prognoses of the same well/prospect are kept together as lists
+    def as_lists(col):
+        return [list(x) for x in np.split(pairs[col].to_numpy(), starts[1:])] if len(pairs) else []
 
-    mapping = {'YES': 1, 'NO': 0, 'OK': 1, 'FAIL': 0}
-    for lst in [discovery, reservoir, source, trap]:
-        convert_to_binary(lst, mapping)
-
-
-
-    # Flatten lists
-    flatten = lambda lst: list(chain.from_iterable(lst))
+    first = pairs.iloc[starts]
 
     dict_total = {
-        'well_prospect': well_prospect_ids,
-        'year': flatten(years),
-        'result NPD play':flatten(npd_play_obs),
-        'prognosis NPD play':npd_play_prog,
-        'Technical Probability': technical_probs,
-        'Reservoir Probability': reservoir_probs,
-        'Source Probability': source_probs,
-        'Trap Probability': trap_probs,
-        'discovery?': flatten(discovery),
-        'reservoir?': flatten(reservoir),
-        'source?': flatten(source),
-        'trap?': flatten(trap)
+        'well_prospect': first[keys].values.tolist(),
+        'year': data_cleaning.completion_years(first['year']).tolist(),
+        'result NPD play': first['result NPD play'].tolist(),
+        'prognosis NPD play': as_lists('prognosis NPD play'),
+        'Technical Probability': as_lists('Technical Probability'),
+        'Reservoir Probability': as_lists('Reservoir Probability'),
+        'Source Probability': as_lists('Source Probability'),
+        'Trap Probability': as_lists('Trap Probability'),
+        'discovery?': first['discovery?'].tolist(),
+        'reservoir?': first['reservoir?'].tolist(),
+        'source?': first['source?'].tolist(),
+        'trap?': first['trap?'].tolist()
     }
 
     df = pd.DataFrame(dict_total)
 
     # Clean up placeholders
-    def clean_placeholders(row):
-        if row['discovery?'] == 1:
-            for col in ['reservoir?', 'source?', 'trap?']:
-                if pd.isna(row[col]):
-                    row[col] = 1
-        return row
-
-    df = df.apply(clean_placeholders, axis=1)
+    df = data_cleaning.clean_placeholders(df)
 
     # Remove invalid data
     #df = df[df[['Technical Probability', 'Reservoir Probability', 'Source Probability', 'Trap Probability']].notna().all(axis=1)]
+    rows = len(df)
     df = df[df[['reservoir?', 'source?', 'trap?', 'discovery?']].isin([0, 1]).all(axis=1)]
+    instrument.dropped('invalid outcome', rows - len(df))
+    rows = len(df)
     df = df.drop(df[df['discovery?'] == 1].index)
+    instrument.dropped('discovery', rows - len(df))
 
     # Reset index
     df = df.reset_index(drop=True)
-    len(df)
     return df
-    
 
+
+@instrument.timed('data_cleaning_no_replicate.data_reshape')
+def data_reshape(data, compact=False):
+    # Load data
+    #data = pd.read_excel('PrognosisResultData_All_3Q2023_v1_anonymized_modified2.xlsx').drop(0)
+    df = reshape_pairs(data_cleaning.pair_rows(data))
+    # compact=True returns compact dtypes, see data_cleaning.compact_frame
+    return data_cleaning.compact_frame(df) if compact else df
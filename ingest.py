@@ -0,0 +1,325 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import instrument
+
+# Bump whenever the on-disk layout below changes; old cache files are then ignored.
+SCHEMA_VERSION = 1
+
+# Value kinds used to store object columns (mixed text, numbers and dates) column-wise.
+KIND_NULL, KIND_STR, KIND_INT, KIND_FLOAT, KIND_DATE, KIND_BOOL = range(6)
+
+
+def file_hash(path, block_size=1 << 20):
+    """
+    Compute the SHA-256 hash of a file's content.
+
+    Parameters:
+        path (str): File to hash.
+        block_size (int): Bytes read per block.
+
+    Returns:
+        str: Hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_path(path, cache_dir=None, sheet_name=0):
+    """
+    Return the cache file for a workbook, keyed by its content hash and the cache schema.
+
+    Parameters:
+        path (str): Source workbook.
+        cache_dir (str): Cache directory (default: '.prognosis_cache' next to the workbook).
+        sheet_name (str or int): Sheet that is cached.
+
+    Returns:
+        str: Path of the '.npz' cache file.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), '.prognosis_cache')
+    schema = hashlib.sha256(json.dumps([SCHEMA_VERSION, sheet_name]).encode()).hexdigest()
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f'{stem}-{file_hash(path)[:16]}-{schema[:8]}.npz')
+
+
+def _value_kind(value):
+    if value is None or value is pd.NaT or (isinstance(value, float) and np.isnan(value)):
+        return KIND_NULL
+    if isinstance(value, str):
+        return KIND_STR
+    if isinstance(value, (bool, np.bool_)):
+        return KIND_BOOL
+    if isinstance(value, (int, np.integer)):
+        return KIND_INT
+    if isinstance(value, (float, np.floating)):
+        return KIND_FLOAT
+    if isinstance(value, (pd.Timestamp, np.datetime64)) or hasattr(value, 'isoformat'):
+        return KIND_DATE
+    return KIND_STR
+
+
+def _encode_column(name, values, arrays):
+    """Store one column as typed arrays under the key prefix 'name'."""
+    if values.dtype != object and not pd.api.types.is_string_dtype(values):
+        arrays[name] = values.to_numpy()
+        return
+    values = values.to_numpy(dtype=object)
+    kinds = np.fromiter((_value_kind(v) for v in values), dtype=np.int8, count=len(values))
+    arrays[f'{name}/kind'] = kinds
+    arrays[f'{name}/str'] = np.array([str(v) for v in values[kinds == KIND_STR]], dtype=str)
+    arrays[f'{name}/int'] = np.array(list(values[kinds == KIND_INT]), dtype=np.int64)
+    arrays[f'{name}/float'] = np.array(list(values[kinds == KIND_FLOAT]), dtype=np.float64)
+    arrays[f'{name}/date'] = np.array([pd.Timestamp(v).to_datetime64() for v in values[kinds == KIND_DATE]],
+                                      dtype='datetime64[ns]')
+    arrays[f'{name}/bool'] = np.array(list(values[kinds == KIND_BOOL]), dtype=bool)
+
+
+def _decode_column(name, arrays):
+    """Rebuild one column stored by _encode_column."""
+    if name in arrays:
+        return arrays[name]
+    kinds = arrays[f'{name}/kind']
+    values = np.full(len(kinds), np.nan, dtype=object)
+    values[kinds == KIND_STR] = arrays[f'{name}/str'].tolist()
+    values[kinds == KIND_INT] = arrays[f'{name}/int'].tolist()
+    values[kinds == KIND_FLOAT] = arrays[f'{name}/float'].tolist()
+    values[kinds == KIND_DATE] = list(pd.DatetimeIndex(arrays[f'{name}/date']))
+    values[kinds == KIND_BOOL] = arrays[f'{name}/bool'].tolist()
+    return values
+
+
+def write_cache(df, path):
+    """
+    Write a DataFrame to a typed columnar '.npz' cache file.
+
+    Parameters:
+        df (DataFrame): Frame as read from the workbook.
+        path (str): Destination cache file.
+    """
+    arrays = {}
+    columns = [str(c) for c in df.columns]
+    dtypes = [str(df[c].dtype) for c in df.columns]
+    for i, c in enumerate(df.columns):
+        _encode_column(f'c{i}', df[c], arrays)
+    arrays['meta'] = np.array(json.dumps({'columns': columns, 'dtypes': dtypes}))
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # Write to a temporary file first so an interrupted run never leaves a broken cache.
+    tmp_path = f'{path}.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def read_cache(path):
+    """
+    Load a DataFrame from a cache file written by write_cache.
+
+    Parameters:
+        path (str): Cache file.
+
+    Returns:
+        DataFrame: The cached frame with its original column dtypes.
+    """
+    with np.load(path, allow_pickle=False) as arrays:
+        meta = json.loads(arrays['meta'].item())
+        data = {c: _decode_column(f'c{i}', arrays) for i, c in enumerate(meta['columns'])}
+    df = pd.DataFrame(data)
+    for c, dtype in zip(meta['columns'], meta['dtypes']):
+        if str(df[c].dtype) != dtype:
+            df[c] = df[c].astype(dtype)
+    return df
+
+
+@instrument.timed('ingest.read_prognosis')
+def read_prognosis(path, cache_dir=None, sheet_name=0, use_cache=True):
+    """
+    Read the PrognosisResultData workbook, going through the columnar cache.
+
+    The workbook is parsed once; later calls load the cached '.npz' file until the
+    workbook's content (or the cache schema) changes.
+
+    Parameters:
+        path (str): Workbook downloaded from the factpages (e.g. 'PrognosisResultData_Released.xlsx').
+        cache_dir (str): Cache directory (default: '.prognosis_cache' next to the workbook).
+        sheet_name (str or int): Sheet to read.
+        use_cache (bool): Set to False to always parse the workbook.
+
+    Returns:
+        DataFrame: Same frame as pd.read_excel(path, sheet_name=sheet_name).
+    """
+    if not use_cache:
+        instrument.annotate(source='workbook')
+        return pd.read_excel(path, sheet_name=sheet_name)
+    cached = cache_path(path, cache_dir, sheet_name)
+    if os.path.exists(cached):
+        instrument.annotate(source='cache')
+        return read_cache(cached)
+    instrument.annotate(source='workbook')
+    df = pd.read_excel(path, sheet_name=sheet_name)
+    write_cache(df, cached)
+    return df
+
+
+# Columns data_cleaning reads; streaming ingest projects the workbook onto these.
+READ_COLUMNS = [
+    'Well name', 'Prospect name', 'Prognosis - Result', 'Completion date', 'NPD Play',
+    'Probability Technical Total', 'Probability Techn Reservoir', 'Probability Techn Source',
+    'Probability Techn Trap', 'Discovery?', 'OK Reservoir?', 'OK Source/ Charge?', 'OK Trap?',
+]
+PROBABILITY_COLUMNS = ['Probability Technical Total', 'Probability Techn Reservoir', 'Probability Techn Source',
+                       'Probability Techn Trap']
+FLAG_COLUMNS = ['Prognosis - Result', 'Discovery?', 'OK Reservoir?', 'OK Source/ Charge?', 'OK Trap?']
+
+
+def _convert_chunk(df):
+    """Type a chunk of projected rows: float probabilities, dates and categorical flags."""
+    for c in df.columns:
+        if c in PROBABILITY_COLUMNS:
+            # Text in a probability cell (e.g. the description row) becomes missing.
+            df[c] = pd.to_numeric(df[c], errors='coerce')
+        elif c == 'Completion date':
+            df[c] = pd.to_datetime(df[c], errors='coerce')
+        elif c in FLAG_COLUMNS:
+            df[c] = df[c].astype('category')
+    return df
+
+
+def _xlsx_rows(path, sheet_name, columns):
+    """Yield the projected cell values of every worksheet row, streamed in read-only mode."""
+    import openpyxl
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else workbook[sheet_name]
+        rows = sheet.iter_rows(values_only=True)
+        header = [str(h) if h is not None else None for h in next(rows, ())]
+        missing = [c for c in columns if c not in header]
+        if missing:
+            raise ValueError(f'{path} has no column(s) {missing}')
+        positions = [header.index(c) for c in columns]
+        width = max(positions) + 1
+        for row in rows:
+            if len(row) < width:
+                row = tuple(row) + (None,) * (width - len(row))
+            values = tuple(row[p] for p in positions)
+            # Skip blank lines, which never pair up.
+            if any(v is not None for v in values):
+                yield values
+    finally:
+        workbook.close()
+
+
+def iter_prognosis_chunks(path, columns=READ_COLUMNS, sheet_name=0, chunk_size=100_000):
+    """
+    Stream the rows of a prognosis workbook (xlsx) or CSV export in typed chunks.
+
+    Only `columns` are kept; the other columns of the export are never turned into
+    Python objects (xlsx) or parsed (CSV). Probabilities become float64 (text becomes
+    missing), completion dates datetime64 and the Prognosis/Result and outcome flags
+    categoricals. The chunks are indexed by row number over the whole file, so row 0 is
+    the first row under the header, as in pd.read_excel.
+
+    Parameters:
+        path (str): '.xlsx'/'.xlsm' workbook or '.csv' export.
+        columns (list): Columns to keep (default: the ones data_cleaning reads).
+        sheet_name (str or int): Worksheet of a workbook.
+        chunk_size (int): Rows per chunk.
+
+    Yields:
+        DataFrame: Up to chunk_size rows of the projected columns.
+    """
+    columns = list(columns)
+    if path.lower().endswith('.csv'):
+        reader = pd.read_csv(path, usecols=columns, chunksize=chunk_size, dtype={c: object for c in FLAG_COLUMNS})
+        for chunk in reader:
+            yield _convert_chunk(chunk[columns])
+        return
+    start, rows = 0, []
+    for values in _xlsx_rows(path, sheet_name, columns):
+        rows.append(values)
+        if len(rows) == chunk_size:
+            yield _convert_chunk(pd.DataFrame.from_records(rows, columns=columns,
+                                                           index=pd.RangeIndex(start, start + len(rows))))
+            start, rows = start + len(rows), []
+    if rows or not start:
+        yield _convert_chunk(pd.DataFrame.from_records(rows, columns=columns,
+                                                       index=pd.RangeIndex(start, start + len(rows))))
+
+
+@instrument.timed('ingest.read_projected')
+def read_projected(path, columns=READ_COLUMNS, sheet_name=0, chunk_size=100_000):
+    """
+    Read only the needed columns of a workbook or CSV export (see iter_prognosis_chunks).
+
+    Returns:
+        DataFrame: Projected, typed rows; a drop-in input of data_reshape.
+    """
+    return pd.concat(iter_prognosis_chunks(path, columns, sheet_name, chunk_size))
+
+
+@instrument.timed('ingest.reshape_stream')
+def reshape_stream(path, no_replicate=False, compact=False, sheet_name=0, chunk_size=100_000):
+    """
+    Reshape a workbook or CSV export chunk by chunk, without holding the raw rows.
+
+    Rows are streamed with iter_prognosis_chunks and every chunk is paired and reshaped
+    on its own. The rows of the last well of a chunk are carried over to the next chunk,
+    so each well is reshaped as a whole; exports must therefore list the rows of a well
+    together (as the factpages exports do), otherwise a ValueError is raised. The result
+    equals data_cleaning.data_reshape (or data_cleaning_no_replicate.data_reshape) of the
+    whole file.
+
+        df = ingest.reshape_stream('merged_exports.xlsx', compact=True)
+
+    Parameters:
+        path (str): '.xlsx'/'.xlsm' workbook or '.csv' export.
+        no_replicate (bool): Build the non-replicated frame (one row per well/prospect).
+        compact (bool): Return compact dtypes (see data_cleaning.compact_frame).
+        sheet_name (str or int): Worksheet of a workbook.
+        chunk_size (int): Rows per chunk.
+
+    Returns:
+        DataFrame: Reshaped frame.
+    """
+    import data_cleaning
+    import data_cleaning_no_replicate
+    reshape = data_cleaning_no_replicate.reshape_pairs if no_replicate else data_cleaning.reshape_pairs
+
+    parts, finished = [], set()
+
+    def close(rows):
+        wells = set(rows['Well name'].dropna())
+        if wells & finished:
+            raise ValueError(f'{path} does not list the rows of each well together '
+                             f'(e.g. {sorted(wells & finished, key=str)[0]!r}); use read_projected')
+        finished.update(wells)
+        parts.append(reshape(data_cleaning.pair_rows(rows)))
+
+    carry = None
+    for chunk in iter_prognosis_chunks(path, READ_COLUMNS, sheet_name, chunk_size):
+        if not no_replicate and len(chunk) and chunk.index[0] == 0:
+            # data_reshape drops the first row (the description row of the workbook).
+            chunk = chunk.iloc[1:]
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        wells = chunk['Well name']
+        named = wells.dropna()
+        open_rows = (wells == named.iloc[-1]).to_numpy() if len(named) else np.zeros(len(chunk), dtype=bool)
+        carry = chunk[open_rows]
+        close(chunk[~open_rows])
+    if carry is not None and len(carry):
+        close(carry)
+
+    df = pd.concat(parts, ignore_index=True) if parts else reshape(data_cleaning.pair_rows(
+        pd.DataFrame(columns=READ_COLUMNS)))
+    # Every well was reshaped as a whole, so a stable sort by well restores data_reshape's order.
+    wells = np.array([wp[0] for wp in df['well_prospect']], dtype=object)
+    df = df.iloc[np.argsort(wells, kind='stable')].reset_index(drop=True)
+    return data_cleaning.compact_frame(df) if compact else df
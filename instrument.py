@@ -0,0 +1,239 @@
+import atexit
+import functools
+import json
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Setting NCS_PROFILE=<path.json> switches the instrumentation on for a whole run and
+# writes the records to that file when the interpreter exits (NCS_PROFILE_MEMORY=1 also
+# traces the peak memory of every stage).
+ENV = 'NCS_PROFILE'
+
+_state = {'enabled': False, 'memory': False, 'owns_tracing': False}
+_records = []
+_stack = []
+
+
+def enable(memory=False):
+    """
+    Start recording stages.
+
+    Parameters:
+        memory (bool): Also trace the peak memory allocated by every stage. Tracing
+            allocations slows Python code down several times (figure rendering most),
+            so timings taken with memory=True are inflated. Without it only the peak
+            resident size of the process is recorded.
+    """
+    _state['enabled'] = True
+    _state['memory'] = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _state['owns_tracing'] = True
+
+
+def disable():
+    """Stop recording stages (the records so far are kept)."""
+    _state['enabled'] = False
+    if _state['owns_tracing']:
+        tracemalloc.stop()
+        _state['owns_tracing'] = False
+
+
+def enabled():
+    return _state['enabled']
+
+
+def reset():
+    """Forget the records so far."""
+    _records.clear()
+
+
+def records():
+    """Return the finished stage records, in the order they finished."""
+    return list(_records)
+
+
+def add_records(new):
+    """
+    Append records made elsewhere, e.g. returned by a worker process (see run_recorded).
+    Their top-level stages become children of the stage running here.
+    """
+    parent = _stack[-1]['record']['stage'] if _stack else None
+    _records.extend(dict(r, parent=r['parent'] or parent) for r in new)
+
+
+def _max_rss_mb():
+    """Peak resident size of the process so far (Linux reports kB, macOS bytes)."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def _rows(value):
+    """Length of a DataFrame, Series or array; None for anything else (numpy scalars too)."""
+    return len(value) if hasattr(value, 'columns') or getattr(value, 'ndim', 0) > 0 else None
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    """
+    Record wall time, CPU time, peak memory and row counts of a block.
+
+        with instrument.stage('reshape', rows_in=len(data)) as record:
+            df = ...
+            instrument.dropped('missing probability', n)
+            record['rows_out'] = len(df)
+
+    Stages nest: every record names its parent stage. When the instrumentation is
+    disabled the block runs unchanged and the yielded record is None.
+
+    Record fields: 'stage', 'parent', 'pid', 'wall_s', 'cpu_s', 'peak_mb' (peak traced
+    memory above the memory in use when the stage started; None without memory
+    tracing), 'max_rss_mb' (peak resident size of the process when the stage ended),
+    'rows_in', 'rows_out', 'dropped' (rows removed per reason) and any fields added with
+    annotate.
+    """
+    if not _state['enabled']:
+        yield None
+        return
+    record = {
+        'stage': name,
+        'parent': _stack[-1]['record']['stage'] if _stack else None,
+        'pid': os.getpid(),
+        'wall_s': None,
+        'cpu_s': None,
+        'peak_mb': None,
+        'max_rss_mb': None,
+        'rows_in': rows_in,
+        'rows_out': None,
+        'dropped': {},
+    }
+    tracing = _state['memory'] and tracemalloc.is_tracing()
+    frame = {'record': record, 'peak': 0}
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        if _stack:
+            # Keep the enclosing stage's peak before restarting the peak for this one.
+            _stack[-1]['peak'] = max(_stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        frame['start'] = current
+    _stack.append(frame)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = time.perf_counter() - wall
+        record['cpu_s'] = time.process_time() - cpu
+        record['max_rss_mb'] = _max_rss_mb()
+        _stack.pop()
+        if tracing and tracemalloc.is_tracing():
+            peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            record['peak_mb'] = max(peak - frame['start'], 0) / 2 ** 20
+            if _stack:
+                _stack[-1]['peak'] = max(_stack[-1]['peak'], peak)
+        _records.append(record)
+
+
+def timed(name):
+    """
+    Decorator recording every call of a function as a stage.
+
+    rows_in is the length of the first DataFrame/array argument and rows_out the length
+    of a DataFrame/array result.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _state['enabled']:
+                return func(*args, **kwargs)
+            rows_in = next((_rows(a) for a in args if _rows(a) is not None), None)
+            with stage(name, rows_in) as record:
+                result = func(*args, **kwargs)
+                record['rows_out'] = _rows(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def dropped(reason, count):
+    """Add rows removed for `reason` to the innermost running stage."""
+    if _state['enabled'] and _stack:
+        counts = _stack[-1]['record']['dropped']
+        counts[reason] = counts.get(reason, 0) + int(count)
+
+
+def annotate(**fields):
+    """Add fields (e.g. cache hits) to the innermost running stage."""
+    if _state['enabled'] and _stack:
+        _stack[-1]['record'].update(fields)
+
+
+def run_recorded(profile, func, *args):
+    """
+    Call func(*args), recording its stages when profile is true; return (result, records).
+
+    Meant for worker processes: the records are passed back to the parent, which adds
+    them with add_records.
+    """
+    if not profile:
+        return func(*args), []
+    if not _state['enabled']:
+        enable(memory=profile == 'memory')
+    start = len(_records)
+    result = func(*args)
+    return result, _records[start:]
+
+
+def profile_mode():
+    """The profile argument for run_recorded in workers: False, True or 'memory'."""
+    if not _state['enabled']:
+        return False
+    return 'memory' if _state['memory'] else True
+
+
+def summary():
+    """Total wall/CPU time, rows and dropped rows, call count and largest peak memory per stage name."""
+    totals = {}
+    for r in _records:
+        t = totals.setdefault(r['stage'], {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'peak_mb': None,
+                                           'max_rss_mb': None, 'rows_in': 0, 'rows_out': 0, 'dropped': {}})
+        t['calls'] += 1
+        t['wall_s'] += r['wall_s']
+        t['cpu_s'] += r['cpu_s']
+        if r['peak_mb'] is not None:
+            t['peak_mb'] = max(t['peak_mb'] or 0.0, r['peak_mb'])
+        if r['max_rss_mb'] is not None:
+            t['max_rss_mb'] = max(t['max_rss_mb'] or 0.0, r['max_rss_mb'])
+        t['rows_in'] += r['rows_in'] or 0
+        t['rows_out'] += r['rows_out'] or 0
+        for reason, n in r['dropped'].items():
+            t['dropped'][reason] = t['dropped'].get(reason, 0) + n
+    return totals
+
+
+def to_json(path=None):
+    """
+    Return the records and their per-stage summary as JSON, also written to path if given.
+    """
+    text = json.dumps({'records': _records, 'summary': summary()}, indent=1, default=str)
+    if path:
+        with open(path, 'w') as f:
+            f.write(text)
+    return text
+
+
+if os.environ.get(ENV):
+    enable(memory=os.environ.get(f'{ENV}_MEMORY', '0') == '1')
+    # Worker processes hand their records to the parent instead of writing the file.
+    if multiprocessing.parent_process() is None:
+        atexit.register(lambda: to_json(os.environ[ENV]))
@@ -0,0 +1,240 @@
+import numpy as np
+import pandas as pd
+
+import instrument
+import verification
+
+
+def _pool(weights, sums, segments):
+    """
+    Pool adjacent violators within every segment in a single left-to-right pass.
+
+    Blocks are kept on a stack; a new point is pooled with the blocks before it while
+    their mean is not below its own, so every point is pushed and popped at most once
+    and the pass is linear in the number of points.
+
+    Parameters:
+        weights (array): Weight of every point, in fitting order.
+        sums (array): Weighted sum of the values of every point.
+        segments (array): Segment of every point (segments are contiguous); blocks are
+            never pooled across segments.
+
+    Returns:
+        ndarray: Fitted (non-decreasing within each segment) value of every point.
+    """
+    block_w, block_s, block_start, block_seg = [], [], [], []
+    for start, (w, s, seg) in enumerate(zip(weights.tolist(), sums.tolist(), segments.tolist())):
+        # Pool while the previous block of the segment has a mean >= this one.
+        while block_w and block_seg[-1] == seg and block_s[-1] * w >= s * block_w[-1]:
+            w += block_w.pop()
+            s += block_s.pop()
+            start = block_start.pop()
+            block_seg.pop()
+        block_w.append(w)
+        block_s.append(s)
+        block_start.append(start)
+        block_seg.append(seg)
+    lengths = np.diff(np.append(block_start, len(weights)))
+    return np.repeat(np.divide(block_s, block_w), lengths)
+
+
+def pav(values, weights=None):
+    """
+    Isotonic (non-decreasing) least-squares fit of values, in the given order.
+
+    Parameters:
+        values (array): Values ordered by the variable they should increase with.
+        weights (array): Weight of every value (default: 1).
+
+    Returns:
+        ndarray: Fitted values.
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=float)
+    if not len(values):
+        return values
+    return _pool(weights, weights * values, np.zeros(len(values), dtype=int))
+
+
+def calibration_points(probs, outcomes, cells=None):
+    """
+    Fit the CORP calibration curve of every cell of forecasts.
+
+    The forecasts are sorted by (cell, probability), equal forecasts of a cell are pooled
+    into one point (so ties get one calibrated value) and the pool-adjacent-violators
+    pass runs over all cells at once, never pooling across cells.
+
+    Parameters:
+        probs (array): Forecast probabilities.
+        outcomes (array): Binary outcomes.
+        cells (array): Cell of every forecast, e.g. from verification.stacked_forecasts
+            (default: one cell).
+
+    Returns:
+        dict: Arrays with one entry per distinct (cell, forecast): 'cell', 'forecast',
+        'count', 'succ' (successes) and 'calibrated' (the isotonic recalibrated
+        probability), sorted by cell and forecast.
+    """
+    probs = verification.as_probabilities(probs)
+    outcomes = np.asarray(outcomes, dtype=float)
+    cells = np.zeros(len(probs), dtype=int) if cells is None else np.asarray(cells)
+    if np.isnan(probs).any():
+        raise ValueError('Forecast probabilities must not be NaN')
+    order = np.lexsort((probs, cells))
+    probs, outcomes, cells = probs[order], outcomes[order], cells[order]
+
+    # First forecast of every distinct (cell, forecast).
+    new = np.ones(len(probs), dtype=bool)
+    new[1:] = (cells[1:] != cells[:-1]) | (probs[1:] != probs[:-1])
+    starts = np.flatnonzero(new)
+    count = np.diff(np.append(starts, len(probs))).astype(float)
+    succ = np.add.reduceat(outcomes == 1, starts).astype(float) if len(starts) else np.zeros(0)
+    return {
+        'cell': cells[starts],
+        'forecast': probs[starts],
+        'count': count,
+        'succ': succ,
+        'calibrated': _pool(count, succ, cells[starts]) if len(starts) else np.zeros(0),
+    }
+
+
+def decomposition_from_points(points, n_cells):
+    """
+    Compute the CORP decomposition of the Brier score from calibration points.
+
+    With S the Brier score of the forecasts, S_c that of the recalibrated forecasts and
+    S_r that of the climatological forecast (the success rate of the cell),
+
+        MCB = S - S_c (miscalibration), DSC = S_r - S_c (discrimination), UNC = S_r
+
+    so that S = MCB - DSC + UNC holds exactly. MCB and DSC are never negative: the
+    isotonic fit is the best-scoring non-decreasing function of the forecasts, and both
+    the forecasts themselves and the constant success rate are such functions.
+
+    Parameters:
+        points (dict): Output of calibration_points.
+        n_cells (int): Number of cells.
+
+    Returns:
+        dict: Arrays of length n_cells 'n', 'brier', 'mcb', 'dsc', 'unc' and 'skill'
+        (1 - S / UNC = (DSC - MCB) / UNC). Cells without forecasts get NaN measures.
+    """
+    cell, p, c = points['cell'], points['forecast'], points['calibrated']
+    count, succ = points['count'], points['succ']
+
+    def per_cell(weights):
+        return np.bincount(cell, weights=weights, minlength=n_cells)
+
+    # With binary outcomes, sum((f - y)^2) over a point is n f^2 - 2 f succ + succ.
+    n = per_cell(count)
+    total_succ = per_cell(succ)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        brier = per_cell(count * p ** 2 - 2 * p * succ + succ) / n
+        recalibrated = per_cell(count * c ** 2 - 2 * c * succ + succ) / n
+        success_mean = total_succ / n
+        unc = success_mean * (1 - success_mean)
+        skill = np.where(unc > 0, 1 - brier / np.where(unc > 0, unc, 1), 0.0)
+    skill = np.where(n > 0, skill, np.nan)
+    return {
+        'n': n.astype(int),
+        'brier': brier,
+        'mcb': brier - recalibrated,
+        'dsc': unc - recalibrated,
+        'unc': unc,
+        'skill': skill,
+    }
+
+
+def corp_decomposition(probs, outcomes):
+    """
+    Fit the CORP calibration curve of one set of forecasts and decompose its Brier score.
+
+    Parameters:
+        probs (array): Forecast probabilities.
+        outcomes (array): Binary outcomes.
+
+    Returns:
+        dict: The curve ('forecast', 'calibrated' and 'count' per distinct forecast) and
+        the measures 'n', 'brier', 'mcb', 'dsc', 'unc' and 'skill' as floats (see
+        decomposition_from_points).
+    """
+    points = calibration_points(probs, outcomes)
+    measures = decomposition_from_points(points, 1)
+    result = {name: points[name] for name in ('forecast', 'calibrated', 'count')}
+    result.update({name: values[0].item() for name, values in measures.items()})
+    return result
+
+
+def _fit(df, by, years, features):
+    by = list(by)
+    features = list(verification.FEATURES) if features is None else list(features)
+    codes, index = verification.group_codes(df, by, years)
+    probs, outcomes, cells = verification.stacked_forecasts(df, codes, features)
+    return by, features, index, calibration_points(probs, outcomes, cells)
+
+
+def _keys(by, index, features, cell):
+    """Grouping keys and feature of every cell number in cell."""
+    n_features = len(features)
+    if by:
+        table = index.to_frame(index=False).iloc[cell // n_features].reset_index(drop=True)
+    else:
+        table = pd.DataFrame(index=range(len(cell)))
+    table['feature'] = np.asarray(features, dtype=object)[cell % n_features]
+    return table
+
+
+@instrument.timed('isotonic.corp_table')
+def corp_table(df, by=('period',), years=None, features=None):
+    """
+    Compute the binning-free CORP decomposition for every group and feature.
+
+    Unlike verification.metrics_table no reliability bins are used: the calibration
+    curve of every (group, feature) cell is the isotonic regression of the outcomes on
+    the forecasts, fitted for all cells in one pool-adjacent-violators pass, so the
+    measures do not depend on bin edges.
+
+        corp_table(df_npd, by=['period', 'result NPD play'], years=[1990, 2006, 2023])
+
+    Parameters:
+        df (DataFrame): Reshaped frame (optionally mapped with map_npd).
+        by (list): Grouping columns, e.g. 'period', 'result NPD play'.
+        years (list): Period edges, required when grouping by 'period'.
+        features (list): Features to score (default: Technical, Reservoir, Source, Trap).
+
+    Returns:
+        DataFrame: Long-format table with the grouping keys, 'feature', 'n', 'brier',
+        'mcb', 'dsc', 'unc' and 'skill' (see decomposition_from_points). Groups without
+        forecasts are left out.
+    """
+    by, features, index, points = _fit(df, by, years, features)
+    n_cells = len(index) * len(features)
+    measures = decomposition_from_points(points, n_cells)
+    table = _keys(by, index, features, np.arange(n_cells))
+    for name, values in measures.items():
+        table[name] = values
+    return table[table['n'] > 0].reset_index(drop=True)
+
+
+@instrument.timed('isotonic.corp_curves')
+def corp_curves(df, by=('period',), years=None, features=None):
+    """
+    Return the CORP calibration curves of every group and feature as a long table.
+
+    Parameters:
+        df (DataFrame): Reshaped frame (optionally mapped with map_npd).
+        by (list): Grouping columns, e.g. 'period', 'result NPD play'.
+        years (list): Period edges, required when grouping by 'period'.
+        features (list): Features to fit (default: Technical, Reservoir, Source, Trap).
+
+    Returns:
+        DataFrame: One row per distinct forecast of every group and feature, with the
+        grouping keys, 'feature', 'forecast', 'count', 'succ' and 'calibrated', sorted
+        by group, feature and forecast.
+    """
+    by, features, index, points = _fit(df, by, years, features)
+    table = _keys(by, index, features, points['cell'])
+    for name in ('forecast', 'count', 'succ', 'calibrated'):
+        table[name] = points[name]
+    table['count'] = table['count'].astype(int)
+    return table
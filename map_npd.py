@@ -1,59 +1,167 @@
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
 
-def map_npd(df):
+import instrument
+
+# Versioned play -> region table shipped with the code (columns: play, region, match).
+PLAY_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'npd_play_regions.csv')
+
+# Columns holding NPD plays.
+PLAY_COLUMNS = ['result NPD play', 'prognosis NPD play']
+
+
+class PlayRegionIndex:
+    """
+    Lookup index of a play -> region table.
+
+    Exact rules are kept in a dict and prefix rules are tried longest first, so every
+    distinct play is resolved once; exact rules win over prefix rules.
+    """
+
+    def __init__(self, table, version=None):
+        table = table.assign(play=table['play'].str.strip().str.lower(),
+                             match=table['match'].str.strip().str.lower())
+        unknown = set(table['match']) - {'exact', 'prefix'}
+        if unknown:
+            raise ValueError(f'Unknown match kind(s) in play table: {sorted(unknown)}')
+        exact = table[table['match'] == 'exact']
+        prefix = table[table['match'] == 'prefix']
+        self.version = version
+        self.regions = list(dict.fromkeys(table['region']))
+        self.exact = dict(zip(exact['play'], exact['region']))
+        self.prefixes = sorted(zip(prefix['play'], prefix['region']), key=lambda rule: -len(rule[0]))
+
+    def region(self, play):
+        """Return the region of a lowercased play, or None if no rule matches."""
+        if play in self.exact:
+            return self.exact[play]
+        for prefix, region in self.prefixes:
+            if play.startswith(prefix):
+                return region
+        return None
+
+
+@lru_cache(maxsize=None)
+def _load_index(path, mtime):
+    with open(path) as f:
+        header = f.readline()
+    version = re.search(r'version\s+(\S+)', header) if header.startswith('#') else None
+    table = pd.read_csv(path, comment='#', dtype=str)
+    return PlayRegionIndex(table, version.group(1) if version else None)
+
+
+def load_play_index(path=None):
+    """
+    Load the play -> region lookup index (cached until the table file changes).
+
+    Parameters:
+        path (str): Play table CSV (default: npd_play_regions.csv next to this module).
+
+    Returns:
+        PlayRegionIndex: The lookup index.
+    """
+    path = os.path.abspath(path or PLAY_TABLE)
+    return _load_index(path, os.path.getmtime(path))
+
+
+def _lookup(values, index):
+    """
+    Lowercase and map the distinct values of a column.
+
+    Returns the factorized codes, the distinct lowercased values and their regions
+    (None where no rule matches), or None if the column holds unhashable values (lists).
+    """
+    try:
+        codes, uniques = pd.factorize(values)
+    except TypeError:
+        return None
+    lowered = [u.lower() if isinstance(u, str) else u for u in uniques]
+    regions = [index.region(u) if isinstance(u, str) else None for u in lowered]
+    return codes, lowered, regions
+
+
+def map_column(values, index=None):
+    """
+    Map a column of plays to their region.
+
+    Every distinct play is looked up once. Plays without a matching rule are kept
+    (lowercased) and missing values stay missing, as before. Columns holding lists of
+    plays (data_cleaning_no_replicate) are returned unchanged.
+
+    Parameters:
+        values (Series): Play names.
+        index (PlayRegionIndex): Lookup index (default: load_play_index()).
+
+    Returns:
+        Series: Categorical regions (the table's regions come first among the categories).
+    """
+    index = index or load_play_index()
+    found = _lookup(values, index)
+    if found is None:
+        return values
+    codes, lowered, regions = found
+    mapped = [r if r is not None else u for u, r in zip(lowered, regions)]
+    categories = index.regions + sorted({m for m in mapped if m not in index.regions}, key=str)
+    position = {c: i for i, c in enumerate(categories)}
+    new_codes = np.array([position[m] for m in mapped] + [-1], dtype=int)[codes]
+    return pd.Series(pd.Categorical.from_codes(new_codes, categories), index=values.index, name=values.name)
+
+
+def unmapped_plays(df, index=None, columns=PLAY_COLUMNS):
+    """
+    Report the plays that no rule of the play table matches.
+
+    Parameters:
+        df (DataFrame): Reshaped frame (before map_npd).
+        index (PlayRegionIndex): Lookup index (default: load_play_index()).
+        columns (list): Play columns to check.
+
+    Returns:
+        DataFrame: 'column', 'play' (lowercased) and 'count' of every unmapped play,
+        most frequent first.
+    """
+    index = index or load_play_index()
+    report = []
+    for column in columns:
+        found = _lookup(df[column], index)
+        if found is None:
+            # Lists of plays: check the flattened values.
+            found = _lookup(df[column].explode().reset_index(drop=True), index)
+        codes, lowered, regions = found
+        counts = np.bincount(codes[codes >= 0], minlength=len(lowered))
+        for play, region, count in zip(lowered, regions, counts):
+            if region is None and isinstance(play, str):
+                report.append((column, play, count))
+    report = pd.DataFrame(report, columns=['column', 'play', 'count'])
+    return report.sort_values(['count', 'column', 'play'], ascending=[False, True, True], ignore_index=True)
+
+
+@instrument.timed('map_npd.map_npd')
+def map_npd(df, table=None):
     """
     this function map npd plays to their region (north, norwegian, or barent sea)
 
+    The plays are mapped with the rules of a play -> region table (npd_play_regions.csv
+    by default); see unmapped_plays for the plays the table does not cover.
+
     """
+    index = load_play_index(table)
+
     # Create a copy of the input DataFrame to avoid modifying the original data.
     df_info = df.copy()
 
-    # Convert string values to lowercase in the specified columns.
-    df_info['result NPD play'] = df_info['result NPD play'].apply(
-        lambda x: x.lower() if isinstance(x, str) else x
-    )
-    df_info['prognosis NPD play'] = df_info['prognosis NPD play'].apply(
-        lambda x: x.lower() if isinstance(x, str) else x
-    )
-
     # Reset the index and drop the old index.
     df_info.reset_index(drop=True, inplace=True)
 
-    # Define the lists of plays corresponding to each region.
-    north_sea = [
-        'neo/frigg-1', 'neo/grid-1', 'nol-1', 'npc-1', 'npc-2', 'npc-3', 'npc-4', 'npc-5',
-        'nsbku-1', 'nkl-2', 'nku-2', 'nku-3', 'nku-4', 'nku-5', 'nju-1', 'nju-2', 'nju-3',
-        'njl,jm-1', 'njl,jm-2', 'njl,jm-3', 'njl,jm-4', 'njl,jm-5', 'njm-1', 'nru,jm-1',
-        'npl-1', 'npl-2', 'nkl-x', 'nku-x', 'nmi-1', 'nju-'
-    ]
-    
-    norwegian_sea = [
-        'nhjj-x', 'nhru-x', 'nheo-x', 'nhplei-1', 'nhpc-1', 'nhpc-2', 'nhpc-4', 'nhku-2',
-        'nhku-3', 'nhku-4', 'nhku-5', 'nhku-6', 'nhkl-2', 'nhkl-3', 'nhju-1', 'nhju-2',
-        'nhjm-1', 'nhjl,jm-1', 'nhjl,jm-2', 'nhjl,jm-3', 'nhpp,rr-1', 'nhpe-x', 'hju-1'
-    ]
-    
-    barents_sea = [
-        'beo-1', 'bpc-1', 'bju,kl-3', 'bku-x', 'bjl,jm-5', 'bjl,jm-6', 'bjl,jm-7', 'brl,rm-4',
-        'brl,rm-5', 'brl-1', 'bru-1', 'bru-2', 'bpm,pu-4', 'bpm,pu-5', 'bpm,pu-7', 'bpu-4',
-        'bcu,pl-3', 'bcu,pl-4', 'bcu,pp-4', 'bcu,pp-5', 'bcu,pp-7', 'bcl-3', 'bcl-4',
-        'bpu-x', 'bpl-x'
-    ]
-
-    # Helper function to map a play value to its region.
-    def map_region(value):
-        if isinstance(value, str):
-            if value in north_sea:
-                return 'north sea'
-            elif value in norwegian_sea:
-                return 'norwegian sea'
-            elif value in barents_sea:
-                return 'barents sea'
-        return value
-
     # Apply the mapping to both 'result NPD play' and 'prognosis NPD play' columns.
-    df_info['result NPD play'] = df_info['result NPD play'].apply(map_region)
-    df_info['prognosis NPD play'] = df_info['prognosis NPD play'].apply(map_region)
+    for column in PLAY_COLUMNS:
+        df_info[column] = map_column(df_info[column], index)
+        if instrument.enabled():
+            instrument.annotate(**{f'{column} unmapped': int((~df_info[column].isin(index.regions)
+                                                              & df_info[column].notna()).sum())})
 
     return df_info
-
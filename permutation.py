@@ -0,0 +1,209 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import instrument
+import verification
+
+CORRECTIONS = ('holm', 'bh')
+
+
+def adjust_pvalues(pvalues, method='holm'):
+    """
+    Adjust p-values for multiple comparisons.
+
+    Parameters:
+        pvalues (array): P-values of one family of tests; NaN entries are left out of
+            the family and stay NaN.
+        method (str): 'holm' (Holm-Bonferroni, controls the family-wise error rate) or
+            'bh' (Benjamini-Hochberg, controls the false discovery rate).
+
+    Returns:
+        ndarray: Adjusted p-values, in the order of pvalues.
+    """
+    if method not in CORRECTIONS:
+        raise ValueError(f'Unknown correction {method!r} (use one of {CORRECTIONS})')
+    pvalues = np.asarray(pvalues, dtype=float)
+    adjusted = np.full(len(pvalues), np.nan)
+    known = np.flatnonzero(~np.isnan(pvalues))
+    m = len(known)
+    if not m:
+        return adjusted
+    order = known[np.argsort(pvalues[known], kind='stable')]
+    ranked = pvalues[order]
+    if method == 'holm':
+        # The i-th smallest (0-based) is multiplied by m - i; adjusted values never decrease.
+        values = np.maximum.accumulate(ranked * (m - np.arange(m)))
+    else:
+        # The i-th smallest is multiplied by m / (i + 1); adjusted values never decrease.
+        values = np.minimum.accumulate((ranked * m / np.arange(1, m + 1))[::-1])[::-1]
+    adjusted[order] = np.minimum(values, 1)
+    return adjusted
+
+
+def _kinds(probs, outcomes, bins, n_bins):
+    """
+    Number the distinct (forecast, outcome) pairs of a test's forecasts.
+
+    Returns:
+        tuple: (kinds, weights) with the kind of every forecast and, per kind, its
+        contribution to the bin statistics (in accumulator.STATS order) as an array of
+        shape (n_kinds, 4, n_bins).
+    """
+    pairs, kinds = np.unique(np.column_stack([probs, outcomes]), axis=0, return_inverse=True)
+    p, y = pairs[:, 0], pairs[:, 1]
+    kinds = kinds.ravel()
+    kind_bins = np.zeros(len(pairs), dtype=int)
+    kind_bins[kinds] = bins
+    weights = np.zeros((len(pairs), 4, n_bins))
+    weights[np.arange(len(pairs)), :, kind_bins] = np.column_stack([np.ones(len(pairs)), p, y, (p - y) ** 2])
+    return kinds, weights
+
+
+def _permute_chunk(kinds, weights, n_a, n_rep, seed, measures, observed):
+    """
+    Count the label shuffles of one test whose difference is at least as large as observed.
+
+    The forecasts of both groups are pooled and every shuffle assigns a random subset of
+    them to the smaller group (the positions of its smallest random keys). The bin
+    statistics of a shuffle only depend on how many forecasts of every (forecast,
+    outcome) kind the subset holds, so all shuffles are counted with a single bincount
+    over (shuffle, kind) cells and turned into statistics with one matrix product. The
+    other group gets the totals minus them.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(kinds)
+    n_kinds, n_stats, n_bins = weights.shape
+    small = min(n_a, n - n_a)
+    subset = np.argpartition(rng.random((n_rep, n)), small - 1, axis=1)[:, :small]
+    cells = (np.arange(n_rep)[:, None] * n_kinds + kinds[subset]).ravel()
+    counts = np.bincount(cells, minlength=n_rep * n_kinds).reshape(n_rep, n_kinds)
+    part = (counts @ weights.reshape(n_kinds, -1)).reshape(n_rep, n_stats, n_bins)
+    totals = np.bincount(kinds, minlength=n_kinds) @ weights.reshape(n_kinds, -1)
+    rest = totals.reshape(n_stats, n_bins) - part
+    first, second = (part, rest) if small == n_a else (rest, part)
+    stats_a = verification.metrics_from_stats(*first.transpose(1, 0, 2))
+    stats_b = verification.metrics_from_stats(*second.transpose(1, 0, 2))
+    # Two-sided; the tolerance keeps shuffles that tie with the observed split from
+    # being lost to rounding.
+    return {m: np.count_nonzero(np.abs(stats_a[m] - stats_b[m]) >= abs(observed[m]) - 1e-12) for m in measures}
+
+
+@instrument.timed('permutation.permutation_tests')
+def permutation_tests(df, compare='period', by=('result NPD play',), years=None, features=None, pairs=None,
+                      n_perm=10000, measures=('brier', 'skill', 'bias'), correction='holm', bins_num=10, width=None,
+                      seed=None, processes=None, max_elements=2_000_000):
+    """
+    Permutation tests of the differences in the verification measures between groups.
+
+    For every stratum of the `by` columns (e.g. every region), every feature and every
+    pair of values of `compare` (e.g. two periods), the forecasts of both groups are
+    pooled and their group labels shuffled n_perm times. The p-value of a measure is the
+    share of shuffles whose |difference| is at least the observed one (two-sided, with
+    the observed split counted as one shuffle). Shuffles are drawn in blocks of at most
+    max_elements shuffled forecasts and spread over worker processes; every block gets
+    its own child of one SeedSequence, so results depend on seed but not on the number
+    of processes. The p-values of each measure are then adjusted over all tests of the
+    table (the whole stratum x feature x pair grid).
+
+        permutation_tests(df_npd, compare='period', by=['result NPD play'], years=[1990, 2006, 2023])
+        permutation_tests(df_npd, compare='result NPD play', by=['period'], years=[1990, 2006, 2023])
+
+    Parameters:
+        df (DataFrame): Reshaped frame (optionally mapped with map_npd).
+        compare (str): Column whose groups are compared, e.g. 'period' or
+            'result NPD play' (see verification.group_codes).
+        by (list): Columns of the strata tested separately.
+        years (list): Period edges, required when compare or by holds 'period'.
+        features (list): Features to test (default: Technical, Reservoir, Source, Trap).
+        pairs (list): (a, b) pairs of compare values to test (default: every pair of
+            values present in a stratum, in sorted order).
+        n_perm (int): Number of label shuffles per test.
+        measures (tuple): Measures to test (see verification.metrics_from_stats).
+        correction (str): 'holm', 'bh' (see adjust_pvalues) or None.
+        bins_num (int): Number of regular bins.
+        width (float): Bin width (default: 1 / bins_num).
+        seed (int): Seed of the random generator.
+        processes (int): Worker processes (default: number of CPUs; 1 runs in-process).
+        max_elements (int): Shuffled forecasts per block.
+
+    Returns:
+        DataFrame: One row per test with the `by` keys, 'feature', '<compare>_a',
+        '<compare>_b', 'n_a', 'n_b' and, for every measure, '<measure>_a', '<measure>_b',
+        '<measure>_diff' (a - b), '<measure>_p' and '<measure>_p_adjusted'.
+    """
+    if correction is not None and correction not in CORRECTIONS:
+        raise ValueError(f'Unknown correction {correction!r} (use one of {CORRECTIONS} or None)')
+    by = list(by)
+    measures = list(measures)
+    features = list(verification.FEATURES) if features is None else list(features)
+    n_features = len(features)
+    codes, index = verification.group_codes(df, by + [compare], years)
+    keys = index.to_frame(index=False)
+    stratum = keys.groupby(by, sort=False).ngroup().to_numpy() if by else np.zeros(len(keys), dtype=int)
+    level = keys[compare].to_numpy()
+
+    # Forecasts of every (group, feature) cell, as in bootstrap.bootstrap_metrics.
+    probs, outcomes, cells = verification.stacked_forecasts(df, codes, features)
+    bins = verification.bin_index(probs, bins_num, width)
+    order = np.argsort(cells, kind='stable')
+    bounds = np.searchsorted(cells[order], np.arange(len(keys) * n_features + 1))
+    stats = verification.metrics_from_stats(
+        **verification.bin_statistics(probs, outcomes, cells, len(keys) * n_features, bins_num, width))
+
+    # Tests as (cell a, cell b): groups of one stratum, compared feature by feature.
+    wanted = None if pairs is None else {tuple(p) for p in pairs}
+    tests = []
+    for s in np.unique(stratum):
+        groups = np.flatnonzero(stratum == s)
+        for f in range(n_features):
+            present = [g for g in groups if bounds[g * n_features + f + 1] > bounds[g * n_features + f]]
+            for a, b in itertools.combinations(present, 2):
+                if wanted is None or (level[a], level[b]) in wanted:
+                    tests.append((a * n_features + f, b * n_features + f))
+                elif (level[b], level[a]) in wanted:
+                    tests.append((b * n_features + f, a * n_features + f))
+    observed = [{m: stats[m][a] - stats[m][b] for m in measures} for a, b in tests]
+
+    # One task per (test, block of shuffles).
+    tasks, test_rows = [], []
+    for t, (a, b) in enumerate(tests):
+        rows = np.concatenate([order[bounds[a]:bounds[a + 1]], order[bounds[b]:bounds[b + 1]]])
+        test_rows.append(rows)
+        chunk = max(1, max_elements // len(rows))
+        for start in range(0, n_perm, chunk):
+            tasks.append((t, bounds[a + 1] - bounds[a], min(chunk, n_perm - start)))
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+    kinds = [_kinds(probs[rows], outcomes[rows], bins[rows], bins_num + 1) for rows in test_rows]
+    args = [(*kinds[t], n_a, n_rep, s, measures, observed[t]) for (t, n_a, n_rep), s in zip(tasks, seeds)]
+
+    workers = processes or os.cpu_count() or 1
+    if workers == 1 or len(tasks) <= 1:
+        results = [_permute_chunk(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_permute_chunk, *zip(*args)))
+
+    exceed = np.zeros((len(tests), len(measures)))
+    for (t, _, _), result in zip(tasks, results):
+        exceed[t] += [result[m] for m in measures]
+
+    cell_a = np.array([a for a, _ in tests], dtype=int)
+    cell_b = np.array([b for _, b in tests], dtype=int)
+    table = keys[by].iloc[cell_a // n_features].reset_index(drop=True) if by else \
+        pd.DataFrame(index=range(len(tests)))
+    table['feature'] = np.asarray(features, dtype=object)[cell_a % n_features]
+    table[f'{compare}_a'] = level[cell_a // n_features]
+    table[f'{compare}_b'] = level[cell_b // n_features]
+    table['n_a'] = stats['n'][cell_a]
+    table['n_b'] = stats['n'][cell_b]
+    for k, m in enumerate(measures):
+        table[f'{m}_a'] = stats[m][cell_a]
+        table[f'{m}_b'] = stats[m][cell_b]
+        table[f'{m}_diff'] = table[f'{m}_a'] - table[f'{m}_b']
+        table[f'{m}_p'] = (exceed[:, k] + 1) / (n_perm + 1)
+        table[f'{m}_p_adjusted'] = adjust_pvalues(table[f'{m}_p'], correction) if correction else table[f'{m}_p']
+    return table
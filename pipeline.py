@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple
+
+import pandas as pd
+
+import ingest
+
+# Bump whenever the stage definitions below change in a way that invalidates old outputs.
+SCHEMA_VERSION = 1
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULTS = {
+    'sheet_name': 0,
+    'years': [1990, 1996, 2002, 2011, 2016, 2022],
+    'npd': False,
+    'by': None,
+    'bins_num': 10,
+    'output_dir': 'figures',
+    'formats': ('pdf',),
+    'ci_method': 'binom',
+    'confidence_level': 0.8,
+    'processes': None,
+}
+
+# deps: upstream stages (or a function of the parameters returning them); params: parameters
+# the stage output depends on; files: source files (code and tables) it depends on.
+Stage = namedtuple('Stage', ['deps', 'params', 'files', 'run'])
+
+
+def _read(p):
+    return ingest.read_prognosis(p['workbook'], sheet_name=p['sheet_name'])
+
+
+def _reshape(p, data):
+    import data_cleaning
+    return data_cleaning.data_reshape(data)
+
+
+def _reshape_no_replicate(p, data):
+    import data_cleaning_no_replicate
+    return data_cleaning_no_replicate.data_reshape(data)
+
+
+def _regions(p, df):
+    import map_npd
+    return map_npd.map_npd(df)
+
+
+def _metrics(p, df):
+    import verification
+    by = p['by'] or (['period', 'result NPD play'] if p['npd'] else ['period'])
+    return verification.metrics_table(df, by=by, years=p['years'], bins_num=p['bins_num'])
+
+
+def _diagrams(p, df):
+    import batch_export
+    kind = 'npd' if p['npd'] else 'all'
+    metrics = batch_export.export_attribute_diagrams(
+        df, p['years'], p['output_dir'], kind=kind, formats=tuple(p['formats']), processes=p['processes'],
+        figure_options={'ci_method': p['ci_method'], 'confidence_level': p['confidence_level']})
+    _, prefix, measures, _ = batch_export.DIAGRAMS[kind]
+    stems = [f'{prefix}_{s}-{e - 1}' for s, e in zip(p['years'][:-1], p['years'][1:])] + [measures]
+    files = [os.path.join(p['output_dir'], f'{stem}.{fmt}') for stem in stems for fmt in p['formats']]
+    return {'metrics': metrics, 'files': files}
+
+
+def _risk(p, df_npd):
+    import batch_export
+    return {'files': batch_export.export_risk_pie_chart(df_npd, p['output_dir'], formats=tuple(p['formats']))}
+
+
+def _reshaped(p):
+    return ('regions',) if p['npd'] else ('reshape',)
+
+
+STAGES = {
+    'data': Stage((), ('workbook', 'sheet_name'), ('ingest.py',), _read),
+    'reshape': Stage(('data',), (), ('data_cleaning.py',), _reshape),
+    'reshape_no_replicate': Stage(('data',), (), ('data_cleaning.py', 'data_cleaning_no_replicate.py'),
+                                  _reshape_no_replicate),
+    'regions': Stage(('reshape',), (), ('map_npd.py', 'npd_play_regions.csv'), _regions),
+    'regions_no_replicate': Stage(('reshape_no_replicate',), (), ('map_npd.py', 'npd_play_regions.csv'), _regions),
+    'metrics': Stage(_reshaped, ('npd', 'by', 'years', 'bins_num'), ('verification.py',), _metrics),
+    'diagrams': Stage(_reshaped, ('npd', 'years', 'output_dir', 'formats', 'ci_method', 'confidence_level'),
+                      ('batch_export.py', 'attribute_subplots.py', 'attribute_npd_subplots.py', 'verification.py',
+                       'confidence.py'), _diagrams),
+    'risk': Stage(('regions_no_replicate',), ('output_dir', 'formats'), ('batch_export.py', 'post_drill_risk.py'),
+                  _risk),
+}
+
+# Stages that write figure files; their output lists the files under 'files'.
+FIGURE_STAGES = {'diagrams', 'risk'}
+
+
+class Pipeline:
+    """
+    Stage-cached run of ingest -> reshape -> region mapping -> metrics/figures.
+
+    Every stage is keyed by a hash of its parameters, the source files it depends on
+    (including the workbook content and the play table) and the keys of its upstream
+    stages. Outputs are written to cache_dir under that key, so a re-run only recomputes
+    the stages whose inputs changed: changing the years recomputes the metrics and
+    figures from the stored reshape without reading the workbook again.
+
+        pipe = Pipeline('PrognosisResultData_Released.xlsx', years=[1990, 2006, 2023], npd=True)
+        table = pipe.run('metrics')
+        pipe.run('diagrams')
+        pipe.log   # [('metrics', 'cached', 0.01), ...]
+
+    Parameters:
+        workbook (str): Prognosis/result workbook.
+        cache_dir (str): Directory of the stage outputs (default: '.pipeline_cache' next to
+            the workbook). The workbook read itself is cached by ingest.read_prognosis, so
+            the 'data' stage is not stored again.
+        **params: Overrides of DEFAULTS (years, npd, by, bins_num, output_dir, formats,
+            ci_method, confidence_level, processes, sheet_name). A relative output_dir is
+            taken from the working directory when the Pipeline is created.
+    """
+
+    def __init__(self, workbook, cache_dir=None, **params):
+        unknown = set(params) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f'Unknown pipeline parameter(s): {sorted(unknown)}')
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(workbook)), '.pipeline_cache')
+        self.cache_dir = cache_dir
+        self.params = dict(DEFAULTS, **params, workbook=workbook)
+        # Figures go to (and are checked in) the same directory whatever the working
+        # directory is when the stages run.
+        self.params['output_dir'] = os.path.abspath(self.params['output_dir'])
+        self.log = []
+        self._keys = {}
+        self._outputs = {}
+
+    def _deps(self, name):
+        deps = STAGES[name].deps
+        return deps(self.params) if callable(deps) else deps
+
+    def key(self, name):
+        """Return the content key of a stage (computed once per Pipeline object)."""
+        if name not in self._keys:
+            stage = STAGES[name]
+            files = [os.path.join(HERE, f) for f in stage.files]
+            if name == 'data':
+                files.append(self.params['workbook'])
+            record = {
+                'schema': SCHEMA_VERSION,
+                'stage': name,
+                'params': {p: self.params[p] for p in stage.params if p != 'workbook'},
+                'files': [ingest.file_hash(f) for f in files],
+                'deps': [self.key(d) for d in self._deps(name)],
+            }
+            blob = json.dumps(record, sort_keys=True, default=list).encode()
+            self._keys[name] = hashlib.sha256(blob).hexdigest()
+        return self._keys[name]
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, f'{name}-{self.key(name)[:16]}.pkl')
+
+    def _is_cached(self, name):
+        path = self._path(name)
+        if not os.path.exists(path):
+            return False
+        if name in FIGURE_STAGES:
+            # Figures count as cached only while every file written by the stage still holds
+            # what the stage wrote: runs with other parameters reuse the same file names.
+            written = pd.read_pickle(path).get('file_hashes')
+            return written is not None and all(os.path.exists(f) and ingest.file_hash(f) == h
+                                               for f, h in written.items())
+        return True
+
+    def run(self, name):
+        """
+        Return the output of a stage, computing it (and its stale upstream stages) if needed.
+
+        Parameters:
+            name (str): Stage name (see STAGES).
+
+        Returns:
+            The stage output; for 'diagrams' a dict with the 'metrics' of the measures plot
+            and the written 'files', for 'risk' a dict with the written 'files'.
+        """
+        if name in self._outputs:
+            return self._outputs[name]
+        start = time.perf_counter()
+        if name != 'data' and self._is_cached(name):
+            output = pd.read_pickle(self._path(name))['output']
+            status = 'cached'
+        else:
+            inputs = [self.run(d) for d in self._deps(name)]
+            start = time.perf_counter()
+            output = STAGES[name].run(self.params, *inputs)
+            status = 'computed'
+            if name != 'data':
+                self._write(name, output)
+        self.log.append((name, status, time.perf_counter() - start))
+        self._outputs[name] = output
+        return output
+
+    def _write(self, name, output):
+        record = {'output': output}
+        if name in FIGURE_STAGES:
+            record['file_hashes'] = {f: ingest.file_hash(f) for f in output['files']}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(name)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        pd.to_pickle(record, tmp)
+        os.replace(tmp, path)
@@ -0,0 +1,217 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import calibration
+import instrument
+import verification
+
+# Simulated per-scenario counts, in the order of the distribution arrays.
+OUTCOMES = ('discoveries', 'reservoir failures', 'source failures', 'trap failures')
+
+FACTORS = ('Reservoir', 'Source', 'Trap')
+
+
+def recalibrate(probs, history, feature, method='binned', bins_num=10, width=None):
+    """
+    Map forecasts through the reliability curve observed for a feature.
+
+    Parameters:
+        probs (array): Forecast probabilities to recalibrate.
+        history (DataFrame): Reshaped frame with the outcomes the curve is fitted on.
+        feature (str): Feature of the forecasts (a key of verification.FEATURES).
+        method (str): 'binned' replaces every forecast by the observed success rate of
+            its reliability bin (bins without history keep the forecast); 'isotonic'
+            interpolates the CORP calibration curve (see calibration.CalibrationModel).
+        bins_num (int): Number of regular bins ('binned' only).
+        width (float): Bin width (default: 1 / bins_num).
+
+    Returns:
+        ndarray: Recalibrated probabilities.
+    """
+    if method not in ('binned', 'isotonic'):
+        raise ValueError(f"Unknown recalibration method {method!r} (use 'binned' or 'isotonic')")
+    model = calibration.CalibrationModel.fit(history, by=(), features=[feature], method=method, min_count=0,
+                                             bins_num=bins_num, width=width)
+    return model.calibrate(probs, feature)
+
+
+def _simulate_chunk(technical, factors, starts, offsets, n_scenarios, seed):
+    """
+    Histograms of the per-group outcome counts of n_scenarios portfolio realizations.
+
+    Discoveries are drawn from the technical probabilities. For every failed prospect
+    the failed factors are drawn from their independent failure probabilities
+    conditioned on at least one factor failing: reservoir first, then source given the
+    reservoir draw, then trap given both (it must fail if the other two succeeded).
+    """
+    rng = np.random.default_rng(seed)
+    n = len(technical)
+    reservoir, source, trap = factors
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # P(reservoir fails | some factor fails) and P(source fails | reservoir ok, some factor fails);
+        # failures of prospects whose factors are all certain are attributed evenly.
+        any_fail = 1 - reservoir * source * trap
+        p_reservoir = np.where(any_fail > 0, (1 - reservoir) / any_fail, 1 / 3)
+        source_or_trap = 1 - source * trap
+        p_source = np.where(source_or_trap > 0, (1 - source) / source_or_trap, 1 / 2)
+    # Single precision halves the cost of drawing and comparing; its 2^-24 resolution is
+    # far below the two-decimal probabilities.
+    technical, p_reservoir, p_source, source_fail, trap_fail = (
+        np.asarray(p, dtype=np.float32) for p in (technical, p_reservoir, p_source, 1 - source, 1 - trap))
+
+    draws = rng.random((n_scenarios, n), dtype=np.float32)
+    failed = draws >= technical
+    rng.random(dtype=np.float32, out=draws)
+    reservoir_failed = failed & (draws < p_reservoir)
+    rng.random(dtype=np.float32, out=draws)
+    source_failed = failed & np.where(reservoir_failed, draws < source_fail, draws < p_source)
+    rng.random(dtype=np.float32, out=draws)
+    other_failed = reservoir_failed | source_failed
+    trap_failed = failed & np.where(other_failed, draws < trap_fail, True)
+
+    size = offsets[-1]
+    hist = np.zeros((len(OUTCOMES), size), dtype=np.int64)
+    group_offsets = offsets[:-1]
+    for k, values in enumerate((~failed, reservoir_failed, source_failed, trap_failed)):
+        # Per-scenario count per group (prospects are sorted by group); summing the
+        # booleans as int8 is several times faster than as bool.
+        counts = np.add.reduceat(values.view(np.int8), starts, axis=1, dtype=np.int32)
+        hist[k] = np.bincount((counts + group_offsets).ravel(), minlength=size)
+    return hist
+
+
+@instrument.timed('portfolio.simulate_portfolio')
+def simulate_portfolio(df, by=('period',), years=None, n_scenarios=100_000, recalibration=None, history=None,
+                       seed=None, processes=None, max_elements=2_000_000):
+    """
+    Simulate the outcomes of drilling every prospect of df, per group, many times.
+
+    Every row of df is one prospect. In every scenario each prospect is a discovery
+    with its Technical probability; the failures are split into reservoir, source and
+    trap failures with the factor probabilities (a failure may involve several
+    factors). The counts per group are accumulated as histograms, so the result does
+    not grow with n_scenarios. Scenarios are drawn in chunks of at most max_elements
+    prospect draws, spread over worker processes; every chunk gets its own child of one
+    SeedSequence, so results depend on seed but not on the number of processes.
+
+        dist = simulate_portfolio(df_npd, by=['period', 'result NPD play'], years=[1990, 2006, 2023],
+                                  n_scenarios=1_000_000, recalibration='isotonic', seed=0)
+        portfolio_summary(dist)
+
+    Parameters:
+        df (DataFrame): Reshaped frame (data_cleaning.data_reshape, optionally mapped
+            with map_npd), one row per prospect.
+        by (list): Grouping columns, e.g. 'period', 'result NPD play' (see
+            verification.group_codes).
+        years (list): Period edges, required when grouping by 'period'.
+        n_scenarios (int): Number of portfolio realizations.
+        recalibration (str): None to use the reported probabilities, or 'binned' or
+            'isotonic' to map them through the observed reliability curves first (see
+            recalibrate).
+        history (DataFrame): Frame the reliability curves are fitted on (default: df).
+        seed (int): Seed of the random generator.
+        processes (int): Worker processes (default: number of CPUs; 1 runs in-process).
+        max_elements (int): Prospect draws per chunk.
+
+    Returns:
+        DataFrame: Distribution of the per-scenario counts: the grouping keys,
+        'outcome' (see OUTCOMES), 'count' (0 to the number of prospects of the group) and
+        'scenarios' (number of scenarios with that count).
+    """
+    by = list(by)
+    codes, index = verification.group_codes(df, by, years)
+    columns = ['Technical'] + list(FACTORS)
+    probs = {f: verification.as_probabilities(df[f'{f} Probability']) for f in columns}
+    if recalibration is not None:
+        history = df if history is None else history
+        probs = {f: recalibrate(p, history, f, recalibration) for f, p in probs.items()}
+
+    # Prospects of every group, sorted by group; rows outside any group or with a
+    # missing probability are left out.
+    valid = (codes >= 0) & ~np.any([np.isnan(p) for p in probs.values()], axis=0)
+    order = np.argsort(np.where(valid, codes, -1), kind='stable')[np.count_nonzero(~valid):]
+    group = codes[order]
+    sizes = np.bincount(group, minlength=len(index))
+    present = np.flatnonzero(sizes)
+    starts = np.searchsorted(group, present)
+    # Histogram layout: group g holds the counts 0 .. sizes[g] at offsets[g] + count.
+    offsets = np.concatenate([[0], np.cumsum(sizes[present] + 1)])
+    technical = np.clip(probs['Technical'][order], 0, 1)
+    factors = np.clip(np.array([probs[f][order] for f in FACTORS]), 0, 1)
+
+    hist = np.zeros((len(OUTCOMES), offsets[-1]), dtype=np.int64)
+    if len(order):
+        chunk = max(1, max_elements // len(order))
+        tasks = [min(chunk, n_scenarios - s) for s in range(0, n_scenarios, chunk)]
+        seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+        args = [(technical, factors, starts, offsets, n, s) for n, s in zip(tasks, seeds)]
+        workers = processes or os.cpu_count() or 1
+        if workers == 1 or len(tasks) <= 1:
+            for a in args:
+                hist += _simulate_chunk(*a)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for result in pool.map(_simulate_chunk, *zip(*args)):
+                    hist += result
+
+    # One row per (group, outcome, count).
+    n_counts = sizes[present] + 1
+    row_group = np.repeat(present, n_counts)
+    count = np.arange(offsets[-1]) - np.repeat(offsets[:-1], n_counts)
+    keys = index.to_frame(index=False).iloc[row_group].reset_index(drop=True) if by else \
+        pd.DataFrame(index=range(len(row_group)))
+    tables = []
+    for k, outcome in enumerate(OUTCOMES):
+        table = keys.copy()
+        table['outcome'] = outcome
+        table['count'] = count
+        table['scenarios'] = hist[k]
+        tables.append(table)
+    table = pd.concat(tables, ignore_index=True)
+    # Order by group, then outcome, then count.
+    order = np.lexsort((table['count'], np.repeat(np.arange(len(OUTCOMES)), len(count)),
+                        np.tile(row_group, len(OUTCOMES))))
+    return table.iloc[order].reset_index(drop=True)
+
+
+def portfolio_summary(distribution, percentiles=(10, 50, 90)):
+    """
+    Summarize a distribution of simulate_portfolio.
+
+    Parameters:
+        distribution (DataFrame): Output of simulate_portfolio.
+        percentiles (tuple): Percentiles of the counts to report.
+
+    Returns:
+        DataFrame: One row per group and outcome with 'prospects', 'mean', 'std',
+        'p<percentile>' for every percentile and, for the factor failures,
+        'share_of_failures' (mean failures involving the factor / mean failures; the
+        shares add up to more than 1 when failures involve several factors).
+    """
+    keys = [c for c in distribution.columns if c not in ('outcome', 'count', 'scenarios')]
+    groups = distribution.groupby(keys, sort=False, observed=True) if keys else [((), distribution)]
+    rows = []
+    for key, group in groups:
+        key = key if isinstance(key, tuple) else (key,)
+        failures = np.nan
+        # Outcomes come in OUTCOMES order, discoveries first.
+        for outcome, part in group.groupby('outcome', sort=False):
+            count = part['count'].to_numpy()
+            weights = part['scenarios'].to_numpy()
+            total = weights.sum()
+            mean = np.dot(count, weights) / total
+            row = dict(zip(keys, key), outcome=outcome, prospects=int(count.max()), mean=mean,
+                       std=np.sqrt(np.dot((count - mean) ** 2, weights) / total))
+            cumulative = np.cumsum(weights) / total
+            for q in percentiles:
+                row[f'p{q}'] = int(count[min(np.searchsorted(cumulative, q / 100), len(count) - 1)])
+            if outcome == 'discoveries':
+                failures = row['prospects'] - mean
+                row['share_of_failures'] = np.nan
+            else:
+                row['share_of_failures'] = mean / failures if failures > 0 else np.nan
+            rows.append(row)
+    return pd.DataFrame(rows)
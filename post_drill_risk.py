@@ -1,50 +1,137 @@
 import numpy as np
-import matplotlib.pyplot as plt
+import pandas as pd
 
-def risk_pie_chart(df_npd):
+import instrument
+import verification
+
+# Geological factors of the failure-reason shares, with their outcome columns.
+FACTORS = {'Reservoir': 'reservoir?', 'Source': 'source?', 'Trap': 'trap?'}
+
+
+def _row_means(values):
+    """
+    Mean probability per row.
+
+    Cells holding the prognoses of a prospect as lists (data_cleaning_no_replicate), or
+    tuples (compact frames), are averaged; missing prognoses are left out.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy()
+        means = _row_means(pd.Series(values.cat.categories.to_numpy(dtype=object)))
+        return np.append(means, np.nan)[codes]
+    cells = values.to_numpy()
+    if cells.dtype != object or not any(isinstance(c, (list, tuple)) for c in cells[:1]):
+        return verification.as_probabilities(cells)
+    lengths = np.fromiter((len(c) for c in cells), dtype=int, count=len(cells))
+    flat = verification.as_probabilities(np.concatenate([np.asarray(c, dtype=float) for c in cells]))
+    rows = np.repeat(np.arange(len(cells)), lengths)
+    valid = ~np.isnan(flat)
+    count = np.bincount(rows[valid], minlength=len(cells))
+    total = np.bincount(rows[valid], weights=flat[valid], minlength=len(cells))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total / count
+
+
+def _shares(rates):
+    """Share of each factor in the failure chance 1 - rate, over the three factors."""
+    failure = 1 - rates
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return failure / failure.sum(axis=1, keepdims=True)
+
+
+@instrument.timed('post_drill_risk.failure_reasons')
+def failure_reasons(df, by=('result NPD play',), years=None, decimals=2):
+    """
+    Post-drill and pre-drill shares of the geological factors in the failure risk, per group.
+
+    The post-drill share of a factor is its observed failure rate 1 - r divided by the sum
+    of the failure rates of reservoir, source and trap; the pre-drill share uses the mean
+    forecast probability of the factor instead of r. All groups and factors are counted in
+    one bincount over (group, factor) cells.
+
+        table = failure_reasons(df_npd, by=['result NPD play', 'period'], years=[1990, 2006, 2023])
+        table.sort_values('post_share', ascending=False)   # main failure causes first
+
+    Parameters:
+        df (DataFrame): Reshaped data (usually data_cleaning_no_replicate, mapped with map_npd).
+        by (list): Grouping columns, e.g. 'result NPD play' (regions after map_npd, or the
+            plays before it) and 'period'.
+        years (list): Period edges, required when grouping by 'period'.
+        decimals (int): Success rates are rounded to this many decimals before the
+            post-drill shares are taken, as risk_pie_chart always did (None keeps them exact).
+
+    Returns:
+        DataFrame: One row per group and factor with the grouping keys, 'factor', 'n'
+        (rows in the group), 'successes' and 'failures' (rows with the factor reported
+        OK or FAIL), 'success_rate' (0 without reports), 'post_share', 'mean_probability'
+        and 'pre_share'.
+    """
+    by = list(by)
+    codes, index = verification.group_codes(df, by, years)
+    inside = codes >= 0
+    n_groups, n_factors = len(index), len(FACTORS)
+
+    outcomes = np.stack([df[c].to_numpy(dtype=float) for c in FACTORS.values()], axis=1)[inside]
+    probs = np.stack([_row_means(df[f'{f} Probability']) for f in FACTORS], axis=1)[inside]
+    cells = codes[inside, None] * n_factors + np.arange(n_factors)
+    size = n_groups * n_factors
+
+    def count(weights):
+        return np.bincount(cells.ravel(), weights=weights.ravel(), minlength=size).reshape(n_groups, n_factors)
+
+    successes = count(outcomes == 1)
+    failures = count(outcomes == 0)
+    reported = successes + failures
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rates = np.where(reported > 0, successes / np.where(reported > 0, reported, 1), 0.0)
+        mean_probability = count(np.nan_to_num(probs)) / count(~np.isnan(probs))
+    post_rates = rates if decimals is None else np.round(rates, decimals)
+
+    if by:
+        table = index.to_frame(index=False).iloc[np.repeat(np.arange(n_groups), n_factors)].reset_index(drop=True)
+    else:
+        table = pd.DataFrame(index=range(n_factors))
+    table['factor'] = np.tile(list(FACTORS), n_groups)
+    table['n'] = np.repeat(np.bincount(codes[inside], minlength=n_groups), n_factors)
+    table['successes'] = successes.ravel().astype(int)
+    table['failures'] = failures.ravel().astype(int)
+    table['success_rate'] = rates.ravel()
+    table['post_share'] = _shares(post_rates).ravel()
+    table['mean_probability'] = mean_probability.ravel()
+    table['pre_share'] = _shares(mean_probability).ravel()
+    return table
+
+
+@instrument.timed('post_drill_risk.risk_pie_chart')
+def risk_pie_chart(df_npd, show=True, kind='post', table=None):
     """
     Analyzes and visualizes the post-drilling risks for different NPD play areas.
     
     Parameters:
     df_npd (DataFrame): Input data containing exploration results and probabilities.
+    show (bool): Display the figure; with False the figure is returned without blocking.
+    kind (str): 'post' for the observed failure reasons, 'pre' for the pre-drill ones
+        (from the forecast probabilities).
+    table (DataFrame): failure_reasons(df_npd) if already computed.
     
     Returns:
-    None (Displays a pie chart visualization of risks per play area).
+    Figure (Displays a pie chart visualization of risks per play area when show is True).
     """
-    feature_obs = ['discovery?', 'reservoir?', 'source?', 'trap?']
-    #feature_prog = ['Technical Probability', 'Reservoir Probability', 'Source Probability', 'Trap Probability']
-    feature_name = ['Reservoir', 'Source', 'Trap']
+    import matplotlib.pyplot as plt
+
+    feature_name = list(FACTORS)
     npd_names = ['north sea', 'norwegian sea', 'barents sea']
     
-    post_risk_all = []
-    num = []
-    
-    for n in npd_names:
-        succ_rate = []
-        avg_prob = []
-        df_play = df_npd[df_npd['result NPD play'] == n]
-        
-        for ff in range(4):
-            disc = df_play[feature_obs[ff]]
-            #probs = df_play[feature_prog[ff]].apply(np.mean)
-            
-            d_yes = (disc == 1).sum()
-            d_no = (disc == 0).sum()
-            
-            #avg_p = np.mean(probs)
-            succ_r = round(d_yes / (d_yes + d_no), 2) if (d_yes + d_no) > 0 else 0
-            
-            succ_rate.append(succ_r)
-            #avg_prob.append(avg_p)
-        
-        #a, b, c = avg_prob[1], avg_prob[2], avg_prob[3]
-        a2, b2, c2 = succ_rate[1], succ_rate[2], succ_rate[3]
-        
-        #pre_risk = [(1-a)/(3-a-b-c), (1-b)/(3-a-b-c), (1-c)/(3-a-b-c)]
-        post_risk = [(1-a2)/(3-a2-b2-c2), (1-b2)/(3-a2-b2-c2), (1-c2)/(3-a2-b2-c2)]
-        
-        post_risk_all.append(post_risk)
-        num.append(len(df_play))
+    if table is None:
+        table = failure_reasons(df_npd, by=['result NPD play'])
+    table = table.astype({'result NPD play': object})
+    shares = table.pivot(index='result NPD play', columns='factor', values=f'{kind}_share')
+    # Regions without wells get equal shares, as before. Regions whose wells never failed
+    # on any factor keep NaN shares: there is no failure to share out, so they get no pie.
+    absent = [n for n in npd_names if n not in shares.index]
+    shares = shares.reindex(index=npd_names, columns=feature_name)
+    shares.loc[absent] = 1 / 3
+    post_risk_all = shares.to_numpy().tolist()
     
     # Plot settings
     fig = plt.figure(figsize=(12, 8))
@@ -52,16 +139,23 @@ def risk_pie_chart(df_npd):
     ax2 = fig.add_axes([0.55, 0.55, 0.35, 0.35])  # Top-right for Norwegian Sea
     ax3 = fig.add_axes([0.33, 0.1, 0.35, 0.35])  # Bottom center for Barents Sea
     
-    fig.suptitle('Main Reason for Failure', fontsize=14, fontweight='normal', y=1.02)
+    title = 'Main Reason for Failure' if kind == 'post' else 'Expected Reason for Failure (pre-drill)'
+    fig.suptitle(title, fontsize=14, fontweight='normal', y=1.02)
     
     axes = [ax1, ax2, ax3]
     for i, ax in enumerate(axes):
-        ax.pie(post_risk_all[i], labels=feature_name, autopct='%1.1f%%', radius=1.5, textprops={'fontsize': 10})
+        if np.isnan(post_risk_all[i]).any():
+            ax.text(0.5, 0.5, 'No failures', ha='center', va='center', fontsize=10, transform=ax.transAxes)
+            ax.axis('off')
+        else:
+            ax.pie(post_risk_all[i], labels=feature_name, autopct='%1.1f%%', radius=1.5, textprops={'fontsize': 10})
         ax.set_title(f'{npd_names[i].capitalize()}', fontsize=12, pad=40)
     
     plt.subplots_adjust(hspace=1, wspace=0.1)
     #plt.savefig(f"Figure_2.pdf")
-    plt.show()
+    if show:
+        plt.show()
+    return fig
     
     
 #risk_pie_chart(df_npd)
\ No newline at end of file
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+
+import instrument
+import verification
+
+
+def window_edges(start, stop, length, step=1):
+    """
+    List the windows of `length` years, stepped by `step`, that fit in [start, stop).
+
+    Parameters:
+        start (int): First year of the first window.
+        stop (int): Year after the last year that windows may cover.
+        length (int): Window length in years.
+        step (int): Years between window starts.
+
+    Returns:
+        list: (first year, year after the last year) of every window.
+    """
+    if length < 1 or step < 1:
+        raise ValueError('Window length and step must be at least one year')
+    return [(s, s + length) for s in range(start, stop - length + 1, step)]
+
+
+@instrument.timed('rolling.rolling_metrics')
+def rolling_metrics(df, length=5, step=1, start=None, stop=None, by=(), features=None, bins_num=10, width=None):
+    """
+    Compute verification measures over rolling windows of years.
+
+    Per-bin statistics are accumulated once per (group, year, feature) and summed
+    cumulatively over the years, so the statistics of every window are the difference of
+    two prefix sums and all windows are scored in one call of
+    verification.metrics_from_stats, however many windows overlap.
+
+        table = rolling_metrics(df, length=5, step=1, start=1990, stop=2024)
+        attribute_subplots.plot_measures(measures_series(table))
+
+    Parameters:
+        df (DataFrame): Reshaped frame (optionally mapped with map_npd).
+        length (int): Window length in years.
+        step (int): Years between window starts.
+        start (int): First year of the first window (default: first completion year).
+        stop (int): Year after the last year covered (default: last completion year + 1).
+        by (list): Grouping columns besides the window, e.g. ['result NPD play'].
+        features (list): Features to score (default: Technical, Reservoir, Source, Trap).
+        bins_num (int): Number of regular bins.
+        width (float): Bin width (default: 1 / bins_num).
+
+    Returns:
+        DataFrame: One row per window, group and feature with 'window' (labelled
+        'start-end' like the attribute_diagram periods), 'start', 'end' (exclusive), the
+        grouping keys, 'feature', 'n' and the measures. Windows without forecasts are kept
+        with n == 0 and NaN measures, so every series has the same windows.
+    """
+    by = list(by)
+    features = list(verification.FEATURES) if features is None else list(features)
+    year = df['year'].to_numpy()
+    start = int(year.min()) if start is None else start
+    stop = int(year.max()) + 1 if stop is None else stop
+    windows = window_edges(start, stop, length, step)
+    n_years, n_features, n_bins = stop - start, len(features), bins_num + 1
+
+    # Cell = (group * n_years + year offset) * n_features + feature.
+    codes, index = verification.group_codes(df, by)
+    offset = year - start
+    inside = (codes >= 0) & (offset >= 0) & (offset < n_years)
+    probs, outcomes, cells = verification.stacked_forecasts(df, np.where(inside, codes * n_years + offset, -1),
+                                                            features)
+    stats = verification.bin_statistics(probs, outcomes, cells, len(index) * n_years * n_features, bins_num, width)
+
+    # Prefix sums over the years, then window = prefix[end] - prefix[start].
+    first = np.array([s - start for s, _ in windows], dtype=int)
+    last = np.array([e - start for _, e in windows], dtype=int)
+    window_stats = {}
+    for name, values in stats.items():
+        values = values.reshape(len(index), n_years, n_features, n_bins)
+        prefix = np.concatenate([np.zeros_like(values[:, :1]), np.cumsum(values, axis=1)], axis=1)
+        window_stats[name] = prefix[:, last] - prefix[:, first]
+    measures = verification.metrics_from_stats(**window_stats)
+
+    # One row per (group, window, feature), in that order.
+    n_groups, n_windows = len(index), len(windows)
+    group = np.repeat(np.arange(n_groups), n_windows * n_features)
+    window = np.tile(np.repeat(np.arange(n_windows), n_features), n_groups)
+    table = pd.DataFrame({
+        'window': [f'{s}-{e - 1}' for s, e in windows],
+        'start': first + start,
+        'end': last + start,
+    }).iloc[window].reset_index(drop=True)
+    if by:
+        keys = index.to_frame(index=False).iloc[group].reset_index(drop=True)
+        table = pd.concat([table, keys], axis=1)
+    table['feature'] = np.tile(features, n_groups * n_windows)
+    for name, values in measures.items():
+        table[name] = values.ravel()
+    return table
+
+
+def measures_series(table, by=None):
+    """
+    Convert a rolling_metrics table to the metrics dict of plot_measures.
+
+    Parameters:
+        table (DataFrame): Output of rolling_metrics.
+        by (list): Grouping columns of the table (default: all columns besides the window,
+            the feature and the measures).
+
+    Returns:
+        dict: Per feature (or per (group keys..., feature) when grouped, e.g.
+        (region, feature) for attribute_npd_subplots.plot_measures), lists of 'brier',
+        'skill', 'bias' and 'time_label' in window order.
+    """
+    if by is None:
+        by = [c for c in table.columns[:list(table.columns).index('feature')] if c not in ('window', 'start', 'end')]
+    metrics = {}
+    for keys, rows in table.groupby(list(by) + ['feature'], sort=False, observed=True):
+        rows = rows.sort_values('start', kind='stable')
+        key = keys[0] if not by else tuple(keys)
+        metrics[key] = {
+            'brier': rows['brier'].tolist(),
+            'skill': rows['skill'].tolist(),
+            'bias': rows['bias'].tolist(),
+            'time_label': rows['window'].tolist(),
+        }
+    return metrics
@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+
+import map_npd
+
+# Roughly the size of the released dataset: wells with at least one prognosis and result.
+BASE_WELLS = 1500
+
+COLUMNS = [
+    'Well name', 'Prospect name', 'Prognosis - Result', 'Completion date', 'NPD Play',
+    'Probability Technical Total', 'Probability Techn Reservoir', 'Probability Techn Source',
+    'Probability Techn Trap', 'Discovery?', 'OK Reservoir?', 'OK Source/ Charge?', 'OK Trap?',
+]
+
+PROSPECT_NAMES = np.array(['Alpha', 'Beta', 'Gamma', 'Delta', 'Epsilon', 'Zeta'])
+REGION_WEIGHTS = {'north sea': 0.55, 'norwegian sea': 0.3, 'barents sea': 0.15}
+
+
+def _choice(rng, n, values, weights):
+    return np.asarray(values, dtype=object)[rng.choice(len(values), n, p=np.asarray(weights) / np.sum(weights))]
+
+
+def _flags(rng, success, yes, no, variants=0.05):
+    """Text flags for boolean outcomes, with a share of lower-case spellings."""
+    flags = np.where(success, yes, no).astype(object)
+    lower = rng.random(len(flags)) < variants
+    flags[lower] = [f.lower() for f in flags[lower]]
+    return flags
+
+
+def make_prognosis_data(scale=1.0, seed=None, description_row=True):
+    """
+    Generate a synthetic PrognosisResultData frame with the columns data_cleaning reads.
+
+    The frame mimics the released data: one result row and one or more prognosis rows per
+    (well, prospect), several prospects per well, NPD plays of the three regions (plus a
+    few unknown and missing plays), YES/NO and OK/FAIL flags in mixed case, missing
+    factor flags for discoveries (the placeholders data_cleaning fills), occasional
+    invalid flags and missing probabilities, and prospects without a reported result.
+    Outcomes are drawn from the forecasts with a small optimism bias, so the verification
+    measures look plausible.
+
+    Parameters:
+        scale (float): Size relative to the released data (1 is about BASE_WELLS wells).
+        seed (int): Seed of the random generator.
+        description_row (bool): Start with a description row, like the workbook (the
+            reshape drops the first row).
+
+    Returns:
+        DataFrame: Raw rows in well order, prognoses before the result of each prospect.
+    """
+    rng = np.random.default_rng(seed)
+    n_wells = max(1, int(round(BASE_WELLS * scale)))
+
+    # Wells: name, completion date and region.
+    quadrant = rng.integers(1, 36, n_wells)
+    block = rng.integers(1, 13, n_wells)
+    well_names = (pd.Series(quadrant).astype(str) + '/' + pd.Series(block).astype(str) + '-'
+                  + pd.Series(np.arange(1, n_wells + 1)).astype(str)).to_numpy(dtype=object)
+    dates = (pd.to_datetime(rng.integers(1985, 2024, n_wells).astype(str), format='%Y')
+             + pd.to_timedelta(rng.integers(0, 365, n_wells), unit='D')).to_numpy()
+    regions = _choice(rng, n_wells, list(REGION_WEIGHTS), list(REGION_WEIGHTS.values()))
+
+    # Prospects: 1-3 per well, each with a play of the well's region.
+    per_well = rng.choice([1, 2, 3], n_wells, p=[0.75, 0.2, 0.05])
+    well = np.repeat(np.arange(n_wells), per_well)
+    n_prospects = len(well)
+    rank = np.arange(n_prospects) - np.repeat(np.cumsum(per_well) - per_well, per_well)
+    index = map_npd.load_play_index()
+    plays = np.empty(n_prospects, dtype=object)
+    for region in REGION_WEIGHTS:
+        in_region = regions[well] == region
+        names = [p.upper() for p, r in index.exact.items() if r == region]
+        plays[in_region] = rng.choice(names, in_region.sum())
+    plays[rng.random(n_prospects) < 0.02] = 'NXX-1'
+    plays[rng.random(n_prospects) < 0.03] = np.nan
+    result_plays = plays.copy()
+    moved = rng.random(n_prospects) < 0.05
+    result_plays[moved] = rng.permutation(plays)[moved]
+
+    # Prognoses: 1-3 per prospect with factor probabilities and their product.
+    per_prospect = rng.choice([1, 2, 3], n_prospects, p=[0.7, 0.22, 0.08])
+    prospect = np.repeat(np.arange(n_prospects), per_prospect)
+    n_prog = len(prospect)
+    factors = np.round(rng.beta([4, 6, 5], [2, 1.5, 2], size=(n_prog, 3)), 2)
+    factors[rng.random((n_prog, 3)) < [0.05, 0.15, 0.05]] = 1.0
+    technical = np.round(factors.prod(axis=1), 2)
+    technical[rng.random(n_prog) < 0.03] = np.nan
+    factors[rng.random((n_prog, 3)) < 0.01] = np.nan
+
+    # Results: outcomes drawn from the first prognosis, slightly less often successful.
+    first = np.cumsum(per_prospect) - per_prospect
+    chance = np.nan_to_num(factors[first], nan=0.7) * 0.9
+    ok = rng.random((n_prospects, 3)) < chance
+    discovery = ok.all(axis=1)
+    flags = [_flags(rng, ok[:, k], 'OK', 'FAIL') for k in range(3)]
+    for k in range(3):
+        # Discoveries mostly leave the factors blank; some flags are missing or unclear.
+        flags[k][discovery & (rng.random(n_prospects) < 0.7)] = np.nan
+        flags[k][~discovery & (rng.random(n_prospects) < 0.02)] = np.nan
+        flags[k][rng.random(n_prospects) < 0.005] = '?'
+    reported = rng.random(n_prospects) < 0.92
+
+    prog = pd.DataFrame({
+        'Well name': well_names[well[prospect]],
+        'Prospect name': PROSPECT_NAMES[rank[prospect]],
+        'Prognosis - Result': _choice(rng, n_prog, ['Prognosis', 'PROGNOSIS'], [0.9, 0.1]),
+        'Completion date': dates[well[prospect]],
+        'NPD Play': plays[prospect],
+        'Probability Technical Total': technical,
+        'Probability Techn Reservoir': factors[:, 0],
+        'Probability Techn Source': factors[:, 1],
+        'Probability Techn Trap': factors[:, 2],
+    })
+    res = pd.DataFrame({
+        'Well name': well_names[well],
+        'Prospect name': PROSPECT_NAMES[rank],
+        'Prognosis - Result': _choice(rng, n_prospects, ['Result', 'RESULT'], [0.9, 0.1]),
+        'Completion date': dates[well],
+        'NPD Play': result_plays,
+        'Discovery?': _flags(rng, discovery, 'YES', 'NO'),
+        'OK Reservoir?': flags[0],
+        'OK Source/ Charge?': flags[1],
+        'OK Trap?': flags[2],
+    })[reported]
+
+    # Wells in random order; prognoses before the result of each prospect.
+    order = rng.permutation(n_wells)
+    prog['_order'] = order[well[prospect]] * 4 + rank[prospect]
+    res['_order'] = order[well[reported]] * 4 + rank[reported]
+    data = pd.concat([prog, res], ignore_index=True)
+    data = data.sort_values('_order', kind='stable').drop(columns='_order')[COLUMNS]
+    if description_row:
+        description = {c: np.nan for c in COLUMNS}
+        description.update({'Well name': 'Wellbore name', 'Prognosis - Result': 'Prognosis or result',
+                            'Completion date': pd.NaT})
+        data = pd.concat([pd.DataFrame([description]).astype(data.dtypes.to_dict(), errors='ignore'), data])
+    return data.reset_index(drop=True)
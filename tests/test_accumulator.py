@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import accumulator
+import synthetic
+
+BY = ['year']
+
+
+@pytest.fixture(scope='module')
+def raw():
+    return synthetic.make_prognosis_data(0.3, seed=0)
+
+
+def _keys(data):
+    return data['Well name'].astype(str) + '/' + data['Prospect name'].astype(str)
+
+
+def _without(data, keys):
+    """Raw rows without the given keys (the description row is kept)."""
+    keep = ~_keys(data).isin(keys)
+    keep.iloc[0] = True
+    return data[keep]
+
+
+def _fresh_metrics(data):
+    store = accumulator.IncrementalMetrics(by=BY)
+    store.update(data)
+    return store.metrics()
+
+
+def _assert_same(actual, expected):
+    pd.testing.assert_frame_equal(actual.reset_index(drop=True), expected.reset_index(drop=True),
+                                  check_exact=False, atol=1e-12)
+
+
+def test_add_change_remove(raw):
+    keys = _keys(raw.iloc[1:]).drop_duplicates()
+    later, dropped = keys.iloc[:15].tolist(), keys.iloc[15:25].tolist()
+    changed = keys.iloc[30:40].tolist()
+
+    first = _without(raw, later)
+    second = _without(raw, dropped).copy()
+    rows = _keys(second).isin(changed) & (second['Prognosis - Result'] == 'Prognosis')
+    second.loc[rows, 'Probability Techn Reservoir'] = 0.55
+
+    store = accumulator.IncrementalMetrics(by=BY)
+    store.update(first)
+    counts = store.update(second)
+    assert counts['added'] == len(later)
+    assert counts['removed'] == len(dropped)
+    assert counts['changed'] == len(set(_keys(second[rows])))
+    _assert_same(store.metrics(), _fresh_metrics(second))
+
+    # An unchanged release is a no-op.
+    assert store.update(second) == {'added': 0, 'changed': 0, 'removed': 0}
+    _assert_same(store.metrics(), _fresh_metrics(second))
+
+
+def test_save_load_then_update(raw, tmp_path):
+    keys = _keys(raw.iloc[1:]).drop_duplicates()
+    store = accumulator.IncrementalMetrics(by=BY)
+    store.update(_without(raw, keys.iloc[:20].tolist()))
+    store.save(tmp_path / 'store.npz')
+
+    loaded = accumulator.IncrementalMetrics.load(tmp_path / 'store.npz')
+    _assert_same(loaded.metrics(), store.metrics())
+    assert loaded.update(raw)['added'] == 20
+    _assert_same(loaded.metrics(), _fresh_metrics(raw))
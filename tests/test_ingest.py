@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+
+import data_cleaning
+import data_cleaning_no_replicate
+import ingest
+import synthetic
+
+
+@pytest.fixture(scope='module')
+def export(tmp_path_factory):
+    path = tmp_path_factory.mktemp('export') / 'export.csv'
+    synthetic.make_prognosis_data(0.2, seed=1).to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.mark.parametrize('no_replicate', [False, True])
+@pytest.mark.parametrize('chunk_size', [2, 17, 64, 100_000])
+def test_reshape_stream_matches_whole_file(export, chunk_size, no_replicate):
+    module = data_cleaning_no_replicate if no_replicate else data_cleaning
+    expected = module.data_reshape(ingest.read_projected(export))
+    actual = ingest.reshape_stream(export, no_replicate=no_replicate, chunk_size=chunk_size)
+    pd.testing.assert_frame_equal(actual, expected.reset_index(drop=True), check_dtype=False)
+
+
+def test_reshape_stream_rejects_split_wells(export, tmp_path):
+    data = pd.read_csv(export)
+    body = data.iloc[1:]
+    first_well = body['Well name'] == body['Well name'].iloc[0]
+    # Move one row of the first well to the end of the file.
+    moved = body[first_well].iloc[[-1]]
+    shuffled = pd.concat([data.iloc[:1], body.drop(moved.index), moved])
+    path = tmp_path / 'split.csv'
+    shuffled.to_csv(path, index=False)
+    with pytest.raises(ValueError, match='together'):
+        ingest.reshape_stream(str(path), chunk_size=50)
+
+
+def test_read_prognosis_cache_invalidation(tmp_path, monkeypatch):
+    path = tmp_path / 'w.xlsx'
+    pd.DataFrame({'a': [1, 2], 'b': ['x', None]}).to_excel(path, index=False)
+    first = ingest.read_prognosis(str(path))
+    assert len(list((tmp_path / '.prognosis_cache').iterdir())) == 1
+
+    # An unchanged workbook is read from the cache.
+    read_excel = pd.read_excel
+    monkeypatch.setattr(pd, 'read_excel', lambda *args, **kwargs: pytest.fail('workbook parsed again'))
+    pd.testing.assert_frame_equal(ingest.read_prognosis(str(path)), first)
+
+    # A changed workbook is parsed again.
+    monkeypatch.setattr(pd, 'read_excel', read_excel)
+    pd.DataFrame({'a': [3], 'b': ['y']}).to_excel(path, index=False)
+    assert ingest.read_prognosis(str(path))['a'].tolist() == [3]
+    assert len(list((tmp_path / '.prognosis_cache').iterdir())) == 2
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import attribute_subplots
+import instrument
+
+
+@pytest.fixture
+def profiling():
+    instrument.reset()
+    instrument.enable()
+    yield
+    instrument.disable()
+    instrument.reset()
+
+
+@instrument.timed('test.identity')
+def _identity(*args):
+    return args[-1]
+
+
+def test_scalar_arguments_are_not_counted(profiling):
+    assert _identity(np.float64(0.45), np.int64(12)) == np.int64(12)
+    assert instrument.records()[-1]['rows_in'] is None
+    assert instrument.records()[-1]['rows_out'] is None
+
+
+def test_profiling_does_not_change_results_for_scalars(profiling):
+    args = (np.float64(0.45), np.int64(12), 0.8)
+    profiled = attribute_subplots.calculate_confidence_intervals(*args)
+    instrument.disable()
+    assert np.allclose(profiled, attribute_subplots.calculate_confidence_intervals(*args))
+
+
+def test_rows_of_frames_and_arrays(profiling):
+    _identity(pd.DataFrame({'a': range(5)}), np.arange(3))
+    record = instrument.records()[-1]
+    assert (record['rows_in'], record['rows_out']) == (5, 3)
+    _identity('workbook.xlsx', np.array(1.0))
+    record = instrument.records()[-1]
+    assert (record['rows_in'], record['rows_out']) == (None, None)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from scipy.optimize import isotonic_regression
+
+import isotonic
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_pav_matches_scipy(seed):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=200).cumsum() * rng.choice([-1, 1])
+    weights = rng.uniform(0.1, 3, size=200)
+    expected = isotonic_regression(values, weights=weights).x
+    assert np.allclose(isotonic.pav(values, weights), expected)
+    assert np.allclose(isotonic.pav(values), isotonic_regression(values).x)
+
+
+def test_pav_empty():
+    assert len(isotonic.pav([])) == 0
+
+
+def test_calibration_points_pool_ties_and_keep_cells_apart():
+    rng = np.random.default_rng(0)
+    probs = rng.choice(np.round(np.linspace(0.05, 0.95, 19), 2), size=3000)
+    outcomes = (rng.random(3000) < probs).astype(float)
+    cells = rng.integers(0, 3, size=3000)
+    points = isotonic.calibration_points(probs, outcomes, cells)
+
+    for cell in range(3):
+        inside = points['cell'] == cell
+        forecast = points['forecast'][inside]
+        assert np.all(np.diff(forecast) > 0)
+        # Per cell: the weighted isotonic fit of the success rate of every distinct forecast.
+        count, succ = points['count'][inside], points['succ'][inside]
+        expected = isotonic_regression(succ / count, weights=count).x
+        assert np.allclose(points['calibrated'][inside], expected)
+        assert count.sum() == np.count_nonzero(cells == cell)
+
+
+def test_corp_decomposition_identity():
+    rng = np.random.default_rng(1)
+    probs = np.round(rng.random(500), 2)
+    outcomes = (rng.random(500) < probs ** 2).astype(float)
+    result = isotonic.corp_decomposition(probs, outcomes)
+    assert result['brier'] == pytest.approx(np.mean((probs - outcomes) ** 2))
+    assert result['brier'] == pytest.approx(result['mcb'] - result['dsc'] + result['unc'])
+    assert result['mcb'] >= 0 and result['dsc'] >= 0
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+import permutation
+
+
+def _holm(p):
+    m = len(p)
+    adjusted, running = np.empty(m), 0.0
+    for i, j in enumerate(np.argsort(p, kind='stable')):
+        running = max(running, min(1.0, (m - i) * p[j]))
+        adjusted[j] = running
+    return adjusted
+
+
+def _bh(p):
+    m = len(p)
+    order = np.argsort(p, kind='stable')
+    adjusted, running = np.empty(m), 1.0
+    for i in range(m - 1, -1, -1):
+        running = min(running, p[order[i]] * m / (i + 1))
+        adjusted[order[i]] = min(running, 1.0)
+    return adjusted
+
+
+@pytest.mark.parametrize('method, reference', [('holm', _holm), ('bh', _bh)])
+def test_adjust_pvalues_matches_reference(method, reference):
+    p = np.random.default_rng(0).random(40) ** 3
+    adjusted = permutation.adjust_pvalues(p, method)
+    assert np.allclose(adjusted, reference(p))
+    assert np.all(adjusted >= p) and np.all(adjusted <= 1)
+
+
+def test_adjust_pvalues_known_values():
+    p = [0.01, 0.04, 0.03, 0.2]
+    assert np.allclose(permutation.adjust_pvalues(p, 'holm'), [0.04, 0.09, 0.09, 0.2])
+    assert np.allclose(permutation.adjust_pvalues(p, 'bh'), [0.04, 0.0533333, 0.0533333, 0.2])
+
+
+def test_adjust_pvalues_leaves_nan_out_of_the_family():
+    p = np.array([0.01, np.nan, 0.02])
+    adjusted = permutation.adjust_pvalues(p, 'holm')
+    assert np.isnan(adjusted[1])
+    assert np.allclose(adjusted[[0, 2]], [0.02, 0.02])
+    assert np.isnan(permutation.adjust_pvalues([np.nan], 'bh')).all()
+
+
+def test_adjust_pvalues_unknown_method():
+    with pytest.raises(ValueError):
+        permutation.adjust_pvalues([0.1], 'bonferroni')
@@ -0,0 +1,52 @@
+import pytest
+
+import pipeline
+import synthetic
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = tmp_path / 'w.xlsx'
+    synthetic.make_prognosis_data(0.1, seed=0).to_excel(path, index=False)
+    return str(path)
+
+
+def _status(pipe):
+    return dict((name, status) for name, status, _ in pipe.log)
+
+
+def test_stages_are_cached_and_invalidated(workbook, tmp_path):
+    options = dict(cache_dir=str(tmp_path / 'cache'), output_dir=str(tmp_path / 'figures'))
+    pipe = pipeline.Pipeline(workbook, years=[1990, 2006, 2023], **options)
+    first = pipe.run('metrics')
+    assert _status(pipe)['metrics'] == 'computed'
+
+    pipe = pipeline.Pipeline(workbook, years=[1990, 2006, 2023], **options)
+    assert pipe.run('metrics').equals(first)
+    assert _status(pipe) == {'metrics': 'cached'}
+
+    # New years recompute the metrics from the stored reshape.
+    pipe = pipeline.Pipeline(workbook, years=[1990, 2000, 2023], **options)
+    pipe.run('metrics')
+    assert _status(pipe) == {'reshape': 'cached', 'metrics': 'computed'}
+
+    # A changed workbook invalidates every stage.
+    synthetic.make_prognosis_data(0.1, seed=1).to_excel(workbook, index=False)
+    pipe = pipeline.Pipeline(workbook, years=[1990, 2000, 2023], **options)
+    pipe.run('metrics')
+    assert _status(pipe) == {'data': 'computed', 'reshape': 'computed', 'metrics': 'computed'}
+
+
+def test_figures_overwritten_by_another_run_are_redrawn(workbook, tmp_path):
+    options = dict(cache_dir=str(tmp_path / 'cache'), output_dir=str(tmp_path / 'figures'), processes=1)
+
+    def diagrams(years):
+        pipe = pipeline.Pipeline(workbook, years=years, **options)
+        pipe.run('diagrams')
+        return _status(pipe)['diagrams']
+
+    assert diagrams([1990, 2006, 2023]) == 'computed'
+    assert diagrams([1990, 2000, 2023]) == 'computed'
+    # measures.pdf now holds the second split, so the first one is drawn again.
+    assert diagrams([1990, 2006, 2023]) == 'computed'
+    assert diagrams([1990, 2006, 2023]) == 'cached'
@@ -0,0 +1,306 @@
+import numpy as np
+import pandas as pd
+
+import instrument
+
+
+def as_probabilities(values):
+    """
+    Return forecast probabilities as float64.
+
+    float32 probabilities (compact frames, see data_cleaning.compact_frame) are rounded
+    back to six decimals, so they bin and score exactly like the float64 values they
+    were made from.
+    """
+    values = np.asarray(values)
+    if values.dtype == np.float32:
+        return np.round(values.astype(float), 6)
+    return values.astype(float)
+
+
+def bin_index(probs, bins_num=10, width=None):
+    """
+    Assign forecast probabilities to reliability bins.
+
+    Bins are `width` wide and left-open, e.g. (0.1 - 0.2]. Probabilities in (0.9, 1) go
+    to the last regular bin and probability 1.0 gets an extra bin (index bins_num).
+
+    Parameters:
+        probs (array): Forecast probabilities.
+        bins_num (int): Number of regular bins.
+        width (float): Bin width (default: 1 / bins_num).
+
+    Returns:
+        ndarray: Bin index of every probability, between 0 and bins_num.
+    """
+    probs = as_probabilities(probs)
+    if np.isnan(probs).any():
+        raise ValueError('Forecast probabilities must not be NaN')
+    if width is None:
+        width = 1 / bins_num
+    bins = np.minimum(np.trunc((probs - 0.001) / width), bins_num - 1).astype(int)
+    bins = np.maximum(bins, 0)
+    bins[(probs > 0.9) & (probs < 1)] = bins_num - 1
+    bins[probs == 1.0] = bins_num
+    return bins
+
+
+def verification_metrics(probs, outcomes, bins_num=10, width=None):
+    """
+    Compute the reliability-diagram bins and verification measures of a set of forecasts.
+
+    Parameters:
+        probs (array): Forecast probabilities.
+        outcomes (array): Observed outcomes (1 for success, 0 for failure).
+        bins_num (int): Number of regular bins.
+        width (float): Bin width (default: 1 / bins_num).
+
+    Returns:
+        dict: Per-bin arrays of length bins_num + 1 ('count_per_bin', 'succ_well_per_bin',
+        'sum_probs_per_bin', 'avg_probs', 'succ_rate_bin', 'bins_mid') and the measures
+        'n', 'success_mean', 'brier', 'rel' (reliability), 'res' (resolution),
+        'unc' (uncertainty), 'variance', 'skill', 'bias' and 'sharpness'.
+    """
+    if width is None:
+        width = 1 / bins_num
+    probs = as_probabilities(probs)
+    discovs = np.asarray(outcomes, dtype=float)
+    bins = bin_index(probs, bins_num, width)
+
+    # Per-bin counts, probability sums and successes.
+    count_per_bin = np.bincount(bins, minlength=bins_num + 1)
+    sum_probs_per_bin = np.bincount(bins, weights=probs, minlength=bins_num + 1)
+    succ_well_per_bin = np.bincount(bins, weights=discovs == 1, minlength=bins_num + 1).astype(int)
+
+    filled = count_per_bin > 0
+    safe_count = np.where(filled, count_per_bin, 1)
+    avg_probs = np.where(filled, sum_probs_per_bin / safe_count, 0)
+    succ_rate_bin = np.where(filled, succ_well_per_bin / safe_count, 0)
+    bins_mid = np.array([round((i + 0.5) * width, 2) for i in range(bins_num)] + [1.0])
+
+    # --- Attribute measures ---
+    success_mean = np.mean(discovs)
+    brier = np.mean((probs - discovs) ** 2)
+    rel = np.sum(count_per_bin[filled] * (avg_probs[filled] - succ_rate_bin[filled]) ** 2) / len(probs)
+    res = np.sum(count_per_bin[filled] * (succ_rate_bin[filled] - success_mean) ** 2) / len(probs)
+    variance = np.var(discovs, ddof=1)
+    skill = (res - rel) / variance if variance > 0 else 0
+    bias = np.mean(probs - discovs)
+    sharpness = np.sqrt(np.mean((probs - np.mean(probs)) ** 2))
+
+    return {
+        'count_per_bin': count_per_bin,
+        'succ_well_per_bin': succ_well_per_bin,
+        'sum_probs_per_bin': sum_probs_per_bin,
+        'avg_probs': avg_probs,
+        'succ_rate_bin': succ_rate_bin,
+        'bins_mid': bins_mid,
+        'n': len(probs),
+        'success_mean': success_mean,
+        'brier': brier,
+        'rel': rel,
+        'res': res,
+        'unc': success_mean * (1 - success_mean),
+        'variance': variance,
+        'skill': skill,
+        'bias': bias,
+        'sharpness': sharpness,
+    }
+
+
+# Forecast probability column prefix -> observed outcome column of the reshaped frame.
+FEATURES = {
+    'Technical': 'discovery?',
+    'Reservoir': 'reservoir?',
+    'Source': 'source?',
+    'Trap': 'trap?',
+}
+
+
+def period_labels(year, years):
+    """
+    Label years with the period they fall in, as used by attribute_diagram.
+
+    Periods run from years[i] to years[i+1] - 1 and are labelled 'start-end'.
+
+    Parameters:
+        year (array): Completion years.
+        years (list): Increasing period edges, e.g. [1990, 1996, 2002].
+
+    Returns:
+        Categorical: Ordered period label per year (NaN outside all periods).
+    """
+    edges = np.asarray(years)
+    labels = [f'{edges[i]}-{edges[i + 1] - 1}' for i in range(len(edges) - 1)]
+    codes = np.searchsorted(edges, np.asarray(year), side='right') - 1
+    codes[(codes < 0) | (codes >= len(labels))] = -1
+    return pd.Categorical.from_codes(codes, categories=labels, ordered=True)
+
+
+def bin_statistics(probs, outcomes, groups, n_groups, bins_num=10, width=None):
+    """
+    Accumulate per-group, per-bin sufficient statistics in one pass.
+
+    Parameters:
+        probs (array): Forecast probabilities.
+        outcomes (array): Binary outcomes.
+        groups (array): Group code (0 .. n_groups - 1) of every forecast.
+        n_groups (int): Number of groups.
+        bins_num (int): Number of regular bins.
+        width (float): Bin width (default: 1 / bins_num).
+
+    Returns:
+        dict: Arrays of shape (n_groups, bins_num + 1): 'count', 'sum_prob' (sum of
+        forecasts), 'succ' (successes) and 'sq_err' (sum of squared errors).
+    """
+    probs = as_probabilities(probs)
+    outcomes = np.asarray(outcomes, dtype=float)
+    n_bins = bins_num + 1
+    cells = np.asarray(groups) * n_bins + bin_index(probs, bins_num, width)
+    size = n_groups * n_bins
+    shape = (n_groups, n_bins)
+    return {
+        'count': np.bincount(cells, minlength=size).reshape(shape),
+        'sum_prob': np.bincount(cells, weights=probs, minlength=size).reshape(shape),
+        'succ': np.bincount(cells, weights=outcomes == 1, minlength=size).reshape(shape),
+        'sq_err': np.bincount(cells, weights=(probs - outcomes) ** 2, minlength=size).reshape(shape),
+    }
+
+
+def metrics_from_stats(count, sum_prob, succ, sq_err):
+    """
+    Compute verification measures from per-bin sufficient statistics.
+
+    The bin axis is the last axis; all leading axes (groups, windows, replicates, ...)
+    are evaluated at once. Outcomes are assumed binary, so the outcome variance follows
+    from the success count. Groups without forecasts get NaN measures.
+
+    Parameters:
+        count (ndarray): Forecasts per bin.
+        sum_prob (ndarray): Sum of forecast probabilities per bin.
+        succ (ndarray): Successes per bin.
+        sq_err (ndarray): Sum of squared forecast errors per bin.
+
+    Returns:
+        dict: Arrays 'n', 'brier', 'rel', 'res', 'unc', 'skill' and 'bias'.
+    """
+    count = np.asarray(count, dtype=float)
+    n = count.sum(axis=-1)
+    total_succ = np.sum(succ, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        safe_count = np.where(count > 0, count, 1)
+        avg_probs = sum_prob / safe_count
+        succ_rate_bin = succ / safe_count
+        success_mean = total_succ / n
+        brier = np.sum(sq_err, axis=-1) / n
+        rel = np.sum(count * (avg_probs - succ_rate_bin) ** 2, axis=-1) / n
+        res = np.sum(count * (succ_rate_bin - success_mean[..., None]) ** 2, axis=-1) / n
+        variance = (total_succ - total_succ * success_mean) / (n - 1)
+        skill = np.where(variance > 0, (res - rel) / np.where(variance > 0, variance, 1), 0.0)
+        bias = (np.sum(sum_prob, axis=-1) - total_succ) / n
+    skill = np.where(n > 0, skill, np.nan)
+    return {
+        'n': n.astype(int),
+        'brier': brier,
+        'rel': rel,
+        'res': res,
+        'unc': success_mean * (1 - success_mean),
+        'skill': skill,
+        'bias': bias,
+    }
+
+
+def group_codes(df, by, years=None):
+    """
+    Number the groups of a reshaped frame.
+
+    Parameters:
+        df (DataFrame): Reshaped frame.
+        by (list): Grouping columns; 'period' groups by the periods defined by years.
+        years (list): Period edges, required when grouping by 'period'.
+
+    Returns:
+        tuple: (codes, index) where codes holds the group number of every row (-1 for rows
+        outside any group) and index the group keys in code order.
+    """
+    keys = {}
+    for key in by:
+        if key == 'period':
+            if years is None:
+                raise ValueError("Grouping by 'period' needs the years argument")
+            keys[key] = period_labels(df['year'], years)
+        else:
+            keys[key] = df[key].to_numpy()
+    if not keys:
+        return np.zeros(len(df), dtype=int), pd.RangeIndex(1)
+    frame = pd.DataFrame(keys)
+    grouped = frame.groupby(list(keys), sort=True, observed=True, dropna=True)
+    codes = grouped.ngroup().to_numpy()
+    return np.where(np.isnan(codes), -1, codes).astype(int), grouped.size().index
+
+
+def stacked_forecasts(df, codes, features):
+    """
+    Stack the forecasts and outcomes of several features into one long array.
+
+    Parameters:
+        df (DataFrame): Reshaped frame.
+        codes (array): Group code of every row (-1 for rows outside any group).
+        features (list): Features to stack.
+
+    Returns:
+        tuple: (probs, outcomes, cells) of the scored forecasts, where
+        cell = group * len(features) + feature. Rows outside any group and forecasts
+        with a missing probability or outcome are left out.
+    """
+    n_features = len(features)
+    probs = np.concatenate([as_probabilities(df[f'{f} Probability']) for f in features])
+    outcomes = np.concatenate([df[FEATURES[f]].to_numpy(dtype=float) for f in features])
+    groups = np.tile(np.asarray(codes), n_features)
+    cells = groups * n_features + np.repeat(np.arange(n_features), len(df))
+    valid = (groups >= 0) & ~np.isnan(probs) & ~np.isnan(outcomes)
+    return probs[valid], outcomes[valid], cells[valid]
+
+
+@instrument.timed('verification.metrics_table')
+def metrics_table(df, by=('period',), years=None, features=None, bins_num=10, width=None):
+    """
+    Compute verification measures for every group and feature in one pass.
+
+    All features are stacked into one long array and accumulated with a single bincount
+    over (group, feature, bin) cells, so no per-group filtering of the frame is needed.
+
+        metrics_table(df_npd, by=['period', 'result NPD play'], years=[1990, 2006, 2023])
+
+    Parameters:
+        df (DataFrame): Reshaped frame (data_cleaning.data_reshape, optionally mapped with map_npd).
+        by (list): Grouping columns, e.g. 'period', 'result NPD play', 'prognosis NPD play'.
+        years (list): Period edges, required when grouping by 'period'.
+        features (list): Features to score (default: Technical, Reservoir, Source, Trap).
+        bins_num (int): Number of regular bins.
+        width (float): Bin width (default: 1 / bins_num).
+
+    Returns:
+        DataFrame: Long-format table with the grouping keys, 'feature', 'n', 'brier', 'rel',
+        'res', 'unc', 'skill' and 'bias'. Groups without forecasts are left out.
+    """
+    by = list(by)
+    features = list(FEATURES) if features is None else list(features)
+    codes, index = group_codes(df, by, years)
+    n_groups, n_features = len(index), len(features)
+
+    # Stack the features: cell = group * n_features + feature.
+    probs, outcomes, cells = stacked_forecasts(df, codes, features)
+    stats = bin_statistics(probs, outcomes, cells, n_groups * n_features, bins_num, width)
+    measures = metrics_from_stats(**stats)
+
+    # One row per (group, feature) cell, in cell order.
+    if by:
+        table = index.to_frame(index=False).iloc[np.repeat(np.arange(n_groups), n_features)]
+        table = table.reset_index(drop=True)
+    else:
+        table = pd.DataFrame(index=range(n_features))
+    table['feature'] = np.tile(features, n_groups)
+    for name, values in measures.items():
+        table[name] = values.ravel()
+    return table[table['n'] > 0].reset_index(drop=True)